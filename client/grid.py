@@ -0,0 +1,129 @@
+from collections import Counter
+
+EMPTY = "~"
+SHIP = "S"
+VIEWPORT = 20  # cells shown per side; larger boards scroll with the cursor
+
+
+class Grid:
+    """A square board kept as {(x, y): cell} for the cells that are not '~'.
+
+    The server sends small boards as rows of cells and large ones as {"size": n, "cells": [[x, y, cell],
+    ...]}; both end up here, so memory follows what is on the board rather than its size, and
+    rendering only visits the cells inside the viewport.
+    """
+
+    def __init__(self, size: int, cells: dict[tuple[int, int], str] | None = None):
+        self.size = size
+        self.cells = cells or {}
+
+    @classmethod
+    def from_wire(cls, value) -> "Grid | None":
+        if value is None:
+            return None
+        if isinstance(value, dict):
+            grid = cls(value["size"])
+            grid.apply(value.get("cells", []))
+            return grid
+        cells = {(x, y): cell for y, row in enumerate(value) for x, cell in enumerate(row) if cell != EMPTY}
+        return cls(len(value), cells)
+
+    def apply(self, cells: list) -> bool:
+        """Apply [x, y, cell] triples from a delta update.
+
+        Returns False if a cell falls outside the board, meaning a full resync is needed.
+        """
+        for x, y, cell in cells:
+            if not (0 <= x < self.size and 0 <= y < self.size):
+                return False
+            if cell == EMPTY:
+                self.cells.pop((x, y), None)
+            else:
+                self.cells[(x, y)] = cell
+        return True
+
+    def origin(self, cursor_x: int, cursor_y: int, span: int = VIEWPORT) -> tuple[int, int]:
+        """Top-left cell of a `span`-wide window that keeps the cursor near its middle."""
+        limit = max(0, self.size - span)
+        return (min(max(0, cursor_x - span // 2), limit), min(max(0, cursor_y - span // 2), limit))
+
+    def render(self, cursor: tuple[int, int] = (0, 0), highlight: bool = True, span: int = VIEWPORT) -> str:
+        """The window around `cursor` as text, with the window's position on boards larger than it."""
+        left, top = self.origin(*cursor, span)
+        right, bottom = min(self.size, left + span), min(self.size, top + span)
+        lines = []
+        for y in range(top, bottom):
+            row = []
+            for x in range(left, right):
+                cell = self.cells.get((x, y), EMPTY)
+                row.append(f"[reverse]{cell}[/reverse]" if highlight and (x, y) == cursor else cell)
+            lines.append(" ".join(row))
+        if self.size > span:
+            lines.append(f"[gray]columns {left}-{right - 1}, rows {top}-{bottom - 1} of {self.size}[/gray]")
+        return "\n".join(lines)
+
+
+class Draft:
+    """The fleet as laid out on this client during placement, sent as one place_ships message.
+
+    Ships go down longest first, as with the server's place_ship, and are checked against the board
+    edges and each other here, so placing and moving them costs no round trips; the server checks
+    the whole layout again when it is confirmed.
+    """
+
+    def __init__(self, size: int, fleet: list[int]):
+        self.size = size
+        self.fleet = fleet
+        self.ships: list[tuple[int, int, int, bool]] = []  # (x, y, length, vertical)
+        self.occupied: dict[tuple[int, int], tuple[int, int, int, bool]] = {}  # {(x, y): ship covering it}
+
+    @staticmethod
+    def cells(x: int, y: int, length: int, vertical: bool) -> list[tuple[int, int]]:
+        return [(x, y + i) if vertical else (x + i, y) for i in range(length)]
+
+    def remaining(self) -> list[int]:
+        """Lengths of the fleet's ships not laid out yet, longest first."""
+        placed = Counter(length for _, _, length, _ in self.ships)
+        remaining = []
+        for length in sorted(self.fleet, reverse=True):
+            if placed[length]:
+                placed[length] -= 1
+            else:
+                remaining.append(length)
+        return remaining
+
+    def place(self, x: int, y: int, vertical: bool = False) -> dict:
+        """Lay out the longest remaining ship with its bow at (x, y).
+
+        Returns a dict containing either an 'error' key or 'ok': True and the [x, y, cell] triples
+        the ship covers, to show on the board until the server confirms them.
+        """
+        remaining = self.remaining()
+        if not remaining:
+            return {"error": "All ships are placed, press C to confirm"}
+        ship = (x, y, remaining[0], vertical)
+        cells = self.cells(*ship)
+        if not all(0 <= cx < self.size and 0 <= cy < self.size for cx, cy in cells):
+            return {"error": "Out of bounds"}
+        if any(cell in self.occupied for cell in cells):
+            return {"error": "Already ship"}
+        self.ships.append(ship)
+        for cell in cells:
+            self.occupied[cell] = ship
+        return {"ok": True, "cells": [[cx, cy, SHIP] for cx, cy in cells]}
+
+    def remove(self, x: int, y: int) -> list | None:
+        """Take away the ship covering (x, y). Returns the [x, y, cell] triples it freed, None if there is none."""
+        ship = self.occupied.get((x, y))
+        if ship is None:
+            return None
+        self.ships.remove(ship)
+        cells = self.cells(*ship)
+        for cell in cells:
+            del self.occupied[cell]
+        return [[cx, cy, EMPTY] for cx, cy in cells]
+
+    def message(self) -> dict:
+        return {"action": "place_ships",
+                "ships": [{"x": x, "y": y, "length": length, "vertical": vertical}
+                          for x, y, length, vertical in self.ships]}
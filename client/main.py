@@ -1,5 +1,4 @@
 import asyncio
-import json
 import logging
 import os
 import platform
@@ -15,13 +14,28 @@ from rich.live import Live
 from rich.panel import Panel
 from rich.table import Table
 
+from grid import VIEWPORT, Draft, Grid
+
+# the wire codecs are shared with the server and live next to this directory
+sys.path.insert(1, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.codec import CODECS, decode, negotiate  # noqa: E402
+
 ezcord.set_log(log_level=logging.DEBUG)
 
 BASE_URI = "hdf-api.geckotv.me"
+# preferred wire format, the server falls back to JSON if it does not support it
+WIRE_FORMAT = os.environ.get("HTF_FORMAT", "msgpack" if "msgpack" in CODECS else "json")
 
 console = Console()
 
 
+wire_codec = negotiate("json")  # replaced by the format the server confirms on connect
+
+
+async def send_message(websocket, payload):
+    await websocket.send(wire_codec.encode(payload))
+
+
 def clear_console():
     if platform.system() == "Windows":
         os.system("cls")
@@ -64,15 +78,15 @@ async def print_welcome_message():
 async def start_menu(player_id: str, websocket):
     while True:
         clear_console()
-        await websocket.send("MENU_start_options")
+        await send_message(websocket, "MENU_start_options")
         data = await websocket.recv()
         if not data.strip():
             print("No data received from server. Retrying...")
             continue
 
         try:
-            options = json.loads(data)["options"]
-        except json.JSONDecodeError:
+            options = decode(data)["options"]
+        except (ValueError, KeyError, TypeError):
             print(f"Received invalid data: {data}")
             continue
 
@@ -96,40 +110,41 @@ async def start_menu(player_id: str, websocket):
                 input_value = await inquirer.text(
                     message=selected_option["input_placeholder"] or "Enter your input:"
                 ).execute_async()
-                await websocket.send(json.dumps({"option": selected_option["id"], "input": input_value}))
+                await send_message(websocket, {"option": selected_option["id"], "input": input_value})
             else:
-                await websocket.send(json.dumps({"option": selected_option["id"]}))
+                await send_message(websocket, {"option": selected_option["id"]})
             break
         else:
             print("Invalid option selected. Please try again.")
 
 
-def format_board(board: list[list[str]]) -> str:
-    lines = []
-    for row in board:
-        lines.append(" ".join(row))
-    return "\n".join(lines)
+OWN_BOARD_VIEWPORT = 10  # cells per side of your own board next to the opponent view during the game
 
 
-def format_board_with_cursor(board: list[list[str]] | None, cursor_x: int, cursor_y: int) -> str:
-    board = board or []
-    lines = []
-    for y, row in enumerate(board):
-        cells = []
-        for x, cell in enumerate(row):
-            if x == cursor_x and y == cursor_y:
-                cells.append(f"[reverse]{cell}[/reverse]")
-            else:
-                cells.append(cell)
-        lines.append(" ".join(cells))
-    return "\n".join(lines)
+def format_board(board: Grid | None, cursor_x: int = 0, cursor_y: int = 0, span: int = VIEWPORT) -> str:
+    """The part of `board` around the cursor, without highlighting it."""
+    return board.render((cursor_x, cursor_y), highlight=False, span=span) if board else ""
+
+
+def format_board_with_cursor(board: Grid | None, cursor_x: int, cursor_y: int) -> str:
+    return board.render((cursor_x, cursor_y)) if board else ""
+
+
+def apply_cells(grid: Grid | None, cells: list) -> bool:
+    """Apply [x, y, cell] triples from a delta update to `grid` in place.
+
+    Returns False if the grid is missing or a cell falls outside it, meaning a full resync is needed.
+    """
+    if grid is None:
+        return not cells
+    return grid.apply(cells)
 
 
 def make_private_lobby_screen(lobby_id: str, players: list[str], logs: list[str], owner_id: str, me: str,
                               game_started: bool = False, placing_phase: bool = False,
                               placement_time_left: int | None = None,
-                              board: list[list[str]] | None = None,
-                              opponent_view: list[list[str]] | None = None,
+                              board: Grid | None = None,
+                              opponent_view: Grid | None = None,
                               cursor_x: int = 0, cursor_y: int = 0,
                               game_state: dict | None = None):
     """Render the lobby UI using rich Layouts.
@@ -169,7 +184,7 @@ def make_private_lobby_screen(lobby_id: str, players: list[str], logs: list[str]
             Layout(Panel(log_table, title="Console", border_style="magenta"), name="right")
         )
     elif placing_phase:
-        board_text = format_board_with_cursor(board or [], cursor_x, cursor_y)
+        board_text = format_board_with_cursor(board, cursor_x, cursor_y)
         timer_text = f"Placement time left: {placement_time_left}s" if placement_time_left is not None else ""
         info_panel = Panel(
             f"[bold cyan]Lobby ID:[/bold cyan] {lobby_id}\n"
@@ -178,7 +193,8 @@ def make_private_lobby_screen(lobby_id: str, players: list[str], logs: list[str]
             f"{turn_line}"
             f"[bold cyan]Cursor:[/bold cyan] ({cursor_x},{cursor_y})\n"
             f"[bold yellow]{timer_text}[/bold yellow]\n"
-            f"[green]Controls: WASD or arrows to move, P or Enter to place, R to remove, S to start (owner)[/green]",
+            f"[green]Controls: WASD or arrows to move, P or Enter to place, O to rotate, R to remove, "
+            f"C to confirm the layout, S to start (owner)[/green]",
             title="Placement",
             border_style="blue"
         )
@@ -196,8 +212,9 @@ def make_private_lobby_screen(lobby_id: str, players: list[str], logs: list[str]
             Layout(Panel(log_table, title="Console", border_style="magenta"), name="console")
         )
     else:
-        board_text = format_board(board or [])
-        opponent_text = format_board_with_cursor(opponent_view or [], cursor_x, cursor_y)
+        board_text = format_board(board, cursor_x, cursor_y, span=OWN_BOARD_VIEWPORT)
+        opponent_text = format_board_with_cursor(opponent_view, cursor_x, cursor_y)
+        own_rows = min(board.size, OWN_BOARD_VIEWPORT) + (board.size > OWN_BOARD_VIEWPORT) if board else 5
         game_panel = Panel(
             f"[bold cyan]You:[/bold cyan] {me}\n"
             f"[bold cyan]Owner:[/bold cyan] {owner_id}\n"
@@ -216,7 +233,7 @@ def make_private_lobby_screen(lobby_id: str, players: list[str], logs: list[str]
             Layout(opponent_panel, name="right")
         )
         layout["left"].split_column(
-            Layout(game_panel, name="game", size=12),
+            Layout(game_panel, name="game", size=7 + own_rows),
             Layout(Panel(log_table, title="Console", border_style="magenta"), name="console")
         )
 
@@ -225,11 +242,15 @@ def make_private_lobby_screen(lobby_id: str, players: list[str], logs: list[str]
 
 async def render_private_lobby(lobby_id: str, websocket, players: list[str], logs: list[str],
                                 owner_id: str | None = None, me: str | None = None,
-                                initial_board: list[list[str]] | None = None,
-                                initial_opponent_view: list[list[str]] | None = None):
+                                initial_board: list[list[str]] | dict | None = None,
+                                initial_opponent_view: list[list[str]] | dict | None = None,
+                                initial_version: int = 0):
     game_started = False
-    current_board = initial_board
-    opponent_view = initial_opponent_view
+    board_version = initial_version
+    current_board = Grid.from_wire(initial_board)
+    opponent_view = Grid.from_wire(initial_opponent_view)
+    vertical = False  # direction of the next ship placed: down instead of right
+    draft: Draft | None = None  # the fleet laid out during placement, sent in one message when confirmed
     placing_phase = False
     placement_time_left: int | None = None
     cursor_x = 0
@@ -266,8 +287,42 @@ async def render_private_lobby(lobby_id: str, websocket, players: list[str], log
                 termios.tcsetattr(fd, termios.TCSADRAIN, old)
 
     def start_key_listener(live):
+        def cursor_limit() -> int:
+            grid = current_board if placing_phase or not game_started else opponent_view
+            return grid.size - 1 if grid else 0
+
+        def place_ship():
+            """Lay the next ship out on the draft, or send it right away while the fleet is unknown."""
+            if draft is None:
+                asyncio.run_coroutine_threadsafe(
+                    send_message(websocket, {"action": "place_ship", "x": cursor_x, "y": cursor_y,
+                                             "vertical": vertical}),
+                    loop
+                )
+                logs.append(f"Sent place_ship at ({cursor_x},{cursor_y})")
+                return
+            result = draft.place(cursor_x, cursor_y, vertical)
+            if result.get("error"):
+                logs.append(f"[red]{result['error']}[/red]")
+                return
+            apply_cells(current_board, result["cells"])
+            if not draft.remaining():
+                logs.append("[green]All ships placed, press C to confirm the layout[/green]")
+
+        def remove_ship():
+            """Take the ship under the cursor off the draft, or ask the server to remove a placed one."""
+            cells = draft.remove(cursor_x, cursor_y) if draft is not None else None
+            if cells is not None:
+                apply_cells(current_board, cells)
+                return
+            asyncio.run_coroutine_threadsafe(
+                send_message(websocket, {"action": "remove_ship", "x": cursor_x, "y": cursor_y}),
+                loop
+            )
+            logs.append(f"Sent remove_ship at ({cursor_x},{cursor_y})")
+
         def run():
-            nonlocal cursor_x, cursor_y, game_started, placing_phase, placement_time_left, current_board, opponent_view, game_state
+            nonlocal cursor_x, cursor_y, game_started, placing_phase, placement_time_left, current_board, opponent_view, game_state, vertical
 
             while running:
                 kind, key = _get_key()
@@ -290,19 +345,11 @@ async def render_private_lobby(lobby_id: str, websocket, players: list[str], log
                     if direction == 'LEFT':
                         cursor_x = max(0, cursor_x - 1)
                     elif direction == 'RIGHT':
-                        if placing_phase or not game_started:
-                            max_x = (len(current_board[0]) - 1) if current_board else 4
-                        else:
-                            max_x = (len(opponent_view[0]) - 1) if opponent_view else 4
-                        cursor_x = min(max_x, cursor_x + 1)
+                        cursor_x = min(cursor_limit(), cursor_x + 1)
                     elif direction == 'UP':
                         cursor_y = max(0, cursor_y - 1)
                     elif direction == 'DOWN':
-                        if placing_phase or not game_started:
-                            max_y = (len(current_board) - 1) if current_board else 4
-                        else:
-                            max_y = (len(opponent_view) - 1) if opponent_view else 4
-                        cursor_y = min(max_y, cursor_y + 1)
+                        cursor_y = min(cursor_limit(), cursor_y + 1)
 
                     try:
                         live.update(make_private_lobby_screen(lobby_id, players, logs, owner_id, me, game_started,
@@ -314,13 +361,13 @@ async def render_private_lobby(lobby_id: str, websocket, players: list[str], log
 
                 ch = key
                 if isinstance(ch, str) and ch.lower() == 's' and me == owner_id and not game_started and len(players) == 2 and not placing_phase:
-                    asyncio.run_coroutine_threadsafe(websocket.send(json.dumps({"action": "start_game"})),
+                    asyncio.run_coroutine_threadsafe(send_message(websocket, {"action": "start_game"}),
                                                      loop)
                     logs.append("[green]Placement phase started (local)[/green]")
                     placing_phase = True
                     placement_time_left = 45
-                    if current_board is None:
-                        current_board = [["~"] * 5 for _ in range(5)]
+                    if current_board is None and opponent_view is not None:
+                        current_board = Grid(opponent_view.size)
                     try:
                         live.update(make_private_lobby_screen(lobby_id, players, logs, owner_id, me, game_started,
                                                               placing_phase, placement_time_left,
@@ -334,19 +381,11 @@ async def render_private_lobby(lobby_id: str, websocket, players: list[str], log
                     if lk == 'a':
                         cursor_x = max(0, cursor_x - 1)
                     elif lk == 'd':
-                        if placing_phase or not game_started:
-                            max_x = (len(current_board[0]) - 1) if current_board else 4
-                        else:
-                            max_x = (len(opponent_view[0]) - 1) if opponent_view else 4
-                        cursor_x = min(max_x, cursor_x + 1)
+                        cursor_x = min(cursor_limit(), cursor_x + 1)
                     elif lk == 'w':
                         cursor_y = max(0, cursor_y - 1)
                     elif lk == 's':
-                        if placing_phase or not game_started:
-                            max_y = (len(current_board) - 1) if current_board else 4
-                        else:
-                            max_y = (len(opponent_view) - 1) if opponent_view else 4
-                        cursor_y = min(max_y, cursor_y + 1)
+                        cursor_y = min(cursor_limit(), cursor_y + 1)
                     try:
                         live.update(make_private_lobby_screen(lobby_id, players, logs, owner_id, me, game_started,
                                                               placing_phase, placement_time_left,
@@ -363,11 +402,7 @@ async def render_private_lobby(lobby_id: str, websocket, players: list[str], log
 
                 if is_enter:
                     if not game_started or placing_phase:
-                        asyncio.run_coroutine_threadsafe(
-                            websocket.send(json.dumps({"action": "place_ship", "x": cursor_x, "y": cursor_y})),
-                            loop
-                        )
-                        logs.append(f"Sent place_ship at ({cursor_x},{cursor_y})")
+                        place_ship()
                         try:
                             live.update(make_private_lobby_screen(lobby_id, players, logs, owner_id, me, game_started,
                                                                   placing_phase, placement_time_left,
@@ -376,7 +411,7 @@ async def render_private_lobby(lobby_id: str, websocket, players: list[str], log
                             pass
                     else:
                         asyncio.run_coroutine_threadsafe(
-                            websocket.send(json.dumps({"action": "shoot", "x": cursor_x, "y": cursor_y})),
+                            send_message(websocket, {"action": "shoot", "x": cursor_x, "y": cursor_y}),
                             loop
                         )
                         logs.append(f"Sent shoot at ({cursor_x},{cursor_y})")
@@ -390,7 +425,7 @@ async def render_private_lobby(lobby_id: str, websocket, players: list[str], log
                     if isinstance(ch, str):
                         lk = ch.lower()
                         if lk == 's' and me == owner_id and not game_started and len(players) == 2:
-                            asyncio.run_coroutine_threadsafe(websocket.send(json.dumps({"action": "start_game"})),
+                            asyncio.run_coroutine_threadsafe(send_message(websocket, {"action": "start_game"}),
                                                              loop)
                             logs.append("Sent start_game")
                             try:
@@ -400,11 +435,16 @@ async def render_private_lobby(lobby_id: str, websocket, players: list[str], log
                             except Exception:
                                 pass
                         elif lk == 'p' and (not game_started or placing_phase):
-                            asyncio.run_coroutine_threadsafe(
-                                websocket.send(json.dumps({"action": "place_ship", "x": cursor_x, "y": cursor_y})),
-                                loop
-                            )
-                            logs.append(f"Sent place_ship at ({cursor_x},{cursor_y})")
+                            place_ship()
+                            try:
+                                live.update(make_private_lobby_screen(lobby_id, players, logs, owner_id, me, game_started,
+                                                                      placing_phase, placement_time_left,
+                                                                      current_board, opponent_view, cursor_x, cursor_y))
+                            except Exception:
+                                pass
+                        elif lk == 'o' and (not game_started or placing_phase):
+                            vertical = not vertical
+                            logs.append(f"Ships now run {'down' if vertical else 'right'} from the cursor")
                             try:
                                 live.update(make_private_lobby_screen(lobby_id, players, logs, owner_id, me, game_started,
                                                                       placing_phase, placement_time_left,
@@ -412,11 +452,17 @@ async def render_private_lobby(lobby_id: str, websocket, players: list[str], log
                             except Exception:
                                 pass
                         elif lk == 'r' and (not game_started or placing_phase):
-                            asyncio.run_coroutine_threadsafe(
-                                websocket.send(json.dumps({"action": "remove_ship", "x": cursor_x, "y": cursor_y})),
-                                loop
-                            )
-                            logs.append(f"Sent remove_ship at ({cursor_x},{cursor_y})")
+                            remove_ship()
+                            try:
+                                live.update(make_private_lobby_screen(lobby_id, players, logs, owner_id, me, game_started,
+                                                                      placing_phase, placement_time_left,
+                                                                      current_board, opponent_view, cursor_x, cursor_y))
+                            except Exception:
+                                pass
+                        elif lk == 'c' and placing_phase and draft is not None:
+                            # the whole layout in one message, answered by a single board update
+                            asyncio.run_coroutine_threadsafe(send_message(websocket, draft.message()), loop)
+                            logs.append(f"Sent the layout of {len(draft.ships)}/{len(draft.fleet)} ships")
                             try:
                                 live.update(make_private_lobby_screen(lobby_id, players, logs, owner_id, me, game_started,
                                                                       placing_phase, placement_time_left,
@@ -446,9 +492,11 @@ async def render_private_lobby(lobby_id: str, websocket, players: list[str], log
                 break
 
             try:
-                event = json.loads(data)
+                event = decode(data)
+                if not isinstance(event, dict):
+                    raise ValueError("not an event")
             except Exception:
-                if "heartbeat" in data:
+                if isinstance(data, str) and "heartbeat" in data:
                     continue
                 logs.append(f"Received invalid message: {data}")
                 live.update(
@@ -464,9 +512,10 @@ async def render_private_lobby(lobby_id: str, websocket, players: list[str], log
                 players = event["lobby_data"]["players"]
                 owner_id = event.get("owner_id", owner_id)
                 if "board" in event:
-                    current_board = event.get("board")
+                    current_board = Grid.from_wire(event.get("board"))
                 if "opponent_view" in event:
-                    opponent_view = event.get("opponent_view")
+                    opponent_view = Grid.from_wire(event.get("opponent_view"))
+                board_version = event.get("version", board_version)
                 logs.extend(event.get("logs", []))
                 live.update(
                     make_private_lobby_screen(lobby_id, players, logs, owner_id, me, game_started, placing_phase,
@@ -475,8 +524,10 @@ async def render_private_lobby(lobby_id: str, websocket, players: list[str], log
             elif event.get("type") == "placing":
                 placing_phase = True
                 placement_time_left = int(event.get("placement_time", 45))
-                current_board = event.get("board")
-                opponent_view = event.get("opponent_view")
+                current_board = Grid.from_wire(event.get("board"))
+                draft = Draft(current_board.size, event["fleet"]) if current_board and event.get("fleet") else None
+                opponent_view = Grid.from_wire(event.get("opponent_view"))
+                board_version = event.get("version", board_version)
                 owner_id = event.get("owner_id", owner_id)
                 game_state = event.get("state", game_state)
                 logs.extend(event.get("logs", []))
@@ -501,8 +552,10 @@ async def render_private_lobby(lobby_id: str, websocket, players: list[str], log
             elif event.get("type") == "start":
                 placing_phase = False
                 game_started = True
-                current_board = event.get("board")
-                opponent_view = event.get("opponent_view")
+                draft = None
+                current_board = Grid.from_wire(event.get("board"))
+                opponent_view = Grid.from_wire(event.get("opponent_view"))
+                board_version = event.get("version", board_version)
                 owner_id = event.get("owner_id", owner_id)
                 game_state = event.get("state", game_state)
                 logs.append("Game started!")
@@ -510,9 +563,28 @@ async def render_private_lobby(lobby_id: str, websocket, players: list[str], log
                     make_private_lobby_screen(lobby_id, players, logs, owner_id, me, game_started, placing_phase,
                                               placement_time_left, current_board, opponent_view, cursor_x, cursor_y, game_state))
 
-            elif event.get("type") == "update":
-                current_board = event.get("board")
-                opponent_view = event.get("opponent_view")
+            elif event.get("type") == "delta":
+                version = event.get("version", 0)
+                game_state = event.get("state", game_state)
+                logs.extend(event.get("logs", []))
+                if version == board_version + 1:
+                    if (apply_cells(current_board, event.get("board", []))
+                            and apply_cells(opponent_view, event.get("opponent_view", []))):
+                        board_version = version
+                    else:
+                        await send_message(websocket, {"action": "resync"})
+                elif version > board_version + 1:
+                    # missed at least one update, ask the server for the full boards
+                    await send_message(websocket, {"action": "resync"})
+                live.update(
+                    make_private_lobby_screen(lobby_id, players, logs, owner_id, me, game_started, placing_phase,
+                                              placement_time_left, current_board, opponent_view, cursor_x, cursor_y, game_state))
+
+            elif event.get("type") == "sync":
+                current_board = Grid.from_wire(event.get("board"))
+                opponent_view = Grid.from_wire(event.get("opponent_view"))
+                board_version = event.get("version", board_version)
+                owner_id = event.get("owner_id", owner_id)
                 game_state = event.get("state", game_state)
                 live.update(
                     make_private_lobby_screen(lobby_id, players, logs, owner_id, me, game_started, placing_phase,
@@ -537,8 +609,8 @@ async def render_private_lobby(lobby_id: str, websocket, players: list[str], log
                 won = (winner == me)
                 result_title = "You Win!" if won else "You Lose!"
                 result_color = "green" if won else "red"
-                board_text = format_board(current_board or [])
-                opponent_text = format_board(opponent_view or [])
+                board_text = format_board(current_board, cursor_x, cursor_y)
+                opponent_text = format_board(opponent_view, cursor_x, cursor_y)
                 result_panel = Panel(
                     f"[bold {result_color}]{result_title}[/bold {result_color}]\n\n"
                     f"Winner: {winner}\n\n"
@@ -557,21 +629,102 @@ async def render_private_lobby(lobby_id: str, websocket, players: list[str], log
                 return
 
 
+def make_spectator_screen(lobby_id: str, players: list[str], boards: dict[str, Grid], logs: list[str],
+                          game_state: dict | None, spectators: int):
+    """Both players' boards side by side, ships hidden, with the game's console below."""
+    layout = Layout()
+    log_table = Table.grid()
+    for log in logs[-8:]:
+        log_table.add_row(f"[white]{log}")
+    state = (game_state or {}).get("state", "waiting")
+    turn = (game_state or {}).get("turn")
+    info = (f"[bold cyan]Lobby ID:[/bold cyan] {lobby_id}   [bold cyan]State:[/bold cyan] {state}   "
+            f"{f'[bold cyan]Turn:[/bold cyan] {turn}   ' if turn else ''}"
+            f"[bold cyan]Spectators:[/bold cyan] {spectators}")
+    board_panels = [Layout(Panel(format_board(boards.get(player_id)), title=f"Player {player_id}", border_style="cyan"))
+                    for player_id in players] or [Layout(Panel("Waiting for players...", border_style="cyan"))]
+    layout.split_column(
+        Layout(Panel(info, title="Spectating", border_style="blue"), name="info", size=3),
+        Layout(name="boards"),
+        Layout(Panel(log_table, title="Console", border_style="magenta"), name="console", size=10),
+    )
+    layout["boards"].split_row(*board_panels)
+    return layout
+
+
+async def render_spectator(websocket, snapshot: dict):
+    """Watch a game until it ends or its lobby closes.
+
+    Updates are numbered; after a gap the client asks for a fresh snapshot and ignores updates
+    until it arrives.
+    """
+    lobby_id = snapshot["lobby_id"]
+    players, boards, logs, game_state, spectators, seq = [], {}, [], None, 0, 0
+    waiting_for_snapshot = False
+    closed = snapshot.get("closed", False)
+
+    def load(event: dict):
+        nonlocal players, boards, game_state, spectators, seq
+        players = event.get("players", [])
+        boards = {player_id: Grid.from_wire(board) for player_id, board in event.get("boards", {}).items()}
+        game_state = event.get("state")
+        spectators = event.get("spectators", spectators)
+        seq = event.get("seq", 0)
+
+    load(snapshot)
+    logs.extend(snapshot.get("logs", []))
+    with Live(make_spectator_screen(lobby_id, players, boards, logs, game_state, spectators),
+              refresh_per_second=10, screen=False) as live:
+        while not closed and (game_state or {}).get("state") != "finished":
+            event = decode(await websocket.recv())
+            if not isinstance(event, dict):
+                continue
+            if event.get("type") == "spectate":
+                if event.get("seq", 0) < seq:
+                    continue  # a snapshot overtaken by updates we already applied
+                load(event)
+                waiting_for_snapshot = False
+            elif event.get("type") == "spectate_delta" and not waiting_for_snapshot:
+                if event.get("seq") != seq + 1 or not all(
+                        apply_cells(boards.get(player_id), cells) for player_id, cells in event["boards"].items()):
+                    waiting_for_snapshot = True
+                    await send_message(websocket, {"option": "watch_game", "input": lobby_id})
+                    continue
+                seq = event["seq"]
+                game_state = event.get("state", game_state)
+            elif event.get("type") == "log":
+                logs.append(event["message"])
+                continue
+            else:
+                continue
+            logs.extend(event.get("logs", []))
+            closed = event.get("closed", False)
+            live.update(make_spectator_screen(lobby_id, players, boards, logs, game_state, spectators))
+
+    winner = (game_state or {}).get("winner")
+    console.print(f"[bold green]Player {winner} won.[/bold green]" if winner else "[red]The game was closed.[/red]")
+    await asyncio.to_thread(console.input, "Press Enter to return to menu...")
+
+
 async def send_heartbeat(websocket):
     while True:
-        await websocket.send("heartbeat")
+        await send_message(websocket, "heartbeat")
         await asyncio.sleep(5)
 
 
 async def run_client(player_id: str | None = None):
-    uri = f"wss://{BASE_URI}/ws"
+    global wire_codec
+    uri = f"wss://{BASE_URI}/ws?format={WIRE_FORMAT}"
     try:
         async with websockets.connect(uri) as websocket:
             message = await websocket.recv()
-            data = json.loads(message)
+            data = decode(message)
             player_id = data.get("player_id", player_id)
+            wire_codec = negotiate(data.get("format"))
 
-            asyncio.create_task(send_heartbeat(websocket))
+            # in "ping" mode the server relies on WebSocket ping/pong, which websockets answers for us
+            if data.get("heartbeat", "app") == "app":
+                asyncio.create_task(send_heartbeat(websocket))
 
             print("\n")
 
@@ -579,13 +732,13 @@ async def run_client(player_id: str | None = None):
 
             try:
                 while True:
-                    response = await websocket.recv()
+                    response = decode(await websocket.recv())
                     if response == "heartbeat_ack":
                         continue
                     try:
-                        data = json.loads(response)
+                        data = response
 
-                        if data.get("message") == "Lobby created":
+                        if data.get("message") in ("Lobby created", "Playing vs computer"):
                             await render_private_lobby(
                                 data["lobby_id"], websocket,
                                 data["lobby_data"]["players"],
@@ -594,9 +747,16 @@ async def run_client(player_id: str | None = None):
                                 me=player_id,
                                 initial_board=data.get("board"),
                                 initial_opponent_view=data.get("opponent_view"),
+                                initial_version=data.get("version", 0),
                                 )
 
-                        elif data.get("message") == "Joined private game":
+                        elif data.get("message") == "Watching game":
+                            await render_spectator(websocket, data)
+
+                        elif data.get("message") == "Waiting for opponent...":
+                            print("Waiting for an opponent to join the public queue...")
+
+                        elif data.get("message") in ("Joined private game", "Joined public game"):
                             await render_private_lobby(
                                 data["lobby_id"], websocket,
                                 data["lobby_data"]["players"],
@@ -605,6 +765,7 @@ async def run_client(player_id: str | None = None):
                                 me=player_id,
                                 initial_board=data.get("board"),
                                 initial_opponent_view=data.get("opponent_view"),
+                                initial_version=data.get("version", 0),
                             )
                         else:
                             print(f"Response: {response}")
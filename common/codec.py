@@ -0,0 +1,74 @@
+"""The wire formats spoken by the client and the server, shared by both."""
+import json
+from typing import Any
+
+try:
+    import msgpack
+except ImportError:  # msgpack is optional, JSON is always available
+    msgpack = None
+
+DEFAULT_FORMAT = "json"
+_json = json.JSONEncoder(separators=(",", ":"))  # reused, json.dumps with options builds one per call
+
+
+class Codec:
+    """Encodes outbound messages for one wire format.
+
+    `binary` tells the transport whether to send the encoded payload as a binary or a text frame.
+    Plain string commands such as "heartbeat" are messages too and go through the same codec.
+    """
+    name: str = ""
+    binary: bool = False
+
+    def encode(self, payload: Any) -> str | bytes:
+        raise NotImplementedError
+
+    def decode(self, data: str | bytes) -> Any:
+        return decode(data)
+
+
+class JsonCodec(Codec):
+    name = "json"
+    binary = False
+
+    def encode(self, payload: Any) -> str:
+        # bare string commands stay unquoted so older text-only peers keep working
+        if isinstance(payload, str):
+            return payload
+        return _json.encode(payload)
+
+
+class MsgPackCodec(Codec):
+    name = "msgpack"
+    binary = True
+
+    def encode(self, payload: Any) -> bytes:
+        return msgpack.packb(payload)
+
+
+CODECS: dict[str, Codec] = {"json": JsonCodec()}
+if msgpack is not None:
+    CODECS["msgpack"] = MsgPackCodec()
+
+
+def negotiate(requested: str | None) -> Codec:
+    """Return the codec for the requested format name, falling back to JSON when unsupported."""
+    return CODECS.get((requested or DEFAULT_FORMAT).lower(), CODECS[DEFAULT_FORMAT])
+
+
+def decode(data: str | bytes) -> Any:
+    """Decode one inbound frame regardless of the negotiated format.
+
+    Binary frames are MessagePack, text frames are JSON. Text that is not valid JSON is a plain
+    command and is returned unchanged.
+    """
+    if isinstance(data, (bytes, bytearray)):
+        if msgpack is None:
+            raise ValueError("Received a binary frame but msgpack is not installed")
+        return msgpack.unpackb(data)
+    if data[:1] not in ("{", "[", '"'):
+        return data
+    try:
+        return json.loads(data)
+    except ValueError:
+        return data
@@ -0,0 +1,149 @@
+"""Time and memory per lobby broadcast: one dict encoded per player versus LobbyBroadcast.
+
+"before" builds every player's payload as a dict and encodes it whole, as broadcast_lobby did;
+"after" builds it with LobbyBroadcast, which also encodes whole copies but splices in boards sent
+in full again without a change. Every case broadcasts to both players of a running game with the
+same codec. "update" repeats a full-board message while the boards stand still, "update_after_change"
+changes both boards before each one, and "delta" is a shot delta. Peak KB is the most memory held
+at once by one broadcast (tracemalloc) beyond what encoding an empty map takes, output bytes the
+encoded size of both copies together.
+
+Run from the repository root:
+
+    python -m server.benchmarks.broadcast [--sizes 10 32 1000] [--number N]
+"""
+import argparse
+import timeit
+import tracemalloc
+from typing import Callable
+
+from common.codec import CODECS, Codec, decode
+from ..utils.broadcast import LobbyBroadcast
+from ..utils.codec import Preencoded
+from ..utils.models import Lobby
+from .lobby import A, B, new_game
+
+# a case returns (before, after), each broadcasting once and returning every player's encoded copy
+Broadcast = Callable[[], list]
+
+
+def _before(lobby: Lobby, codec: Codec, payload_for: Callable[[str], dict]) -> Broadcast:
+    return lambda: [codec.encode(payload_for(p.id)) for p in lobby.players]
+
+
+def encode(payload, codec: Codec) -> str | bytes:
+    """What Connection._write does with a queued payload."""
+    return payload.encode(codec) if isinstance(payload, Preencoded) else codec.encode(payload)
+
+
+def _after(lobby: Lobby, codec: Codec, build: Callable[[], LobbyBroadcast]) -> Broadcast:
+    def broadcast():
+        payload_for = build()
+        return [encode(payload_for(p.id), codec) for p in lobby.players]
+    return broadcast
+
+
+def _update(lobby: Lobby, codec: Codec) -> tuple[Broadcast, Broadcast]:
+    logs = ["Player bbbbbbbb joined the lobby."]
+    before = _before(lobby, codec, lambda player_id: {
+        "lobby_id": lobby.id,
+        "state": lobby.game_state,
+        "message": "Lobby update",
+        "owner_id": lobby.owner_id,
+        "lobby_data": {"players": [p.id for p in lobby.players]},
+        "board": lobby.get_board(player_id),
+        "opponent_view": lobby.get_opponent_view(player_id),
+        "version": lobby.version,
+        "logs": logs,
+    })
+    after = _after(lobby, codec, lambda: LobbyBroadcast(
+        lobby, {"message": "Lobby update", "version": lobby.version, "logs": logs}, lobby_data=True, boards=True))
+    return before, after
+
+
+def update(size: int, codec: Codec) -> tuple[Broadcast, Broadcast]:
+    return _update(new_game(size), codec)
+
+
+def update_after_change(size: int, codec: Codec) -> tuple[Broadcast, Broadcast]:
+    lobby = new_game(size)
+    views = [view for board in lobby.boards.values() for view in (board.own, board.opponent)]
+
+    def change(broadcast: Broadcast) -> Broadcast:
+        marks = iter(range(1 << 30))  # one per side, so both first broadcasts see the same boards
+
+        def changed():
+            mark = "O" if next(marks) % 2 else "~"
+            for view in views:  # invalidates whatever each view has cached
+                view.set(size * size - 1, mark)
+            return broadcast()
+        return changed
+
+    before, after = _update(lobby, codec)
+    return change(before), change(after)
+
+
+def delta(size: int, codec: Codec) -> tuple[Broadcast, Broadcast]:
+    lobby = new_game(size)
+    changed = [[3, 4, "O"]]
+    logs = ["Player aaaaaaaa shot at (3,4) - miss"]
+    before = _before(lobby, codec, lambda player_id: {
+        "type": "delta",
+        "lobby_id": lobby.id,
+        "version": lobby.version,
+        "state": lobby.game_state,
+        "board": changed if player_id == B else [],
+        "opponent_view": changed if player_id == A else [],
+        "logs": logs,
+    })
+    after = _after(lobby, codec, lambda: LobbyBroadcast(
+        lobby, {"type": "delta", "version": lobby.version, "logs": logs}, own=lambda player_id: {
+            "board": changed if player_id == B else [], "opponent_view": changed if player_id == A else []}))
+    return before, after
+
+
+CASES = (update, update_after_change, delta)
+
+
+def peak_bytes(broadcast: Broadcast, rounds: int = 5) -> int:
+    """The most memory one broadcast holds at once, including the copies it returns."""
+    broadcast()  # warm the caches a running server would already have
+    peaks = []
+    tracemalloc.start()
+    try:
+        for _ in range(rounds):
+            tracemalloc.reset_peak()
+            start = tracemalloc.get_traced_memory()[0]
+            copies = broadcast()
+            peaks.append(tracemalloc.get_traced_memory()[1] - start)
+            del copies
+    finally:
+        tracemalloc.stop()
+    return min(peaks)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 32, 100, 1000], help="board sizes")
+    parser.add_argument("--number", type=int, default=500, help="broadcasts per timing")
+    args = parser.parse_args()
+
+    print(f"{'case':<22}{'size':>6}{'format':>9}{'bytes':>9}"
+          f"{'before us':>11}{'after us':>10}{'before KB':>11}{'after KB':>10}")
+    for case in CASES:
+        for size in args.sizes:
+            for codec in CODECS.values():
+                before, after = case(size, codec)
+                expected, built = before(), after()
+                if [decode(data) for data in expected] != [decode(data) for data in built]:
+                    raise SystemExit(f"{case.__name__} size={size} {codec.name}: copies differ")
+                times = [timeit.timeit(run, number=args.number) / args.number * 1e6 for run in (before, after)]
+                # msgpack's packer reserves a scratch buffer per call, which would hide everything else
+                scratch = peak_bytes(lambda: [codec.encode({})])
+                peaks = [(peak_bytes(run) - scratch) / 1024 for run in (before, after)]
+                print(f"{case.__name__:<22}{size:>6}{codec.name:>9}{sum(map(len, built)):>9}"
+                      f"{times[0]:>11.1f}{times[1]:>10.1f}{peaks[0]:>11.1f}{peaks[1]:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""Compare payload size and encode/decode time of the wire formats for the current message types.
+
+Run from the repository root:
+
+    python -m server.benchmarks.codec [--number N]
+"""
+import argparse
+import timeit
+
+from common.codec import CODECS, decode
+from ..utils.models import Lobby
+
+
+def sample_messages() -> dict[str, object]:
+    lobby = Lobby(id="123456", isPublic=False)
+    lobby.add_player("aaaaaaaa")
+    lobby.add_player("bbbbbbbb")
+    lobby.place_ships_randomly("aaaaaaaa")
+    lobby.place_ships_randomly("bbbbbbbb")
+    lobby.start_game()
+    lobby.shoot("aaaaaaaa", 0, 0)
+    lobby_data = {"players": [p.id for p in lobby.players]}
+    return {
+        "heartbeat": "heartbeat",
+        "hello": {"player_id": "aaaaaaaa", "format": "json"},
+        "menu_options": {"options": [
+            {"display_name": "Join Public Game", "id": "join_public_game", "input": False,
+             "input_placeholder": None, "disabled": True},
+            {"display_name": "Join Private Game", "id": "join_private_game", "input": True,
+             "input_placeholder": "Enter the game ID", "disabled": False},
+            {"display_name": "Create Private Game", "id": "create_private_game", "input": False,
+             "input_placeholder": None, "disabled": False},
+        ]},
+        "shoot_request": {"action": "shoot", "x": 3, "y": 4},
+        "lobby_update": {
+            "lobby_id": lobby.id,
+            "state": lobby.game_state,
+            "message": "Lobby update",
+            "owner_id": lobby.owner_id,
+            "lobby_data": lobby_data,
+            "board": lobby.get_board("aaaaaaaa"),
+            "opponent_view": lobby.get_opponent_view("aaaaaaaa"),
+            "version": lobby.version,
+            "logs": ["Player bbbbbbbb joined the lobby."],
+        },
+        "delta": {
+            "type": "delta",
+            "lobby_id": lobby.id,
+            "version": lobby.version,
+            "state": lobby.game_state,
+            "board": [],
+            "opponent_view": [[0, 0, "O"]],
+            "logs": ["Player aaaaaaaa shot at (0,0) - miss"],
+        },
+        "log": {"type": "log", "message": "[green]Placement starting in 3...[/green]"},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--number", type=int, default=20000, help="iterations per measurement")
+    args = parser.parse_args()
+
+    print(f"{'message':<16}{'format':<10}{'bytes':>8}{'encode us':>12}{'decode us':>12}")
+    for name, payload in sample_messages().items():
+        for codec in CODECS.values():
+            encoded = codec.encode(payload)
+            encode_us = timeit.timeit(lambda: codec.encode(payload), number=args.number) / args.number * 1e6
+            decode_us = timeit.timeit(lambda: decode(encoded), number=args.number) / args.number * 1e6
+            print(f"{name:<16}{codec.name:<10}{len(encoded):>8}{encode_us:>12.2f}{decode_us:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""Measure what the event log adds to the `Lobby.shoot` hot path in each fsync mode.
+
+The timed section is the `shoot` call itself, which is all a handler waits for. In "batch" and "off"
+mode the batch write happens later in the server's flush task; it is timed separately here.
+
+Run from the repository root:
+
+    python -m server.benchmarks.eventlog [--shots N] [--batch N]
+"""
+import argparse
+import statistics
+import tempfile
+import time
+
+from ..utils.eventlog import FSYNC_MODES, EventLog
+from ..utils.models import Lobby
+
+
+def new_game(journal: EventLog | None, n: int) -> Lobby:
+    lobby = Lobby(id=f"{n:06d}", isPublic=False, journal=journal.record if journal else None)
+    lobby.add_player("aaaaaaaa")
+    lobby.add_player("bbbbbbbb")
+    lobby.place_ships_randomly("aaaaaaaa")
+    lobby.place_ships_randomly("bbbbbbbb")
+    lobby.start_game()
+    return lobby
+
+
+def run(mode: str | None, shots: int, batch: int) -> tuple[list[float], list[float]]:
+    """Return per-shot latencies and per-batch flush times, in microseconds."""
+    with tempfile.TemporaryDirectory() as tmp:
+        journal = EventLog(tmp, fsync=mode) if mode else None
+        latencies, flushes = [], []
+        games = 0
+        lobby = new_game(journal, games)
+        cells = iter(())
+        for _ in range(shots):
+            shot = next(cells, None)
+            if shot is None or lobby.game_state["state"] != "playing":
+                games += 1
+                lobby = new_game(journal, games)
+                cells = ((x, y) for y in range(lobby.board_size) for x in range(lobby.board_size)
+                         for _ in range(2))
+                shot = next(cells)
+            shooter = lobby.game_state["turn"]
+            start = time.perf_counter()
+            lobby.shoot(shooter, *shot)
+            latencies.append((time.perf_counter() - start) * 1e6)
+            if journal and len(journal.pending) >= batch:
+                start = time.perf_counter()
+                journal.flush()
+                flushes.append((time.perf_counter() - start) * 1e6)
+        if journal:
+            journal.close()
+    return latencies, flushes
+
+
+def percentile(values: list[float], p: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--shots", type=int, default=20000)
+    parser.add_argument("--batch", type=int, default=256, help="records per flush in batch/off mode")
+    args = parser.parse_args()
+
+    print(f"{'log':>8}{'p50 µs':>10}{'p99 µs':>10}{'max µs':>10}{'flush µs':>12}{'per shot µs':>13}")
+    for mode in (None, *FSYNC_MODES):
+        shots = args.shots if mode != "always" else min(args.shots, 2000)
+        latencies, flushes = run(mode, shots, args.batch)
+        flush = statistics.mean(flushes) if flushes else 0.0
+        amortized = sum(flushes) / len(latencies)
+        print(f"{mode or 'none':>8}{percentile(latencies, 0.5):>10.2f}{percentile(latencies, 0.99):>10.2f}"
+              f"{max(latencies):>10.1f}{flush:>12.1f}{amortized:>13.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,246 @@
+"""Load-test a running server with bot clients that play complete games over the real protocol.
+
+Every game is two bots: the host opens the menu, creates a private game and starts it once the guest
+has joined, then both place their ships and shoot until one of them wins. Bots send heartbeats like
+the real client. The harness keeps `--concurrency` games in flight, opens at most `--ramp` new
+connections per second and stops starting games after `--duration` seconds.
+
+Start the server with short phases, otherwise every game waits out the placement timer:
+
+    HTF_COUNTDOWN=0 HTF_PLACEMENT_TIME=1 HTF_REPLAY_DIR= python -m server.main
+    python -m server.benchmarks.loadtest --concurrency 50 --ramp 20 --duration 30 [--json]
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+from collections import Counter, defaultdict
+
+import websockets
+
+from common.codec import decode, negotiate
+
+HEARTBEAT_INTERVAL = 5  # seconds, same as the client
+
+
+class Stats:
+    def __init__(self):
+        self.connections = 0
+        self.connect_times: list[float] = []
+        self.sent = 0
+        self.received = 0
+        self.games = 0
+        self.latencies: dict[str, list[float]] = defaultdict(list)  # {action: [seconds, ...]}
+        self.errors: Counter = Counter()  # server error replies by text
+        self.failures: Counter = Counter()  # broken games by exception
+
+    def report(self, elapsed: float) -> dict:
+        def percentiles(values: list[float]) -> dict:
+            ordered = sorted(values)
+            pick = lambda p: round(ordered[min(len(ordered) - 1, int(len(ordered) * p))] * 1000, 2)
+            return {"count": len(ordered), "p50_ms": pick(0.5), "p95_ms": pick(0.95), "p99_ms": pick(0.99)}
+
+        return {
+            "elapsed_s": round(elapsed, 2),
+            "connections": self.connections,
+            "connections_per_s": round(self.connections / elapsed, 2),
+            "connect": percentiles(self.connect_times) if self.connect_times else None,
+            "games_completed": self.games,
+            "messages_sent_per_s": round(self.sent / elapsed, 2),
+            "messages_received_per_s": round(self.received / elapsed, 2),
+            "latency": {action: percentiles(values) for action, values in sorted(self.latencies.items())},
+            "server_errors": dict(self.errors),
+            "failed_games": dict(self.failures),
+        }
+
+
+class Bot:
+    """One simulated player. `expect` reads messages until one matches, recording errors on the way."""
+
+    def __init__(self, stats: Stats, url: str, wire_format: str):
+        self.stats = stats
+        self.url = f"{url}?format={wire_format}"
+        self.codec = negotiate(wire_format)
+        self.websocket = None
+        self.id: str | None = None
+        self.state: dict = {}
+
+    async def connect(self):
+        start = time.perf_counter()
+        self.websocket = await websockets.connect(self.url, max_size=None)
+        hello = await self.expect(lambda m: isinstance(m, dict) and "player_id" in m)
+        self.stats.connect_times.append(time.perf_counter() - start)
+        self.stats.connections += 1
+        self.id = hello["player_id"]
+        if hello.get("heartbeat", "app") == "app":
+            asyncio.create_task(self.heartbeat())
+
+    async def heartbeat(self):
+        try:
+            while True:
+                await asyncio.sleep(HEARTBEAT_INTERVAL)
+                await self.send("heartbeat")
+        except Exception:
+            pass
+
+    async def send(self, payload):
+        await self.websocket.send(self.codec.encode(payload))
+        self.stats.sent += 1
+
+    async def expect(self, matches) -> dict:
+        while True:
+            message = decode(await self.websocket.recv())
+            self.stats.received += 1
+            if isinstance(message, dict):
+                if message.get("error"):
+                    self.stats.errors[message["error"]] += 1
+                elif message.get("type") == "log" and "[red]" in message.get("message", ""):
+                    self.stats.errors[message["message"]] += 1
+                if isinstance(message.get("state"), dict):
+                    self.state = message["state"]
+            if matches(message):
+                return message
+
+    async def request(self, action: str, payload, matches) -> dict:
+        """Send `payload` and time how long the matching update takes to arrive."""
+        start = time.perf_counter()
+        await self.send(payload)
+        message = await self.expect(matches)
+        self.stats.latencies[action].append(time.perf_counter() - start)
+        return message
+
+    async def close(self):
+        if self.websocket is not None:
+            await self.websocket.close()
+
+
+def is_own_delta(key: str):
+    return lambda m: isinstance(m, dict) and m.get("type") == "delta" and m.get(key)
+
+
+async def play(bot: Bot, host: bool, lobby_id: asyncio.Future):
+    is_placing = lambda m: isinstance(m, dict) and m.get("type") == "placing"
+    placing = None
+    await bot.request("menu", "MENU_start_options", lambda m: isinstance(m, dict) and "options" in m)
+    if host:
+        created = await bot.request("create_private_game", {"option": "create_private_game"},
+                                    lambda m: isinstance(m, dict) and m.get("message") == "Lobby created")
+        lobby_id.set_result(created["lobby_id"])
+        await bot.expect(lambda m: isinstance(m, dict) and m.get("message") == "Lobby update")
+        # the first countdown message, or the placement phase itself without a countdown
+        reply = await bot.request("start_game", {"action": "start_game"},
+                                  lambda m: isinstance(m, dict) and m.get("type") in ("log", "placing"))
+        placing = reply if is_placing(reply) else None
+    else:
+        await bot.request("join_private_game", {"option": "join_private_game", "input": await lobby_id},
+                          lambda m: isinstance(m, dict) and m.get("message") == "Joined private game")
+
+    placing = placing or await bot.expect(is_placing)
+    size = placing["board_size"]
+    taken: set[tuple[int, int]] = set()
+    # the server places the longest unplaced ship, so pick non-overlapping spots in that order
+    for length in sorted(placing["fleet"], reverse=True):
+        while True:
+            vertical = random.random() < 0.5
+            x = random.randrange(size if vertical else size - length + 1)
+            y = random.randrange(size - length + 1 if vertical else size)
+            cells = {(x, y + i) if vertical else (x + i, y) for i in range(length)}
+            if not cells & taken:
+                break
+        taken |= cells
+        await bot.request("place_ship", {"action": "place_ship", "x": x, "y": y, "vertical": vertical},
+                          is_own_delta("board"))
+
+    await bot.expect(lambda m: isinstance(m, dict) and m.get("type") == "start")
+    targets = [(x, y) for y in range(size) for x in range(size)]
+    random.shuffle(targets)
+    while bot.state.get("state") == "playing":
+        if bot.state.get("turn") != bot.id:
+            await bot.expect(lambda m: isinstance(m, dict) and m.get("type") == "delta"
+                             and (m["state"].get("turn") == bot.id or m["state"].get("state") != "playing"))
+            continue
+        x, y = targets.pop()
+        await bot.request("shoot", {"action": "shoot", "x": x, "y": y}, is_own_delta("opponent_view"))
+
+
+async def run_game(stats: Stats, args, gate: "RampGate"):
+    host, guest = Bot(stats, args.url, args.format), Bot(stats, args.url, args.format)
+    try:
+        await gate.wait()
+        await host.connect()
+        await gate.wait()
+        await guest.connect()
+        lobby_id = asyncio.get_running_loop().create_future()
+        await asyncio.wait_for(asyncio.gather(play(host, True, lobby_id), play(guest, False, lobby_id)),
+                               args.game_timeout)
+        stats.games += 1
+    except Exception as exc:
+        stats.failures[type(exc).__name__] += 1
+    finally:
+        await host.close()
+        await guest.close()
+
+
+class RampGate:
+    """Lets at most `rate` connection attempts through per second."""
+
+    def __init__(self, rate: float):
+        self.interval = 1 / rate
+        self.next = time.perf_counter()
+
+    async def wait(self):
+        now = time.perf_counter()
+        delay = self.next - now
+        self.next = max(self.next, now) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+async def main_async(args) -> dict:
+    stats = Stats()
+    gate = RampGate(args.ramp)
+    start = time.perf_counter()
+    deadline = start + args.duration
+    running: set[asyncio.Task] = set()
+    while time.perf_counter() < deadline:
+        while len(running) < args.concurrency and time.perf_counter() < deadline:
+            task = asyncio.create_task(run_game(stats, args, gate))
+            running.add(task)
+            task.add_done_callback(running.discard)
+        await asyncio.sleep(0.05)
+    if running:
+        await asyncio.wait(running, timeout=args.game_timeout)
+    return stats.report(time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default="ws://127.0.0.1:8000/ws")
+    parser.add_argument("--format", default="json", choices=("json", "msgpack"))
+    parser.add_argument("--concurrency", type=int, default=10, help="games in flight (two connections each)")
+    parser.add_argument("--ramp", type=float, default=20, help="new connections per second")
+    parser.add_argument("--duration", type=float, default=30, help="seconds to keep starting games")
+    parser.add_argument("--game-timeout", type=float, default=120, help="seconds before a game counts as failed")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args()
+
+    report = asyncio.run(main_async(args))
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+    print(f"{report['connections']} connections in {report['elapsed_s']}s "
+          f"({report['connections_per_s']}/s), {report['games_completed']} games completed")
+    print(f"messages: {report['messages_sent_per_s']}/s sent, {report['messages_received_per_s']}/s received")
+    print(f"{'action':>20}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for action, row in [("connect", report["connect"]), *report["latency"].items()]:
+        if row:
+            print(f"{action:>20}{row['count']:>8}{row['p50_ms']:>10}{row['p95_ms']:>10}{row['p99_ms']:>10}")
+    if report["server_errors"]:
+        print("server errors:", report["server_errors"])
+    if report["failed_games"]:
+        print("failed games:", report["failed_games"])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,272 @@
+"""Micro-benchmarks for the Lobby and LobbyManager hot paths, with baselines to catch regressions.
+
+Board operations are swept over board sizes, lobby directory operations over lobby counts. Each
+result is the median time per operation over several timed batches; setup is never timed.
+
+Run from the repository root:
+
+    python -m server.benchmarks.lobby [--quick] [--save FILE] [--compare FILE] [--threshold 0.25]
+
+`--save` writes the results as JSON; `--compare` checks them against such a file and exits with
+status 1 when any benchmark is slower than the baseline by more than `--threshold` (a fraction).
+Baselines are machine-specific, so save and compare on the same host. The full sweep saved on the
+reference machine is kept in server/benchmarks/baselines/lobby.json:
+
+    python -m server.benchmarks.lobby --compare server/benchmarks/baselines/lobby.json
+"""
+import argparse
+import asyncio
+import json
+import platform
+import statistics
+import sys
+import time
+from typing import Callable
+
+from ..utils.lobby_manager import LobbyManager
+from ..utils.models import Lobby, Player, default_fleet
+
+BOARD_SIZES = (5, 10, 50, 100, 500, 1000)
+LOBBY_COUNTS = (10, 100, 1000, 10_000, 100_000)
+QUICK_BOARD_SIZES = (5, 50)
+QUICK_LOBBY_COUNTS = (10, 1000)
+MIN_TIME = 0.2  # seconds of timed batches per benchmark
+MAX_BATCHES = 50
+
+A, B = "aaaaaaaa", "bbbbbbbb"
+
+# a case builds its state untimed and returns a batch: a callable that runs the operation and
+# returns how many times it did
+Batch = Callable[[], int]
+
+
+def new_game(size: int) -> Lobby:
+    lobby = Lobby(id="000000", isPublic=False, board_size=size, fleet=default_fleet(size))
+    lobby.add_player(A)
+    lobby.add_player(B)
+    lobby.place_ships_randomly(A)
+    lobby.place_ships_randomly(B)
+    lobby.start_game()
+    return lobby
+
+
+_games: dict[int, Lobby] = {}
+
+
+def started_lobby(size: int) -> Lobby:
+    """A running game per board size, shared by the benchmarks that only read it."""
+    if size not in _games:
+        _games[size] = new_game(size)
+    return _games[size]
+
+
+_shooting: dict[int, tuple[Lobby, int]] = {}  # {size: (lobby, cells already swept)}
+
+
+def shoot(size: int) -> Batch:
+    # both players sweep the board row by row, 100 shots per batch; a new game is only set up
+    # once the previous one is over or swept completely
+    lobby, swept = _shooting.get(size) or (new_game(size), 0)
+    if lobby.game_state["state"] != "playing" or swept >= size * size:
+        lobby, swept = new_game(size), 0
+    cells = [(i % size, i // size) for i in range(swept, min(swept + 50, size * size))]
+    _shooting[size] = lobby, swept + len(cells)
+
+    def batch():
+        shots = 0
+        for x, y in cells:
+            for shooter in (A, B):
+                lobby.shoot(shooter, x, y)
+                shots += 1
+                if lobby.game_state["state"] != "playing":
+                    return shots
+        return shots
+    return batch
+
+
+def get_opponent_view(size: int) -> Batch:
+    lobby = started_lobby(size)
+    return lambda: lobby.get_opponent_view(A) and 1
+
+
+def get_board(size: int) -> Batch:
+    lobby = started_lobby(size)
+    return lambda: lobby.get_board(A) and 1
+
+
+def ships_placed(size: int) -> Batch:
+    lobby = started_lobby(size)
+
+    def batch():
+        for _ in range(1000):
+            lobby.ships_placed(A)
+        return 1000
+    return batch
+
+
+def place_ships_randomly(size: int) -> Batch:
+    lobby = Lobby(id="000000", isPublic=False, board_size=size, fleet=default_fleet(size))
+    lobby.add_player(A)
+    return lambda: lobby.place_ships_randomly(A) or 1
+
+
+_managers: dict[int, LobbyManager] = {}
+
+
+def populated_manager(count: int) -> LobbyManager:
+    """A manager with `count` one-player lobbies, shared by the directory benchmarks."""
+    if count not in _managers:
+        manager = LobbyManager()
+
+        async def fill():
+            for n in range(count):
+                await manager.create_lobby(Player(id=f"p{n}", websocket=None), is_public=False)
+        asyncio.run(fill())
+        _managers[count] = manager
+    return _managers[count]
+
+
+def _sample_lobbies(manager: LobbyManager, k: int = 1000) -> list[Lobby]:
+    lobbies = list(manager.lobbies.values())
+    step = max(1, len(lobbies) // k)
+    return lobbies[::step][:k]
+
+
+def add_player(count: int) -> Batch:
+    lobbies = _sample_lobbies(populated_manager(count))
+    for lobby in lobbies:
+        lobby.remove_player(f"g{lobby.id}")
+
+    def batch():
+        for lobby in lobbies:
+            lobby.add_player(f"g{lobby.id}")
+        return len(lobbies)
+    return batch
+
+
+def remove_player(count: int) -> Batch:
+    lobbies = _sample_lobbies(populated_manager(count))
+    for lobby in lobbies:
+        lobby.add_player(f"g{lobby.id}")
+
+    def batch():
+        for lobby in lobbies:
+            lobby.remove_player(f"g{lobby.id}")
+        return len(lobbies)
+    return batch
+
+
+def get_lobby_by_player(count: int) -> Batch:
+    manager = populated_manager(count)
+    players = [lobby.players[0].id for lobby in _sample_lobbies(manager)]
+
+    async def lookup():
+        for player_id in players:
+            await manager.get_lobby_by_player(player_id)
+
+    def batch():
+        # drive the coroutines by hand, an event loop would dominate the measurement
+        try:
+            lookup().send(None)
+        except StopIteration:
+            pass
+        return len(players)
+    return batch
+
+
+def generate_lobby_id(count: int) -> Batch:
+    manager = populated_manager(count)
+
+    async def generate():
+        for _ in range(100):
+            manager.store.release_lobby(await manager.generate_lobby_id())
+
+    def batch():
+        try:
+            generate().send(None)
+        except StopIteration:
+            pass
+        return 100
+    return batch
+
+
+BOARD_CASES = (shoot, get_opponent_view, get_board, ships_placed, place_ships_randomly)
+MANAGER_CASES = (add_player, remove_player, get_lobby_by_player, generate_lobby_id)
+
+
+def measure(case: Callable[[int], Batch], param: int) -> float:
+    """Median nanoseconds per operation over several batches; building their state is not timed."""
+    per_op = []
+    spent = 0.0
+    while spent < MIN_TIME and len(per_op) < MAX_BATCHES:
+        batch = case(param)
+        start = time.perf_counter()
+        ops = batch()
+        elapsed = time.perf_counter() - start
+        spent += elapsed
+        per_op.append(elapsed / ops * 1e9)
+    return statistics.median(per_op)
+
+
+def run(quick: bool) -> dict[str, float]:
+    results = {}
+    sizes = QUICK_BOARD_SIZES if quick else BOARD_SIZES
+    counts = QUICK_LOBBY_COUNTS if quick else LOBBY_COUNTS
+    for case in BOARD_CASES:
+        for size in sizes:
+            results[f"{case.__name__}[size={size}]"] = measure(case, size)
+    for case in MANAGER_CASES:
+        for count in counts:
+            results[f"{case.__name__}[lobbies={count}]"] = measure(case, count)
+    return results
+
+
+def compare(results: dict[str, float], baseline: dict[str, float], threshold: float) -> list[str]:
+    """Print each result against the baseline and return the names that regressed."""
+    regressions = []
+    print(f"{'benchmark':<40}{'baseline ns':>14}{'now ns':>14}{'change':>9}")
+    for name, now in results.items():
+        before = baseline.get(name)
+        if before is None:
+            print(f"{name:<40}{'-':>14}{now:>14.0f}{'new':>9}")
+            continue
+        change = now / before - 1
+        flag = ""
+        if change > threshold:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print(f"{name:<40}{before:>14.0f}{now:>14.0f}{change:>+9.0%}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--quick", action="store_true", help="small sweep for a fast check")
+    parser.add_argument("--save", metavar="FILE", help="write the results as a JSON baseline")
+    parser.add_argument("--compare", metavar="FILE", help="compare against a saved baseline")
+    parser.add_argument("--threshold", type=float, default=0.25, help="allowed slowdown, e.g. 0.25 = 25%%")
+    args = parser.parse_args()
+
+    results = run(args.quick)
+    report = {
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "unit": "ns/op",
+        "results": results,
+    }
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} benchmarks regressed by more than {args.threshold:.0%}")
+            sys.exit(1)
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
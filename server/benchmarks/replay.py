@@ -0,0 +1,67 @@
+"""Measure replay size and how many replays per second can be decoded and verified.
+
+Run from the repository root:
+
+    python -m server.benchmarks.replay [--games N]
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from ..utils.models import Lobby
+from ..utils.replay import Replay, ReplayFile, save_replay
+
+
+def play_game(n: int) -> Replay:
+    lobby = Lobby(id=f"{n:06d}", isPublic=False, seed=n)
+    lobby.add_player("aaaaaaaa")
+    lobby.add_player("bbbbbbbb")
+    lobby.place_ships_randomly("aaaaaaaa")
+    lobby.place_ships_randomly("bbbbbbbb")
+    lobby.start_game()
+    targets = {p.id: [(x, y) for y in range(lobby.board_size) for x in range(lobby.board_size)]
+               for p in lobby.players}
+    for cells in targets.values():
+        lobby.rng.shuffle(cells)
+    while lobby.game_state["state"] == "playing":
+        shooter = lobby.game_state["turn"]
+        lobby.shoot(shooter, *targets[shooter].pop())
+    return Replay.from_lobby(lobby)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--games", type=int, default=5000)
+    args = parser.parse_args()
+
+    replays = [play_game(n) for n in range(args.games)]
+    blobs = [replay.encode() for replay in replays]
+    size = sum(map(len, blobs)) / len(blobs)
+    turns = sum(replay.turns for replay in replays) / len(replays)
+    print(f"{len(blobs)} replays, {size:.0f} bytes and {turns:.1f} shots on average")
+
+    start = time.perf_counter()
+    decoded = [Replay.decode(blob) for blob in blobs]
+    decode_time = time.perf_counter() - start
+    start = time.perf_counter()
+    ok = sum(replay.verify() for replay in decoded)
+    verify_time = time.perf_counter() - start
+    print(f"decode: {len(blobs) / decode_time:>10.0f} replays/s")
+    print(f"verify: {len(blobs) / verify_time:>10.0f} replays/s ({ok}/{len(blobs)} valid)")
+    print(f"both:   {len(blobs) / (decode_time + verify_time):>10.0f} replays/s")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = save_replay(replays[0], tmp)
+        replay_file = ReplayFile(path)
+        seeks = 10000
+        start = time.perf_counter()
+        for _ in range(seeks):
+            replay_file.shot(random.randrange(replay_file.turns))
+        seek_time = time.perf_counter() - start
+        print(f"seek:   {seek_time / seeks * 1e6:>10.1f} µs per turn lookup on disk ({os.path.getsize(path)} bytes)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""Measure game throughput as the number of worker processes sharing one state store grows.
+
+Every process plays complete games through its own LobbyManager backed by the shared SQLite store
+(lobby claims, player index updates, release), and forwards one message per action to a neighbouring
+worker over the store's pub/sub channel, like a lobby whose players sit on two workers.
+
+Run from the repository root:
+
+    python -m server.benchmarks.scaling [--max-workers N] [--duration SECONDS]
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import tempfile
+import time
+
+from ..utils.lobby_manager import LobbyManager
+from ..utils.models import Player
+from ..utils.state import SQLiteStore
+
+
+async def play_games(store: SQLiteStore, peer: str, deadline: float) -> tuple[int, int]:
+    manager = LobbyManager(store=store)
+    games = actions = 0
+    while time.time() < deadline:
+        a, b = f"{store.worker_id}-{games}-a", f"{store.worker_id}-{games}-b"
+        lobby = await manager.create_lobby(Player(id=a, websocket=None), is_public=False)
+        await manager.join_lobby(b, lobby.id)
+        for player_id in (a, b):
+            for x in range(lobby.ships_required):
+                lobby.place_ship(player_id, x, 0)
+        lobby.start_game()
+        shooter, target = a, b
+        x = y = 0
+        while lobby.game_state["state"] == "playing":
+            lobby.shoot(shooter, x, y)
+            store.publish(peer, {"kind": "deliver", "player_id": target, "payload": {"x": x, "y": y}})
+            actions += 1
+            if shooter == b:
+                x += 1
+                if x == lobby.board_size:
+                    x, y = 0, y + 1
+            shooter, target = target, shooter
+        await store.poll()
+        await manager.leave_lobby(a, lobby.id)
+        await manager.leave_lobby(b, lobby.id)
+        games += 1
+    return games, actions
+
+
+def worker(path: str, index: int, count: int, start: float, duration: float, results):
+    store = SQLiteStore(path, worker_id=f"w{index}")
+    store.open()  # connects before the clock starts
+    while time.time() < start:
+        time.sleep(0.001)
+    games, actions = asyncio.run(play_games(store, f"w{(index + 1) % count}", start + duration))
+    store.close()  # writes are committed behind the game, count the time they take
+    results.put((games, actions))
+
+
+def run(workers: int, duration: float) -> tuple[float, float]:
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "state.db")
+        setup = SQLiteStore(path)
+        setup.open()  # create the schema once
+        setup.close()
+        results = multiprocessing.Queue()
+        start = time.time() + 0.5
+        processes = [multiprocessing.Process(target=worker, args=(path, i, workers, start, duration, results))
+                     for i in range(workers)]
+        for process in processes:
+            process.start()
+        totals = [results.get() for _ in processes]
+        elapsed = time.time() - start
+        for process in processes:
+            process.join()
+    games = sum(g for g, _ in totals)
+    actions = sum(a for _, a in totals)
+    return games / elapsed, actions / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--duration", type=float, default=3.0, help="seconds per measurement")
+    args = parser.parse_args()
+
+    print(f"{'workers':>8}{'games/s':>12}{'actions/s':>12}{'speedup':>10}")
+    baseline = None
+    for workers in range(1, args.max_workers + 1):
+        games, actions = run(workers, args.duration)
+        baseline = baseline or actions
+        print(f"{workers:>8}{games:>12.1f}{actions:>12.1f}{actions / baseline:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
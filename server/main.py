@@ -1,354 +1,935 @@
 import asyncio
-import json
 import logging
-import random
-import string
+import os
+import re
 import time
+from collections import Counter
 from contextlib import asynccontextmanager
 
 import uvicorn
 from fastapi import FastAPI, WebSocket
-
-from .utils import StartMenuOption, LobbyManager
-from .utils.models import Player
+from fastapi.responses import PlainTextResponse
+
+from common.codec import negotiate
+from .utils import Context, LobbyManager, Router, StartMenuOption
+from .utils.ai import DEFAULT_DIFFICULTY, DIFFICULTIES, Sightings, TargetingPool
+from .utils.broadcast import LobbyBroadcast
+from .utils.codec import Encoded
+from .utils.connection import Connection, RemoteConnection, broadcast
+from .utils.eventlog import EventLog
+from .utils.heartbeat import HeartbeatTracker
+from .utils.ids import PLAYER_ID_ALPHABET, PLAYER_ID_LENGTH, IdAllocator
+from .utils.lifecycle import LobbyLifecycle, parse_ttls
+from .utils.logs import MessageLog, parse_sample_rates, setup_logging, start_listener
+from .utils.metrics import Metrics
+from .utils.state import make_store
+from .utils.timers import TimerService
+from .utils.models import (DEFAULT_BOARD_SIZE, MAX_BOARD_SIZE, ActionMessage, CoordsMessage, OptionMessage,
+                           PlaceShipMessage, PlaceShipsMessage, Player, ReplayMessage, check_board,
+                           default_fleet)
+from .utils.replay import EXTENSION, Replay, ReplayError, ReplayFile, save_replay
 
 
 @asynccontextmanager
 async def on_startup(_: FastAPI):
-    asyncio.create_task(heartbeat_checker())
+    # fork the search processes before this worker starts threads of its own, see TargetingPool
+    targeting.start()
+    start_listener(log_listener)
+    store.open()
+    if journal:
+        recovered = lobby_manager.recover()
+        logger.info(f"Recovered {len(recovered)} lobbies from {EVENT_LOG_DIR}")
+        for lobby in recovered:
+            if lobby.game_state.get("state") == "placing":
+                timers.schedule((lobby.id, "placement"), PLACEMENT_TIME, finalize_placement, lobby.id)
+            schedule_turn(lobby)
+        asyncio.create_task(journal_loop())
+    asyncio.create_task(timers.run())
+    asyncio.create_task(loop_lag_monitor())
+    if HEARTBEAT_MODE == "app":
+        asyncio.create_task(heartbeat_checker())
+    asyncio.create_task(matchmaking_loop())
+    asyncio.create_task(lobby_sweeper())
+    if STATE_BACKEND != "memory":
+        asyncio.create_task(store_listener())
     yield
+    targeting.shutdown()
+    store.close()
+    if journal:
+        journal.close()
 
 
 app = FastAPI(redoc_url=None, lifespan=on_startup)
-logging.basicConfig(level=logging.INFO)
+# records are formatted and written by a background thread, see setup_logging
+LOG_LEVEL = os.environ.get("HTF_LOG_LEVEL", "INFO")
+LOG_FORMAT = os.environ.get("HTF_LOG_FORMAT", "text")  # "text" or "json", one object per line
+# share of inbound messages logged per kind, e.g. "heartbeat=0,shoot=0.1"; other kinds are always logged
+LOG_SAMPLE = os.environ.get("HTF_LOG_SAMPLE", "heartbeat=0")
 logger = logging.getLogger("server")
 
-lobby_manager = LobbyManager()
-
-CURRENT_USERS = {}  # {player_id: websocket}
-USER_HEARTBEATS = {}  # {player_id: last_heartbeat_timestamp}
+# "memory" keeps shared state in this process; "sqlite" shares it between worker processes
+STATE_BACKEND = os.environ.get("HTF_STATE_BACKEND", "memory")
+STATE_PATH = os.environ.get("HTF_STATE_PATH", "hackthefleet-state.db")
+WORKERS = int(os.environ.get("HTF_WORKERS", "1"))
+STORE_POLL_INTERVAL = 0.01  # seconds between checks for messages and state changes from other workers
+ROLE_LEASE = 10  # seconds a worker holds a role such as matchmaker without renewing it
+
+# "Play vs Computer": the computer's shots are searched for in other processes, never on the event loop
+AI_PROCESSES = int(os.environ.get("HTF_AI_PROCESSES", "1"))  # 0 searches in a thread instead
+AI_MOVE_BUDGET = float(os.environ.get("HTF_AI_MOVE_BUDGET", "1"))  # seconds of search per shot
+AI_THINK_TIME = 0.8  # seconds the computer waits before shooting, so its shots can be followed
+targeting = TargetingPool(AI_PROCESSES)  # started in on_startup
+log_listener = setup_logging(LOG_LEVEL, LOG_FORMAT, start=False)  # records wait in the queue until on_startup
+
+# directory for the lobby event log and snapshots; unset disables crash recovery
+EVENT_LOG_DIR = os.environ.get("HTF_EVENT_LOG")
+EVENT_LOG_FSYNC = os.environ.get("HTF_EVENT_LOG_FSYNC", "batch")  # "always", "batch" or "off"
+EVENT_LOG_FLUSH_INTERVAL = 0.05  # seconds between batched log writes
+SNAPSHOT_INTERVAL = 60  # seconds between snapshots that compact the event log
+# finished games are saved here as replays; set it to an empty string to stop recording them
+REPLAY_DIR = os.environ.get("HTF_REPLAY_DIR", "replays")
+REPLAY_ID = re.compile(r"^\d{6}-\d+$")
+
+store = make_store(STATE_BACKEND, STATE_PATH)
+WORKER_ID = store.worker_id
+journal = EventLog(EVENT_LOG_DIR, fsync=EVENT_LOG_FSYNC) if EVENT_LOG_DIR else None
+# board and fleet of public games and of private ones created without their own
+BOARD_SIZE = int(os.environ.get("HTF_BOARD_SIZE", DEFAULT_BOARD_SIZE))
+FLEET = [int(length) for length in os.environ.get("HTF_FLEET", "").split(",") if length.strip()] or None
+if error := check_board(BOARD_SIZE, FLEET or default_fleet(BOARD_SIZE)):
+    raise SystemExit(f"HTF_BOARD_SIZE / HTF_FLEET: {error}")
+# idle seconds per game state before a lobby is closed, e.g. "waiting=300,finished=60"; see DEFAULT_TTLS
+LOBBY_TTLS = parse_ttls(os.environ.get("HTF_LOBBY_TTL", ""))
+MAX_LOBBIES = int(os.environ.get("HTF_MAX_LOBBIES", "0"))  # lobbies this worker holds at most, 0 for no cap
+LOBBY_SWEEP_INTERVAL = 1  # seconds between checks for idle lobbies
+# debugging aid: compare the player index with the lobbies on every sweep and log what disagrees
+CHECK_PLAYER_INDEX = bool(int(os.environ.get("HTF_CHECK_INDEX", "0")))
+lobby_manager = LobbyManager(store=store, journal=journal, board_size=BOARD_SIZE, fleet=FLEET,
+                             lifecycle=LobbyLifecycle(LOBBY_TTLS, MAX_LOBBIES, resolution=LOBBY_SWEEP_INTERVAL))
+
+CURRENT_USERS: dict[str, Connection] = {}  # {player_id: Connection}, sockets held by this worker
+player_ids = IdAllocator(store, "players", PLAYER_ID_ALPHABET, PLAYER_ID_LENGTH)  # unique across workers
 HEARTBEAT_TIMEOUT = 10  # seconds
+MATCHMAKING_TICK = 0.25  # seconds between batched public matchmaking rounds
+SEND_TIMEOUT = 2  # seconds a single outbound frame may take before the connection is dropped
+OUTBOUND_QUEUE_SIZE = 64  # messages buffered per connection
+OUTBOUND_POLICY = os.environ.get("HTF_OUTBOUND_POLICY", "coalesce")  # "coalesce" or "disconnect"
+# "app": clients send text heartbeats and USER_HEARTBEATS expires silent ones,
+# "ping": uvicorn sends WebSocket protocol pings and drops peers that stop answering
+HEARTBEAT_MODE = os.environ.get("HTF_HEARTBEAT_MODE", "app")
+HEARTBEAT_PING_INTERVAL = 5  # seconds, only used in "ping" mode
+# both can be shortened through the environment, e.g. for load tests
+COUNTDOWN_SECONDS = int(os.environ.get("HTF_COUNTDOWN", "3"))  # seconds announced before placement starts
+PLACEMENT_TIME = float(os.environ.get("HTF_PLACEMENT_TIME", "45"))  # seconds players get to place their ships
+TURN_TIME = 30  # seconds per shot before the server fires a random one for the player
+MAX_MISSED_TURNS = 2  # consecutive timed-out turns after which the player forfeits
+timers = TimerService()  # countdowns, placement deadlines and turn timers, keyed (lobby_id, name)
+USER_HEARTBEATS = HeartbeatTracker(HEARTBEAT_TIMEOUT)
+LOOP_LAG_INTERVAL = 0.25  # seconds between event-loop lag probes
+GAME_STATES = ("waiting", "placing", "playing", "finished")
+
+# served at /metrics; every worker keeps and serves its own
+metrics = Metrics()
+metrics.gauge("htf_connected_users", "WebSockets held by this worker.", lambda: len(CURRENT_USERS))
+metrics.gauge("htf_lobbies", "Lobbies on this worker by game state.", lambda: {
+    **dict.fromkeys(GAME_STATES, 0),
+    **Counter(lobby.game_state["state"] for lobby in lobby_manager.lobbies.values()),
+}, label_name="state")
+
+
+def lobby_memory() -> dict[str, int]:
+    """Estimated bytes held by this worker's lobbies, summed per game state."""
+    totals = dict.fromkeys(GAME_STATES, 0)
+    for lobby in lobby_manager.lobbies.values():
+        state = lobby.game_state["state"]
+        totals[state] = totals.get(state, 0) + lobby.memory_estimate()
+    return totals
+
+
+metrics.gauge("htf_lobby_memory_bytes", "Estimated memory held by lobbies on this worker, by game state.",
+              lobby_memory, label_name="state")
+metrics.gauge("htf_lobby_memory_max_bytes", "Estimated memory of the largest lobby on this worker.",
+              lambda: max((lobby.memory_estimate() for lobby in lobby_manager.lobbies.values()), default=0))
+metrics.gauge("htf_public_queue_length", "Players waiting for a public game.", lambda: len(lobby_manager.public_queue))
+metrics.gauge("htf_timers_pending", "Game timers waiting to fire.", lambda: len(timers))
+metrics.histogram_view("htf_matchmaking_wait_seconds", "Time matched players waited in the public queue.",
+                       lobby_manager.public_queue.wait_times)
+broadcast_seconds = metrics.histogram("htf_broadcast_seconds", "Time to build and queue a lobby broadcast.")
+spectator_broadcast_seconds = metrics.histogram("htf_spectator_broadcast_seconds",
+                                                "Time to build, encode and queue an update for a lobby's spectators.")
+metrics.gauge("htf_spectators", "Spectators watching lobbies on this worker.", lambda: len(lobby_manager.spectating))
+broadcast_refused = metrics.counter("htf_broadcast_refused_total", "Broadcast messages refused by closed connections.")
+lobbies_expired = metrics.counter("htf_lobbies_expired_total", "Lobbies closed after idling past their TTL.",
+                                  label_name="state")
+lobbies_refused = metrics.counter("htf_lobbies_refused_total", "Lobbies not created because of HTF_MAX_LOBBIES.")
+computer_move_seconds = metrics.histogram("htf_computer_move_seconds", "Time the computer took to pick a shot.")
+loop_lag_seconds = metrics.histogram("htf_event_loop_lag_seconds", "How late a sleeping task wakes up.")
 
 START_MENU_OPTIONS = [
-    StartMenuOption(display_name="Join Public Game", id="join_public_game", disabled=True),
+    StartMenuOption(display_name="Join Public Game", id="join_public_game"),
     StartMenuOption(display_name="Join Private Game", id="join_private_game", input=True,
                     input_placeholder="Enter the game ID"),
     StartMenuOption(display_name="Create Private Game", id="create_private_game"),
+    StartMenuOption(display_name="Create Custom Private Game", id="create_custom_game", input=True,
+                    input_placeholder=f"Enter the board size (up to {MAX_BOARD_SIZE})"),
+    StartMenuOption(display_name="Play vs Computer", id="play_computer", input=True,
+                    input_placeholder=f"Difficulty: {', '.join(DIFFICULTIES)} (Enter for {DEFAULT_DIFFICULTY})"),
+    StartMenuOption(display_name="Watch Game", id="watch_game", input=True,
+                    input_placeholder="Enter the game ID"),
 ]
 
 
-def generate_player_id():
-    player_id = ''.join(random.choices(string.ascii_letters + string.digits, k=8))
+async def generate_player_id():
+    player_id = await player_ids.allocate()
     while player_id in CURRENT_USERS:
-        player_id = ''.join(random.choices(string.ascii_letters + string.digits, k=8))
+        player_id = await player_ids.allocate()
     return player_id
 
 
+def board_delta(lobby, changes=None, logs: list[str] | None = None) -> LobbyBroadcast:
+    """Build a versioned delta update carrying only the changed cells as [x, y, cell] triples.
+
+    `changes(player_id)` returns the cells that changed for that player as {"board": [...]} (their
+    own board) and/or {"opponent_view": [...]} (their view of the opponent's board).
+    """
+    def own(player_id: str) -> dict:
+        return {"board": [], "opponent_view": [], **((changes and changes(player_id)) or {})}
+
+    return LobbyBroadcast(lobby, {"type": "delta", "version": lobby.version, "logs": logs or []}, own=own)
+
+
+def spectator_snapshot(lobby, message: str | None = None, logs: list[str] | None = None,
+                       advance: bool = True) -> dict:
+    """Everything a spectator shows: both boards with ships hidden, the players and the game state.
+
+    Sent to all spectators it takes the next number of the feed. A snapshot for a single spectator
+    (`advance=False`) repeats the last number instead, so the others see no gap.
+    """
+    if advance:
+        lobby.spectator_seq += 1
+    return {
+        "type": "spectate",
+        "message": message,
+        "lobby_id": lobby.id,
+        "seq": lobby.spectator_seq,
+        "state": lobby.game_state,
+        "players": [p.id for p in lobby.players],
+        "boards": {p.id: lobby.get_public_board(p.id) for p in lobby.players},
+        "board_size": lobby.board_size,
+        "spectators": len(lobby.spectators),
+        "closed": lobby.id not in lobby_manager.lobbies,
+        "logs": logs or [],
+    }
+
+
+def spectator_delta(lobby, boards: dict[str, list] | None = None, logs: list[str] | None = None) -> dict:
+    """A spectator update carrying the cells that changed per player's board as [x, y, cell] triples.
+
+    `seq` counts the updates of the lobby's feed; a client that sees a gap asks for a new snapshot.
+    """
+    lobby.spectator_seq += 1
+    return {
+        "type": "spectate_delta",
+        "lobby_id": lobby.id,
+        "seq": lobby.spectator_seq,
+        "state": lobby.game_state,
+        "boards": boards or {},
+        "closed": lobby.id not in lobby_manager.lobbies,
+        "logs": logs or [],
+    }
+
+
+def connection_for(player_id: str) -> Connection | RemoteConnection | None:
+    """Return the player's local Connection, or a RemoteConnection if another worker holds the socket."""
+    conn = CURRENT_USERS.get(player_id)
+    if conn is not None or STATE_BACKEND == "memory":
+        return conn
+    worker_id = store.session_worker(player_id)
+    if worker_id is None or worker_id == WORKER_ID:
+        return None
+    return RemoteConnection(player_id=player_id, worker_id=worker_id, store=store)
+
+
+matchmaker = WORKER_ID  # the worker that runs the public queue, renewed by store_listener
+
+
+def matchmaker_worker() -> str:
+    return matchmaker
+
+
+async def forward_message(worker_id: str, ctx: Context, raw: dict):
+    store.publish(worker_id, {"kind": "dispatch", "player_id": ctx.player.id, "worker_id": WORKER_ID,
+                              "message": raw})
+
+
+router = Router(lobby_manager, worker_id=WORKER_ID, forward=forward_message if STATE_BACKEND != "memory" else None,
+                metrics=metrics, message_log=MessageLog(logger, parse_sample_rates(LOG_SAMPLE)))
+
+
+async def store_listener():
+    """Handle messages other workers published for this one and keep this worker's roles alive."""
+    global matchmaker
+    last_renewal = 0.0
+    while True:
+        now = asyncio.get_running_loop().time()
+        if now - last_renewal > ROLE_LEASE / 3:
+            try:
+                matchmaker = await store.call(store.claim_role, "matchmaker", WORKER_ID, ROLE_LEASE)
+            except Exception as exc:
+                logger.error(f"Renewing the matchmaker role failed: {exc}")
+            last_renewal = now
+        try:
+            messages = await store.poll()
+        except Exception as exc:
+            logger.error(f"Reading worker messages failed: {exc}")
+            messages = []
+        for message in messages:
+            try:
+                await handle_worker_message(message)
+            except Exception as exc:
+                logger.error(f"Worker message {message.get('kind')} failed: {exc}")
+        if not messages:
+            await asyncio.sleep(STORE_POLL_INTERVAL)
+
+
+async def handle_worker_message(message: dict):
+    kind = message.get("kind")
+    if kind == "deliver":
+        conn = CURRENT_USERS.get(message["player_id"])
+        if conn:
+            conn.send(message["payload"], coalesce=message.get("coalesce", False))
+    elif kind == "dispatch":
+        route = router.route_for(message["message"])
+        if route is None:
+            return
+        player = Player(id=message["player_id"], websocket=None)
+        conn = RemoteConnection(player_id=player.id, worker_id=message["worker_id"], store=store)
+        await router.call(route, Context(player=player, conn=conn), message["message"])
+    elif kind == "left":
+        await player_left(message["player_id"])
+
+
+def broadcast_lobby(lobby, payload_for, coalesce: bool = False):
+    """Queue `payload_for(player_id)` for every connected player of `lobby`.
+
+    Each connection's writer task delivers it, so a stalled or broken socket neither delays the other
+    players nor raises into the calling handler. `coalesce` marks board deltas that a slow client may
+    skip in favour of newer state.
+    """
+    start = time.perf_counter()
+    messages = [(conn, payload_for(p.id)) for p in lobby.players if (conn := connection_for(p.id))]
+    refused = broadcast(messages, coalesce=coalesce)
+    broadcast_seconds.observe(time.perf_counter() - start)
+    for player_id in refused:
+        broadcast_refused.inc()
+        logger.warning(f"Broadcast to player {player_id} in lobby {lobby.id} was refused (connection closed).")
+
+
+def broadcast_spectators(lobby, build, coalesce: bool = False):
+    """Send one update to every spectator of `lobby`, encoded once per wire format.
+
+    `build()` returns the payload and only runs when someone is watching. Spectators whose
+    connection refuses it stop watching.
+    """
+    if not lobby.spectators:
+        return
+    start = time.perf_counter()
+    payload = Encoded(build())
+    messages, gone = [], []
+    for spectator_id in lobby.spectators:
+        conn = connection_for(spectator_id)
+        if conn:
+            messages.append((conn, payload))
+        else:
+            gone.append(spectator_id)  # no session on any worker, they disconnected
+    refused = broadcast(messages, coalesce=coalesce)
+    spectator_broadcast_seconds.observe(time.perf_counter() - start)
+    for spectator_id in refused + gone:
+        lobby_manager.stop_watching(spectator_id)
+
+
+async def matchmaking_loop():
+    while True:
+        await asyncio.sleep(MATCHMAKING_TICK)
+        try:
+            lobbies = await lobby_manager.match_public_games()
+        except Exception as exc:
+            logger.error(f"Matchmaking round failed: {exc}")
+            continue
+        for lobby in lobbies:
+            broadcast_lobby(lobby, LobbyBroadcast(lobby, {
+                "message": "Joined public game",
+                "version": lobby.version,
+                "logs": ["Matched with an opponent."]
+            }, lobby_data=True, boards=True))
+            logger.info(f"Matched players {[p.id for p in lobby.players]} in public game {lobby.id}")
+        if lobbies:
+            stats = lobby_manager.public_queue.wait_times.snapshot()
+            logger.info(f"Matched {len(lobbies)} public games, queue wait avg {stats['avg']:.2f}s "
+                        f"max {stats['max']:.2f}s, {len(lobby_manager.public_queue)} still waiting")
+
+
+async def journal_loop():
+    """Flush the event log in batches and periodically replace it with a snapshot."""
+    loop = asyncio.get_running_loop()
+    last_snapshot = loop.time()
+    while True:
+        await asyncio.sleep(EVENT_LOG_FLUSH_INTERVAL)
+        try:
+            await journal.flush_async()
+            if loop.time() - last_snapshot >= SNAPSHOT_INTERVAL:
+                await lobby_manager.snapshot()
+                last_snapshot = loop.time()
+        except Exception as exc:
+            logger.error(f"Writing the event log failed: {exc}")
+
+
+def record_replay(lobby):
+    """Save the lobby's finished game as a replay without blocking the event loop.
+
+    The replay is taken from the lobby right away, its players may leave before it is written.
+    """
+    if not REPLAY_DIR:
+        return
+    try:
+        replay = Replay.from_lobby(lobby)
+    except ReplayError as exc:
+        logger.error(f"Saving the replay of lobby {lobby.id} failed: {exc}")
+        return
+    asyncio.create_task(write_replay(replay))
+
+
+async def write_replay(replay: Replay):
+    try:
+        path = await asyncio.to_thread(save_replay, replay, REPLAY_DIR)
+        logger.info(f"Saved replay of lobby {replay.lobby_id} to {path}")
+    except Exception as exc:
+        logger.error(f"Saving the replay of lobby {replay.lobby_id} failed: {exc}")
+
+
+async def loop_lag_monitor():
+    """Sleep for a fixed interval and record how much later than asked the loop woke us."""
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(LOOP_LAG_INTERVAL)
+        loop_lag_seconds.observe(max(0.0, loop.time() - start - LOOP_LAG_INTERVAL))
+
+
+async def lobby_sweeper():
+    """Close the lobbies that went idle past the TTL of their game state, telling anyone still in them."""
+    while True:
+        await asyncio.sleep(LOBBY_SWEEP_INTERVAL)
+        for lobby in lobby_manager.expired_lobbies():
+            state = lobby.game_state["state"]
+            ttl = lobby_manager.lifecycle.ttls[state]
+            message = {"type": "log", "message": f"[red]Lobby closed after {ttl:g}s without activity.[/red]"}
+            encoded = Encoded(message)
+            broadcast_lobby(lobby, lambda _: encoded)
+            size = lobby.memory_estimate()
+            lobby_manager.close_lobby(lobby.id)
+            broadcast_spectators(lobby, lambda: spectator_delta(lobby, logs=[message["message"]]))
+            timers.cancel_group(lobby.id)
+            lobbies_expired.inc(state)
+            logger.info(f"Closed idle lobby {lobby.id} ({state}, about {size} bytes)")
+        if CHECK_PLAYER_INDEX:
+            for problem in lobby_manager.check_player_index():
+                logger.error(f"Player index: {problem}")
+
+
 async def heartbeat_checker():
     while True:
-        now = time.time()
-        to_remove = []
-        for player_id, last_beat in USER_HEARTBEATS.items():
-            if now - last_beat > HEARTBEAT_TIMEOUT:
-                logger.info(f"Player {player_id} timed out (no heartbeat).")
-                to_remove.append(player_id)
-        for player_id in to_remove:
-            USER_HEARTBEATS.pop(player_id, None)
-            ws = CURRENT_USERS.pop(player_id, None)
-            if ws:
-                await ws.close()
-        await asyncio.sleep(HEARTBEAT_TIMEOUT // 2)
+        for player_id in USER_HEARTBEATS.expired():
+            logger.info(f"Player {player_id} timed out (no heartbeat).")
+            conn = CURRENT_USERS.pop(player_id, None)
+            if conn:
+                await conn.close()
+        await asyncio.sleep(USER_HEARTBEATS.resolution)
+
+
+def countdown(lobby_id: str, remaining: int):
+    """Announce one second of the pre-placement countdown, then schedule the next step."""
+    lobby = lobby_manager.lobbies.get(lobby_id)
+    if not lobby or lobby.game_state.get("state") != "waiting":
+        return
+    if len(lobby.players) < 2:
+        message = Encoded({"type": "log", "message": "[red]Countdown cancelled, a player left.[/red]"})
+        broadcast_lobby(lobby, lambda _: message)
+        return
+    if remaining > 0:
+        message = Encoded({"type": "log", "message": f"[green]Placement starting in {remaining}...[/green]"})
+        broadcast_lobby(lobby, lambda _: message)
+        timers.schedule((lobby_id, "countdown"), 1, countdown, lobby_id, remaining - 1)
+        return
+
+    lobby.begin_placement()
+    for computer_id in lobby.computers:
+        lobby.place_ships_randomly(computer_id)
+    fleet = ", ".join(f"{count} of length {length}"
+                      for length, count in sorted(Counter(lobby.fleet).items(), reverse=True))
+    broadcast_lobby(lobby, LobbyBroadcast(lobby, {
+        "type": "placing",
+        "board_size": lobby.board_size,
+        "fleet": lobby.fleet,
+        "version": lobby.version,
+        "owner_id": lobby.owner_id,
+        "placement_time": PLACEMENT_TIME,
+        "logs": ["Placement phase started. Place your ships!  \n[gray](Controls: WASD or arrows to move, P or Enter to place, "
+                 "O to rotate, R to remove, C to confirm the layout)[/gray]",
+                 f"[gray]Ships to place: {fleet}.[/gray]"]
+    }, boards=True, own=lambda player_id: {"you": player_id}))
+    broadcast_spectators(lobby, lambda: spectator_delta(lobby, logs=["Players are placing their ships."]))
+    timers.schedule((lobby_id, "placement"), PLACEMENT_TIME, finalize_placement, lobby_id)
+
+
+def finalize_placement(lobby_id: str):
+    lobby = lobby_manager.lobbies.get(lobby_id)
+    if not lobby:
+        return
+    if lobby.game_state.get("state") != "placing":
+        return
+
+    for p in lobby.players:
+        if lobby.ships_placed(p.id) < lobby.ships_required:
+            lobby.place_ships_randomly(p.id)
+
+    result = lobby.start_game()
+    if result.get("error"):
+        logger.warning(f"Lobby {lobby_id} could not start after placement: {result['error']}")
+        return
+
+    broadcast_lobby(lobby, LobbyBroadcast(lobby, {
+        "type": "start",
+        "version": lobby.version,
+        "owner_id": lobby.owner_id,
+        "turn_time": TURN_TIME,
+        "logs": ["Game started!", f"[gray]You have {TURN_TIME}s per shot.[/gray]"]
+    }, boards=True, own=lambda player_id: {"you": player_id}))
+    broadcast_spectators(lobby, lambda: spectator_delta(lobby, logs=["Game started!"]))
+    schedule_turn(lobby)
+
+
+def schedule_turn(lobby):
+    """(Re)start the turn timer of the player to move, or drop it once the game is over.
+
+    On the computer's turn the timer plays its shot instead.
+    """
+    turn = lobby.game_state.get("turn")
+    if lobby.game_state.get("state") == "playing" and turn in lobby.computers:
+        timers.schedule((lobby.id, "turn"), AI_THINK_TIME, computer_turn, lobby.id, turn)
+    elif lobby.game_state.get("state") == "playing" and turn:
+        timers.schedule((lobby.id, "turn"), TURN_TIME, turn_timeout, lobby.id, turn)
+    else:
+        timers.cancel((lobby.id, "turn"))
+
+
+async def computer_turn(lobby_id: str, player_id: str):
+    """Search for the computer's shot in the targeting pool and fire it through Lobby.shoot."""
+    lobby = lobby_manager.lobbies.get(lobby_id)
+    if not lobby or lobby.game_state.get("state") != "playing" or lobby.game_state.get("turn") != player_id:
+        return
+    seen = Sightings.of(lobby, player_id)
+    if seen is None:
+        return
+    start = time.perf_counter()
+    target = await targeting.choose(seen, lobby.computers[player_id], AI_MOVE_BUDGET)
+    computer_move_seconds.observe(time.perf_counter() - start)
+    # the human may have shot, left or forfeited while the search ran
+    if (lobby_manager.lobbies.get(lobby_id) is not lobby or lobby.game_state.get("state") != "playing"
+            or lobby.game_state.get("turn") != player_id):
+        return
+    if target is None or seen.is_shot(target[1] * seen.size + target[0]):
+        target = lobby.random_target(player_id)
+    if target is None:
+        return
+    x, y = target
+    result = lobby.shoot(player_id, x, y)
+    if result.get("error"):
+        logger.warning(f"Computer {player_id} in lobby {lobby_id} could not shoot at ({x},{y}): {result['error']}")
+        return
+    broadcast_shot(lobby, player_id, x, y, result, prefix="The computer shot")
+
+
+def turn_timeout(lobby_id: str, player_id: str):
+    """Fire a random shot for a player who let their turn run out, or make them forfeit."""
+    lobby = lobby_manager.lobbies.get(lobby_id)
+    if not lobby or lobby.game_state.get("state") != "playing" or lobby.game_state.get("turn") != player_id:
+        return
+    missed = lobby.missed_turns.get(player_id, 0) + 1
+    lobby.missed_turns[player_id] = missed
+    target = lobby.random_target(player_id)
+    if missed >= MAX_MISSED_TURNS or target is None:
+        lobby.forfeit(player_id)
+        logs = [f"Player {player_id} ran out of time {missed} times and forfeits."]
+        broadcast_lobby(lobby, board_delta(lobby, logs=logs), coalesce=True)
+        broadcast_spectators(lobby, lambda: spectator_delta(lobby, logs=logs))
+        record_replay(lobby)
+        return
+    x, y = target
+    result = lobby.shoot(player_id, x, y)
+    broadcast_shot(lobby, player_id, x, y, result, prefix=f"Time's up for {player_id}, random shot")
+
+
+def broadcast_shot(lobby, shooter_id: str, x: int, y: int, result: dict, prefix: str | None = None):
+    """Send the outcome of a shot to both players and move the turn timer on."""
+    # an already-shot cell changes nothing, the delta then only carries state and logs
+    changed = [[x, y, result["cell"]]] if not result.get("already") else None
+    outcome = "hit" if result.get("hit") else "miss"
+    if result.get("sunk"):
+        outcome += f", sunk a ship of {result['sunk']}"
+    logs = [f"{prefix or f'Player {shooter_id} shot'} at ({x},{y}) - {outcome}"]
+    broadcast_lobby(lobby, board_delta(lobby, lambda player_id: (
+        {"opponent_view": changed} if player_id == shooter_id else {"board": changed}) if changed else None,
+        logs), coalesce=True)
+    target = next((p.id for p in lobby.players if p.id != shooter_id), None)
+    broadcast_spectators(lobby, lambda: spectator_delta(lobby, {target: changed} if changed and target else None, logs))
+    if not result.get("already"):
+        schedule_turn(lobby)
+    if result.get("winner"):
+        record_replay(lobby)
+
+
+@router.text("heartbeat")
+async def handle_heartbeat(ctx: Context):
+    # the deadline itself is refreshed for every inbound frame in websocket_endpoint
+    ctx.conn.send("heartbeat_ack")
+
+
+@router.text("MENU_start_options")
+async def handle_start_options(ctx: Context):
+    options = [option.model_dump() for option in START_MENU_OPTIONS]
+    ctx.conn.send({"options": options})
+
+
+async def create_requested_lobby(ctx: Context, board_size: int | None, fleet: list[int] | None):
+    """Create a private lobby for the player with the board they asked for, or tell them why not."""
+    if board_size is not None or fleet is not None:
+        board_size = board_size or BOARD_SIZE
+        fleet = fleet or default_fleet(board_size)
+        if error := check_board(board_size, fleet):
+            ctx.conn.send({"error": error})
+            return None
+    lobby = await lobby_manager.create_lobby(ctx.player, is_public=False, board_size=board_size, fleet=fleet)
+    if lobby is None:
+        lobbies_refused.inc()
+        ctx.conn.send({"error": "The server is full, please try again later"})
+    return lobby
+
+
+def lobby_created(lobby, player_id: str, message: str, logs: list[str]) -> dict:
+    return {
+        "lobby_id": lobby.id,
+        "state": lobby.game_state,
+        "message": message,
+        "lobby_data": {"players": [p.id for p in lobby.players]},
+        "owner_id": lobby.owner_id,
+        "board": lobby.get_board(player_id),
+        "opponent_view": lobby.get_opponent_view(player_id),
+        "version": lobby.version,
+        "logs": logs,
+    }
+
+
+@router.route("create_private_game", schema=OptionMessage)
+@router.route("create_custom_game", schema=OptionMessage)
+async def handle_create_private_game(ctx: Context):
+    player, msg = ctx.player, ctx.msg
+    board_size = msg.board_size
+    if msg.option == "create_custom_game":
+        try:
+            board_size = int(msg.input or "")
+        except ValueError:
+            ctx.conn.send({"error": "Board size must be a number"})
+            return
+    lobby = await create_requested_lobby(ctx, board_size, msg.fleet)
+    if lobby is None:
+        return
+    ctx.conn.send(lobby_created(lobby, player.id, "Lobby created",
+                                ["Lobby created.", "[yellow]Waiting for players...[/yellow]"]))
+    logger.info(f"Created private lobby {lobby.id}")
+
+
+@router.route("play_computer", schema=OptionMessage)
+async def handle_play_computer(ctx: Context):
+    player, msg = ctx.player, ctx.msg
+    difficulty = (msg.input or "").strip().lower() or DEFAULT_DIFFICULTY
+    if difficulty not in DIFFICULTIES:
+        ctx.conn.send({"error": f"Difficulty must be one of {', '.join(DIFFICULTIES)}"})
+        return
+    lobby = await create_requested_lobby(ctx, msg.board_size, msg.fleet)
+    if lobby is None:
+        return
+    lobby.add_computer(await generate_player_id(), difficulty)
+    ctx.conn.send(lobby_created(lobby, player.id, "Playing vs computer",
+                                [f"Playing against the computer ({difficulty})."]))
+    logger.info(f"Player {player.id} plays the computer ({difficulty}) in lobby {lobby.id}")
+    countdown(lobby.id, COUNTDOWN_SECONDS)
+
+
+@router.route("join_public_game", schema=OptionMessage, home=lambda ctx, raw: matchmaker_worker())
+async def handle_join_public_game(ctx: Context):
+    if ctx.player.id in lobby_manager.player_lobbies:
+        ctx.conn.send({"error": "Leave your lobby before joining a public game"})
+        return
+    await lobby_manager.join_public_game(ctx.player)
+    ctx.conn.send({"message": "Waiting for opponent..."})
+
+
+@router.route("join_private_game", schema=OptionMessage,
+              home=lambda ctx, raw: lobby_manager.find_lobby_home(str(raw.get("input") or "")))
+async def handle_join_private_game(ctx: Context):
+    player = ctx.player
+    lobby_id = ctx.msg.input
+    if not lobby_id:
+        ctx.conn.send({"error": "Lobby ID is required"})
+        return
+
+    lobby = await lobby_manager.get_lobby(lobby_id)
+    if not lobby:
+        ctx.conn.send({"error": "Lobby not found"})
+        return
+
+    if not await lobby_manager.join_lobby(player.id, lobby_id):
+        ctx.conn.send({"error": "Failed to join lobby"})
+        return
+
+    broadcast_lobby(lobby, LobbyBroadcast(lobby, {
+        "version": lobby.version,
+        "logs": [f"Player {player.id} joined the lobby."]
+    }, lobby_data=True, boards=True, own=lambda player_id: {
+        "message": "Joined private game" if player_id == player.id else "Lobby update"}))
+    broadcast_spectators(lobby, lambda: spectator_snapshot(lobby, logs=[f"Player {player.id} joined the lobby."]))
+
+    logger.info(f"Player {player.id} joined private game {lobby.id}")
+
+
+@router.route("watch_game", schema=OptionMessage,
+              home=lambda ctx, raw: lobby_manager.find_lobby_home(str(raw.get("input") or "")))
+async def handle_watch_game(ctx: Context):
+    player = ctx.player
+    lobby_id = ctx.msg.input
+    if not lobby_id:
+        ctx.conn.send({"error": "Lobby ID is required"})
+        return
+    if lobby_manager.player_lobbies.get(player.id):
+        ctx.conn.send({"error": "Leave your game before watching another"})
+        return
+    lobby = lobby_manager.watch(player.id, lobby_id)
+    if not lobby:
+        ctx.conn.send({"error": "Lobby not found" if lobby_id not in lobby_manager.lobbies else "Cannot watch this game"})
+        return
+    # queued like the feed updates, so the spectator gets those that follow it in order
+    ctx.conn.send(spectator_snapshot(lobby, "Watching game", [f"Watching game {lobby.id}."], advance=False))
+    logger.info(f"Player {player.id} is watching game {lobby.id} ({len(lobby.spectators)} spectators)")
+
+
+@router.route("start_game", schema=ActionMessage, needs_lobby=True)
+async def handle_start_game(ctx: Context):
+    lobby = ctx.lobby
+    if lobby.owner_id != ctx.player.id:
+        ctx.conn.send(
+            {"type": "log", "message": "[red]Only the owner can start the game.[/red]"})
+        return
+    if len(lobby.players) < 2:
+        ctx.conn.send({"type": "log",
+                             "message": "[red]At least 2 players are required to start the game.[/red]"})
+        return
+    if lobby.game_state.get("state") != "waiting" or (lobby.id, "countdown") in timers:
+        ctx.conn.send(
+            {"type": "log", "message": "[red]Game has already started.[/red]"})
+        return
+
+    # the countdown runs on the timer service, this player's receive loop carries on right away
+    countdown(lobby.id, COUNTDOWN_SECONDS)
+
+
+@router.route("place_ship", schema=PlaceShipMessage, needs_lobby=True, coords=True)
+async def handle_place_ship(ctx: Context):
+    lobby, player = ctx.lobby, ctx.player
+    result = lobby.place_ship(player.id, ctx.msg.x, ctx.msg.y, ctx.msg.vertical)
+    if result.get("error"):
+        ctx.conn.send({"type": "log", "message": f"[red]{result['error']}[/red]"})
+        return
+
+    cells = [[x, y, "S"] for x, y in result["cells"]]
+    logs = [f"Player {player.id} placed a ship of {len(cells)} ({result.get('placed')}/{lobby.ships_required})"]
+    broadcast_lobby(lobby, board_delta(
+        lobby, lambda player_id: {"board": cells} if player_id == player.id else None, logs), coalesce=True)
+
+
+@router.route("place_ships", schema=PlaceShipsMessage, needs_lobby=True)
+async def handle_place_ships(ctx: Context):
+    """Replace the player's whole layout in one step, for clients that lay out their fleet locally."""
+    lobby, player = ctx.lobby, ctx.player
+    result = lobby.set_layout(player.id, [(s.x, s.y, s.length, s.vertical) for s in ctx.msg.ships])
+    if result.get("error"):
+        ctx.conn.send({"type": "log", "message": f"[red]{result['error']}[/red]"})
+        return
+
+    cells = result["cells"]
+    logs = [f"Player {player.id} placed their fleet ({result.get('placed')}/{lobby.ships_required})"]
+    broadcast_lobby(lobby, board_delta(
+        lobby, lambda player_id: {"board": cells} if player_id == player.id else None, logs), coalesce=True)
+
+
+@router.route("remove_ship", schema=CoordsMessage, needs_lobby=True, coords=True)
+async def handle_remove_ship(ctx: Context):
+    lobby, player = ctx.lobby, ctx.player
+    x, y = ctx.msg.x, ctx.msg.y
+    result = lobby.remove_ship(player.id, x, y)
+    if result.get("error"):
+        ctx.conn.send({"type": "log", "message": f"[red]{result['error']}[/red]"})
+        return
+
+    cells = [[x, y, "~"] for x, y in result["cells"]]
+    logs = [f"Player {player.id} removed a ship ({result.get('placed')}/{lobby.ships_required})"]
+    broadcast_lobby(lobby, board_delta(
+        lobby, lambda player_id: {"board": cells} if player_id == player.id else None, logs), coalesce=True)
+
+
+@router.route("shoot", schema=CoordsMessage, needs_lobby=True, coords=True)
+async def handle_shoot(ctx: Context):
+    lobby, player = ctx.lobby, ctx.player
+    x, y = ctx.msg.x, ctx.msg.y
+    result = lobby.shoot(player.id, x, y)
+    if result.get("error"):
+        ctx.conn.send({"type": "log", "message": f"[red]{result['error']}[/red]"})
+        return
+
+    if not result.get("already"):
+        lobby.missed_turns.pop(player.id, None)
+    broadcast_shot(lobby, player.id, x, y, result)
+
+
+@router.route("resync", schema=ActionMessage, needs_lobby=True)
+async def handle_resync(ctx: Context):
+    lobby, player = ctx.lobby, ctx.player
+    # a board synced again without changing is spliced in from its encoding, see BoardView.encoded
+    ctx.conn.send(LobbyBroadcast(lobby, {"type": "sync", "version": lobby.version, "owner_id": lobby.owner_id},
+                                 boards=True)(player.id))
+
+
+@router.route("watch_replay", schema=ReplayMessage)
+async def handle_watch_replay(ctx: Context):
+    replay_id = ctx.msg.replay_id
+    path = os.path.join(REPLAY_DIR, replay_id + EXTENSION) if REPLAY_DIR else ""
+    if not REPLAY_ID.match(replay_id) or not os.path.exists(path):
+        ctx.conn.send({"error": "Replay not found"})
+        return
+    try:
+        replay = await asyncio.to_thread(lambda: ReplayFile(path).load())
+    except (OSError, ReplayError) as exc:
+        logger.error(f"Loading replay {replay_id} failed: {exc}")
+        ctx.conn.send({"error": "Replay not found"})
+        return
+    asyncio.create_task(stream_replay(ctx.conn, replay, ctx.msg.speed, ctx.msg.from_turn))
+
+
+async def stream_replay(conn, replay: Replay, speed: float, from_turn: int):
+    """Send both boards after every shot at the original pace, until the end or the viewer leaves."""
+    try:
+        async for turn, lobby in replay.stream(speed=max(speed, 0.01), from_turn=from_turn):
+            if not conn.send({
+                "type": "replay",
+                "replay_id": replay.name,
+                "turn": turn,
+                "turns": replay.turns,
+                "state": lobby.game_state,
+                "boards": {player_id: lobby.get_board(player_id) for player_id in replay.players},
+            }, coalesce=True):
+                return
+    except ReplayError as exc:
+        logger.error(f"Replay {replay.name} is invalid: {exc}")
+        conn.send({"error": "Replay is invalid"})
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics_endpoint():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
 
 
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
     await websocket.accept()
-    player = Player(id=generate_player_id(), websocket=websocket)
-    CURRENT_USERS[player.id] = websocket
-    USER_HEARTBEATS[player.id] = time.time()
-
-    await websocket.send_json({"player_id": player.id})
+    player = Player(id=await generate_player_id(), websocket=websocket)
+    # the wire format is picked once per connection from ?format=json|msgpack, JSON if unsupported
+    conn = Connection(player_id=player.id, websocket=websocket,
+                      codec=negotiate(websocket.query_params.get("format")),
+                      max_queue=OUTBOUND_QUEUE_SIZE, overflow_policy=OUTBOUND_POLICY, send_timeout=SEND_TIMEOUT)
+    conn.start()
+    CURRENT_USERS[player.id] = conn
+    store.add_session(player.id, WORKER_ID)
+    if HEARTBEAT_MODE == "app":
+        USER_HEARTBEATS.beat(player.id)
+
+    conn.send({"player_id": player.id, "format": conn.codec.name, "heartbeat": HEARTBEAT_MODE})
 
     while True:
         try:
-            data = await websocket.receive_text()
-            logger.info(f"Received message from {player.id}: {data}")
-
-            if data == "heartbeat":
-                USER_HEARTBEATS[player.id] = time.time()
-                await websocket.send_text("heartbeat_ack")
-            elif data == "MENU_start_options":
-                options = [option.model_dump() for option in START_MENU_OPTIONS]
-                await websocket.send_json({"options": options})
-            else:
-                try:
-                    msg = json.loads(data)
-                    if msg.get("option") == "create_private_game":
-                        lobby = await lobby_manager.create_lobby(player, is_public=False)
-                        lobby_data = {"players": [p.id for p in lobby.players]}
-                        await websocket.send_json({
-                            "lobby_id": lobby.id,
-                            "state": lobby.game_state,
-                            "message": "Lobby created",
-                            "lobby_data": lobby_data,
-                            "owner_id": lobby.owner_id,
-                            "board": lobby.get_board(player.id),
-                            "opponent_view": lobby.get_opponent_view(player.id),
-                            "logs": ["Lobby created.", "[yellow]Waiting for players...[/yellow]"]
-                        })
-                        logger.info(f"Created private lobby {lobby.id}")
-
-                    elif msg.get("option") == "join_public_game":
-                        lobby = await lobby_manager.join_public_game(player)
-                        if not lobby:
-                            await websocket.send_json({"message": "Waiting for opponent..."})
-                        else:
-                            await websocket.send_json({
-                                "lobby_id": lobby.id,
-                                "board": lobby.get_board(player.id),
-                                "state": lobby.game_state,
-                                "owner_id": lobby.owner_id,
-                                "message": "Joined public game"
-                            })
-                            logger.info(f"Player {player.id} joined public game {lobby.id}")
-
-                    elif msg.get("option") == "join_private_game":
-                        lobby_id = msg.get("input")
-                        if not lobby_id:
-                            await websocket.send_json({"error": "Lobby ID is required"})
-                            continue
-
-                        lobby = await lobby_manager.get_lobby(lobby_id)
-                        if not lobby:
-                            await websocket.send_json({"error": "Lobby not found"})
-                            continue
-
-                        if not await lobby_manager.join_lobby(player.id, lobby_id):
-                            await websocket.send_json({"error": "Failed to join lobby"})
-                            continue
-
-                        lobby_data = {"players": [p.id for p in lobby.players]}
-
-                        for p in lobby.players:
-                            ws = CURRENT_USERS.get(p.id)
-                            if ws:
-                                await ws.send_json({
-                                    "lobby_id": lobby.id,
-                                    "state": lobby.game_state,
-                                    "message": ("Joined private game" if p.id == player.id else "Lobby update"),
-                                    "owner_id": lobby.owner_id,
-                                    "lobby_data": lobby_data,
-                                    "board": lobby.get_board(p.id),
-                                    "opponent_view": lobby.get_opponent_view(p.id),
-                                    "logs": [f"Player {player.id} joined the lobby."]
-                                })
-
-                        logger.info(f"Player {player.id} joined private game {lobby.id}")
-
-                    elif msg.get("action") == "start_game":
-                        lobby = await lobby_manager.get_lobby_by_player(player.id)
-                        if not lobby:
-                            await websocket.send_json({"type": "log", "message": "[red]No lobby found.[/red]"})
-                            continue
-                        if lobby.owner_id != player.id:
-                            await websocket.send_json(
-                                {"type": "log", "message": "[red]Only the owner can start the game.[/red]"})
-                        if len(lobby.players) < 2:
-                            await websocket.send_json({"type": "log",
-                                                       "message": "[red]At least 2 players are required to start the game.[/red]"})
-                            continue
-                        if lobby.game_state.get("state") != "waiting":
-                            await websocket.send_json(
-                                {"type": "log", "message": "[red]Game has already started.[/red]"})
-                            continue
-
-                        for n in range(3, 0, -1):
-                            for p in lobby.players:
-                                ws = CURRENT_USERS.get(p.id)
-                                if ws:
-                                    await ws.send_json(
-                                        {"type": "log", "message": f"[green]Placement starting in {n}...[/green]"})
-                            await asyncio.sleep(1)
-
-                        placement_time = 45
-                        lobby.game_state = {"state": "placing", "turn": None, "winner": None}
-                        for p in lobby.players:
-                            ws = CURRENT_USERS.get(p.id)
-                            if ws:
-                                await ws.send_json({
-                                    "type": "placing",
-                                    "lobby_id": lobby.id,
-                                    "board": lobby.get_board(p.id),
-                                    "opponent_view": lobby.get_opponent_view(p.id),
-                                    "you": p.id,
-                                    "owner_id": lobby.owner_id,
-                                    "placement_time": placement_time,
-                                    "state": lobby.game_state,
-                                    "logs": ["Placement phase started. Place your ships!  \n[gray](Controls: WASD or arrows to move, P or Enter to place, R to remove)[/gray]"]
-                                })
-
-                        async def finalize_placement(lobby_id: str, delay: int):
-                            await asyncio.sleep(delay)
-                            lobby = await lobby_manager.get_lobby(lobby_id)
-                            if not lobby:
-                                return
-                            if lobby.game_state.get("state") != "placing":
-                                return
-
-                            for p in lobby.players:
-                                placed = lobby.ships_placed(p.id)
-                                if placed < lobby.ships_required:
-                                    lobby.place_ships_randomly(p.id, lobby.ships_required - placed)
-
-                            lobby.start_game()
-
-                            for p in lobby.players:
-                                ws = CURRENT_USERS.get(p.id)
-                                if ws:
-                                    await ws.send_json({
-                                        "type": "start",
-                                        "lobby_id": lobby.id,
-                                        "board": lobby.get_board(p.id),
-                                        "opponent_view": lobby.get_opponent_view(p.id),
-                                        "you": p.id,
-                                        "owner_id": lobby.owner_id,
-                                        "state": lobby.game_state,
-                                        "logs": ["Game started!"]
-                                    })
-
-                        asyncio.create_task(finalize_placement(lobby.id, placement_time))
-
-                    elif msg.get("action") == "place_ship":
-                        lobby = await lobby_manager.get_lobby_by_player(player.id)
-                        if not lobby:
-                            await websocket.send_json({"type": "log", "message": "[red]No lobby found.[/red]"})
-                            continue
-                        x = msg.get("x")
-                        y = msg.get("y")
-                        try:
-                            x = int(x)
-                            y = int(y)
-                        except Exception:
-                            await websocket.send_json({"type": "log", "message": "[red]Invalid coordinates.[/red]"})
-                            continue
-
-                        result = lobby.place_ship(player.id, x, y)
-                        if result.get("error"):
-                            await websocket.send_json({"type": "log", "message": f"[red]{result['error']}[/red]"})
-                            continue
-
-                        lobby_data = {"players": [p.id for p in lobby.players]}
-                        for p in lobby.players:
-                            ws = CURRENT_USERS.get(p.id)
-                            if ws:
-                                await ws.send_json({
-                                    "lobby_id": lobby.id,
-                                    "state": lobby.game_state,
-                                    "message": "Lobby update",
-                                    "owner_id": lobby.owner_id,
-                                    "lobby_data": lobby_data,
-                                    "board": lobby.get_board(p.id),
-                                    "opponent_view": lobby.get_opponent_view(p.id),
-                                    "logs": [f"Player {player.id} placed ship ({result.get('placed')}/{lobby.ships_required})"]
-                                })
-
-                    elif msg.get("action") == "remove_ship":
-                        lobby = await lobby_manager.get_lobby_by_player(player.id)
-                        if not lobby:
-                            await websocket.send_json({"type": "log", "message": "[red]No lobby found.[/red]"})
-                            continue
-                        x = msg.get("x")
-                        y = msg.get("y")
-                        try:
-                            x = int(x)
-                            y = int(y)
-                        except Exception:
-                            await websocket.send_json({"type": "log", "message": "[red]Invalid coordinates.[/red]"})
-                            continue
-
-                        result = lobby.remove_ship(player.id, x, y)
-                        if result.get("error"):
-                            await websocket.send_json({"type": "log", "message": f"[red]{result['error']}[/red]"})
-                            continue
-
-                        lobby_data = {"players": [p.id for p in lobby.players]}
-                        for p in lobby.players:
-                            ws = CURRENT_USERS.get(p.id)
-                            if ws:
-                                await ws.send_json({
-                                    "lobby_id": lobby.id,
-                                    "state": lobby.game_state,
-                                    "message": "Lobby update",
-                                    "owner_id": lobby.owner_id,
-                                    "lobby_data": lobby_data,
-                                    "board": lobby.get_board(p.id),
-                                    "opponent_view": lobby.get_opponent_view(p.id),
-                                    "logs": [f"Player {player.id} removed a ship ({result.get('placed')}/{lobby.ships_required})"]
-                                })
-
-                    elif msg.get("action") == "shoot":
-                        lobby = await lobby_manager.get_lobby_by_player(player.id)
-                        if not lobby:
-                            await websocket.send_json({"type": "log", "message": "[red]No lobby found.[/red]"})
-                            continue
-                        x = msg.get("x")
-                        y = msg.get("y")
-                        try:
-                            x = int(x)
-                            y = int(y)
-                        except Exception:
-                            await websocket.send_json({"type": "log", "message": "[red]Invalid coordinates.[/red]"})
-                            continue
-
-                        result = lobby.shoot(player.id, x, y)
-                        if result.get("error"):
-                            await websocket.send_json({"type": "log", "message": f"[red]{result['error']}[/red]"})
-                            continue
-
-                        for p in lobby.players:
-                            ws = CURRENT_USERS.get(p.id)
-                            if not ws:
-                                continue
-                            await ws.send_json({
-                                "type": "update",
-                                "lobby_id": lobby.id,
-                                "board": lobby.get_board(p.id),
-                                "opponent_view": lobby.get_opponent_view(p.id),
-                                "you": p.id,
-                                "state": lobby.game_state,
-                                "logs": [f"Player {player.id} shot at ({x},{y}) - {'hit' if result.get('hit') else 'miss'}"]
-                            })
-
-                except Exception as exc:
-                    logger.error(f"An error occurred: {exc}")
+            data = await conn.receive()
+            if HEARTBEAT_MODE == "app":
+                USER_HEARTBEATS.beat(player.id)
+            try:
+                await router.dispatch(player, conn, data)
+            except Exception as exc:
+                logger.error(f"An error occurred: {exc}")
 
         except Exception as e:
             logger.error(f"Error with player {player.id}: {e}")
             break
 
-    USER_HEARTBEATS.pop(player.id, None)
+    USER_HEARTBEATS.remove(player.id)
     CURRENT_USERS.pop(player.id, None)
+    conn.stop()
+    store.remove_session(player.id)
+
+    # the public queue and the player's lobby may live on other workers, let those clean up there
+    lobby_id = lobby_manager.player_lobbies.get(player.id)
+    remote_workers = {matchmaker_worker(), lobby_manager.lobby_home(lobby_id)} - {WORKER_ID, None}
+    for worker_id in remote_workers:
+        store.publish(worker_id, {"kind": "left", "player_id": player.id})
+    await player_left(player.id)
+    logger.info(f"Player {player.id} disconnected.")
+
 
-    lobby = await lobby_manager.get_lobby_by_player(player.id)
+async def player_left(player_id: str):
+    """Take a disconnected player out of the public queue and their lobby, as far as this worker holds them."""
+    await lobby_manager.leave_public_queue(player_id)
+    lobby_manager.stop_watching(player_id)
+
+    lobby = await lobby_manager.get_lobby_by_player(player_id)
     if lobby:
-        await lobby_manager.leave_lobby(player.id, lobby.id)
-        logger.info(f"Player {player.id} left lobby {lobby.id}.")
-
-        lobby_data = {"players": [p.id for p in lobby.players]}
-        for p in lobby.players:
-            ws = CURRENT_USERS.get(p.id)
-            if ws:
-                await ws.send_json({
-                    "lobby_id": lobby.id,
-                    "state": lobby.game_state,
-                    "message": "player_left",
-                    "owner_id": lobby.owner_id,
-                    "lobby_data": lobby_data,
-                    "logs": [f"Player {player.id} has left the lobby."]
-                })
-    else:
-        logger.info(f"Player {player.id} was not in any lobby.")
-    logger.info(f"Player {player.id} disconnected.")
+        logs = [f"Player {player_id} has left the lobby."]
+        # a running game is lost by whoever leaves it, settled while they still hold their seat
+        if lobby.game_state.get("state") == "playing":
+            timers.cancel((lobby.id, "turn"))
+            if not lobby.forfeit(player_id).get("error"):
+                logs.append(f"Player {player_id} forfeits.")
+                record_replay(lobby)
+        await lobby_manager.leave_lobby(player_id, lobby.id)
+        logger.info(f"Player {player_id} left lobby {lobby.id}.")
+        if lobby.id not in lobby_manager.lobbies:
+            timers.cancel_group(lobby.id)
+
+        broadcast_lobby(lobby, LobbyBroadcast(lobby, {
+            "message": "player_left",
+            "logs": logs
+        }, lobby_data=True))
+        broadcast_spectators(lobby, lambda: spectator_snapshot(lobby, logs=logs))
+    elif player_id not in lobby_manager.player_lobbies:
+        logger.info(f"Player {player_id} was not in any lobby.")
+
 
 if __name__ == '__main__':
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    options = {"host": "0.0.0.0", "port": 8000}
+    if HEARTBEAT_MODE == "ping":
+        options.update(ws_ping_interval=HEARTBEAT_PING_INTERVAL, ws_ping_timeout=HEARTBEAT_TIMEOUT)
+    if WORKERS > 1:
+        if STATE_BACKEND == "memory":
+            raise SystemExit("HTF_WORKERS > 1 needs a shared state backend, e.g. HTF_STATE_BACKEND=sqlite")
+        if EVENT_LOG_DIR:
+            raise SystemExit("HTF_EVENT_LOG only supports a single worker")
+        start_listener(log_listener)  # this process only supervises the workers, each starts its own
+        uvicorn.run("server.main:app", workers=WORKERS, log_config=None, **options)
+    else:
+        uvicorn.run(app, log_config=None, **options)
@@ -1,2 +1,3 @@
+from .dispatch import Context, Router
 from .lobby_manager import LobbyManager
 from .models import Lobby, StartMenuOption
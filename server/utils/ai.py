@@ -0,0 +1,277 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import random
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass
+
+from .models import Lobby
+
+try:
+    import numpy as np
+except ImportError:  # numpy is optional, the pure Python search covers boards up to PYTHON_MAX_CELLS
+    np = None
+
+logger = logging.getLogger("server")
+
+DIFFICULTIES = ("easy", "medium", "hard")
+DEFAULT_DIFFICULTY = "medium"
+TARGET_WEIGHT = 40  # how much more a placement counts for each unresolved hit it covers
+TARGET_WEIGHT_MAX_HITS = 4  # hits counted per placement, so long ships cannot overflow the weights
+PYTHON_MAX_CELLS = 150 * 150  # largest board scored without numpy; larger ones fall back to parity hunting
+RANDOM_TRIES = 64  # random cells tried before listing the free ones
+PARENT_CHECK_INTERVAL = 1.0  # seconds between a search process's checks that the server is still there
+
+
+@dataclass(frozen=True)
+class Sightings:
+    """What a shooter knows about the opponent's board, small enough to send to another process.
+
+    `hits` are hit cells not known to belong to a sunk ship, `blocked` the misses and the cells of
+    sunk ships (no ship left afloat covers them) and `remaining` the lengths of the ships still afloat.
+    """
+    size: int
+    hits: frozenset[int]
+    blocked: frozenset[int]
+    remaining: tuple[int, ...]
+
+    @classmethod
+    def of(cls, lobby: Lobby, shooter_id: str) -> "Sightings | None":
+        """The opponent's board as `shooter_id` sees it, or None without an opponent.
+
+        A player is told the length of every ship they sink; the cells it covered are taken as
+        known too, as they can be told from the hits around the sinking shot.
+        """
+        opponent_id = next((p.id for p in lobby.players if p.id != shooter_id), None)
+        board = lobby.boards.get(opponent_id) if opponent_id else None
+        if board is None:
+            return None
+        sunk, remaining = set(), []
+        for ship in board.ships:
+            if ship.sunk:
+                sunk.update(y * board.size + x for x, y in ship.cells())
+            else:
+                remaining.append(ship.length)
+        return cls(board.size, frozenset(board.hits - sunk), frozenset(board.misses | sunk), tuple(remaining))
+
+    def is_shot(self, cell: int) -> bool:
+        return cell in self.hits or cell in self.blocked
+
+
+def choose_target(seen: Sightings, difficulty: str = DEFAULT_DIFFICULTY, budget: float = 1.0,
+                  seed: int | None = None) -> tuple[int, int] | None:
+    """Pick the next cell to shoot, within about `budget` seconds, as (x, y). None if none is left.
+
+    "hard" and "medium" score every cell by how many placements of the remaining ships cover it,
+    placements through unresolved hits weighing far more (target mode) than the rest (hunt mode).
+    "hard" shoots the best cell, "medium" draws one in proportion to its score. "easy" shoots at
+    random until it hits, then around its hits. When the board is too large for the search or the
+    budget runs out, the shot falls back to hunting on the parity grid of the shortest ship.
+    Runs in a pool process, see TargetingPool.
+    """
+    rng = random.Random(seed)
+    deadline = time.monotonic() + budget
+    if difficulty not in ("medium", "hard"):
+        return _to_xy(seen, _near_hits(seen, rng) or _random_cell(seen, rng))
+    if np is not None:
+        cell = _best_numpy(seen, difficulty, rng, deadline)
+    elif seen.size * seen.size <= PYTHON_MAX_CELLS:
+        cell = _best_python(seen, difficulty, rng, deadline)
+    else:
+        cell = None
+    if cell is None:
+        cell = _near_hits(seen, rng) or _parity_cell(seen, rng) or _random_cell(seen, rng)
+    return _to_xy(seen, cell)
+
+
+def _to_xy(seen: Sightings, cell: int | None) -> tuple[int, int] | None:
+    return None if cell is None else (cell % seen.size, cell // seen.size)
+
+
+def _weight(count: int, hits: int) -> float:
+    return count * TARGET_WEIGHT ** min(hits, TARGET_WEIGHT_MAX_HITS)
+
+
+def _pick(scores: dict[int, float], difficulty: str, rng: random.Random) -> int | None:
+    if not scores:
+        return None
+    if difficulty == "hard":
+        best = max(scores.values())
+        return rng.choice([cell for cell, score in scores.items() if score == best])
+    return rng.choices(list(scores), weights=list(scores.values()))[0]
+
+
+def _best_python(seen: Sightings, difficulty: str, rng: random.Random, deadline: float) -> int | None:
+    size = seen.size
+    density = [0.0] * (size * size)
+    for length, count in Counter(seen.remaining).items():
+        for horizontal in (True, False):
+            for line in range(size):
+                if time.monotonic() > deadline:
+                    return None
+                cells = ([line * size + i for i in range(size)] if horizontal
+                         else [i * size + line for i in range(size)])
+                blocked = [cell in seen.blocked for cell in cells]
+                hit = [cell in seen.hits for cell in cells]
+                # slide a window of `length` cells along the line, counting what it covers
+                in_blocked = in_hits = 0
+                for i in range(size):
+                    in_blocked += blocked[i]
+                    in_hits += hit[i]
+                    if i >= length:
+                        in_blocked -= blocked[i - length]
+                        in_hits -= hit[i - length]
+                    if i >= length - 1 and not in_blocked:
+                        weight = _weight(count, in_hits)
+                        for cell in cells[i - length + 1:i + 1]:
+                            density[cell] += weight
+    return _pick({cell: score for cell, score in enumerate(density) if score and not seen.is_shot(cell)},
+                 difficulty, rng)
+
+
+def _best_numpy(seen: Sightings, difficulty: str, rng: random.Random, deadline: float) -> int | None:
+    size = seen.size
+    blocked = np.zeros(size * size, dtype=np.int32)
+    blocked[list(seen.blocked)] = 1
+    hits = np.zeros(size * size, dtype=np.int32)
+    hits[list(seen.hits)] = 1
+    blocked, hits = blocked.reshape(size, size), hits.reshape(size, size)
+    density = np.zeros((size, size))
+    for length, count in Counter(seen.remaining).items():
+        for transposed in (False, True):
+            if time.monotonic() > deadline:
+                return None
+            b, h = (blocked.T, hits.T) if transposed else (blocked, hits)
+            # placements along each row start at columns 0..starts-1
+            starts = size - length + 1
+            free = _window_sums(b, length) == 0
+            weights = np.where(free, count * TARGET_WEIGHT ** np.minimum(_window_sums(h, length),
+                                                                          TARGET_WEIGHT_MAX_HITS), 0.0)
+            # each cell collects the weights of the placements starting up to length-1 cells before it
+            column = np.arange(size)
+            total = np.cumsum(np.pad(weights, ((0, 0), (1, 0))), axis=1)
+            cover = total[:, np.minimum(column, starts - 1) + 1] - total[:, np.maximum(column - length + 1, 0)]
+            density += cover.T if transposed else cover
+    density = density.ravel()
+    density[(blocked | hits).ravel() == 1] = 0
+    best = float(density.max())
+    if best <= 0:
+        return None
+    if difficulty == "hard":
+        return int(rng.choice(np.flatnonzero(density == best)))
+    cumulative = np.cumsum(density)
+    return int(np.searchsorted(cumulative, rng.random() * cumulative[-1], side="right"))
+
+
+def _window_sums(grid, length: int):
+    """Sums of every `length` consecutive cells along the rows of `grid`."""
+    total = np.cumsum(np.pad(grid, ((0, 0), (1, 0))), axis=1)
+    return total[:, length:] - total[:, :-length]
+
+
+def _near_hits(seen: Sightings, rng: random.Random) -> int | None:
+    """A free cell next to an unresolved hit, preferring to extend a line of hits."""
+    size = seen.size
+    along, beside = [], []
+    for cell in seen.hits:
+        x, y = cell % size, cell // size
+        for dx, dy in ((1, 0), (-1, 0), (0, 1), (0, -1)):
+            nx, ny = x + dx, y + dy
+            if 0 <= nx < size and 0 <= ny < size and not seen.is_shot(ny * size + nx):
+                behind = (x - dx, y - dy)
+                in_line = 0 <= behind[0] < size and 0 <= behind[1] < size and behind[1] * size + behind[0] in seen.hits
+                (along if in_line else beside).append(ny * size + nx)
+    candidates = along or beside
+    return rng.choice(candidates) if candidates else None
+
+
+def _parity_cell(seen: Sightings, rng: random.Random) -> int | None:
+    """A random free cell on the grid every ship still afloat must cross."""
+    step = min(seen.remaining, default=1)
+    if step < 2:
+        return None
+    size = seen.size
+    for _ in range(RANDOM_TRIES):
+        x, y = rng.randrange(size), rng.randrange(size)
+        x -= (x + y) % step
+        if x >= 0 and not seen.is_shot(y * size + x):
+            return y * size + x
+    return None
+
+
+def _random_cell(seen: Sightings, rng: random.Random) -> int | None:
+    cells = seen.size * seen.size
+    for _ in range(RANDOM_TRIES):
+        cell = rng.randrange(cells)
+        if not seen.is_shot(cell):
+            return cell
+    free = [cell for cell in range(cells) if not seen.is_shot(cell)]
+    return rng.choice(free) if free else None
+
+
+def _search_thread() -> Executor:
+    return ThreadPoolExecutor(1, thread_name_prefix="targeting")
+
+
+def _exit_with_parent(parent: int):
+    """Pool initializer: end the search process once the server is gone, even if it was killed outright."""
+    def watch():
+        while os.getppid() == parent:
+            time.sleep(PARENT_CHECK_INTERVAL)
+        os._exit(0)
+    threading.Thread(target=watch, name="parent-watch", daemon=True).start()
+
+
+class TargetingPool:
+    """Runs choose_target in worker processes, so a search never holds up the event loop.
+
+    `processes=0` runs it in a thread instead, as do hosts that cannot fork. The processes are
+    forked by `start()`, which the server calls first thing on startup, before the log listener and
+    the store start their threads: a fork copies only the calling thread, so a lock another thread
+    holds would stay locked in the child. For the same reason the pool is never forked later:
+    without `start()`, or once a search process has crashed, the search runs in a thread. Search
+    processes exit with the server, also when it is killed before it can shut the pool down. A
+    search that overruns its budget by more than `grace` seconds is given up on (the caller then
+    shoots at random).
+    """
+
+    def __init__(self, processes: int = 1, grace: float = 1.0):
+        self.processes = processes
+        self.grace = grace
+        self.executor: Executor | None = None
+
+    def start(self) -> Executor:
+        if self.executor is None:
+            if self.processes > 0 and "fork" in multiprocessing.get_all_start_methods():
+                self.executor = ProcessPoolExecutor(self.processes, mp_context=multiprocessing.get_context("fork"),
+                                                    initializer=_exit_with_parent, initargs=(os.getpid(),))
+                self.executor.submit(int)  # forks every process now, before the pool's own thread starts
+            else:
+                self.executor = _search_thread()
+        return self.executor
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+    async def choose(self, seen: Sightings, difficulty: str, budget: float) -> tuple[int, int] | None:
+        loop = asyncio.get_running_loop()
+        if self.executor is None:
+            self.executor = _search_thread()  # too late to fork, see the class docstring
+        try:
+            future = loop.run_in_executor(self.executor, choose_target, seen, difficulty, budget, random.getrandbits(64))
+            return await asyncio.wait_for(future, budget + self.grace)
+        except asyncio.TimeoutError:
+            logger.warning(f"Targeting took longer than {budget + self.grace:g}s on a {seen.size}x{seen.size} board")
+        except BrokenProcessPool:
+            logger.error("The targeting pool crashed, searching in a thread from now on")
+            self.executor = _search_thread()
+        except Exception as exc:
+            logger.error(f"Targeting failed: {exc}")
+        return None
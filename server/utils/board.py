@@ -0,0 +1,281 @@
+import sys
+from functools import lru_cache
+
+from .codec import Encoded
+
+EMPTY = "~"
+SHIP = "S"
+HIT = "X"
+MISS = "O"
+DENSE_BOARD_MAX = 32  # boards up to this size go on the wire as rows, larger ones as marked cells only
+SPLICE_MIN_CELLS = 100  # cells on the wire below which a board is encoded with its message every time
+INT_BYTES = sys.getsizeof(1 << 20)  # a cell number; small ints are shared, these mostly are not
+
+
+class Ship:
+    """A straight ship of `length` cells whose bow is at (x, y), running right or, if `vertical`, down."""
+
+    __slots__ = ("x", "y", "length", "vertical", "hits")
+
+    def __init__(self, x: int, y: int, length: int, vertical: bool = False):
+        self.x = x
+        self.y = y
+        self.length = length
+        self.vertical = vertical
+        self.hits = 0
+
+    @property
+    def sunk(self) -> bool:
+        return self.hits >= self.length
+
+    def cells(self) -> list[tuple[int, int]]:
+        if self.vertical:
+            return [(self.x, self.y + i) for i in range(self.length)]
+        return [(self.x + i, self.y) for i in range(self.length)]
+
+    def layout(self) -> tuple[int, int, int, bool]:
+        return self.x, self.y, self.length, self.vertical
+
+
+SHIP_BYTES = sys.getsizeof(Ship(0, 0, 1))
+
+
+class BoardView:
+    """What one side sees of a board, updated cell by cell as the board changes.
+
+    `wire()` is the form sent to clients: rows of cells for boards up to DENSE_BOARD_MAX, otherwise
+    {"size": n, "cells": [[x, y, cell], ...]} for the cells that are not '~'. It is built once per
+    `version` and shared by every message until the next change. A board sent in full more than
+    once without changing is also kept serialized per codec, see `encoded()`.
+
+    Rows are copy-on-write: once they have been handed out, a change copies the outer list and the
+    changed row instead of editing them, so a message still waiting in an outbound queue never
+    changes under the writer. The sparse form is rebuilt from `marks` on the first request after
+    a change. Per-shot updates travel as deltas, so that only happens for full syncs.
+    """
+
+    __slots__ = ("size", "dense", "marks", "version", "_rows", "_shared", "_owned", "_wire", "_synced", "_encoded")
+
+    def __init__(self, size: int):
+        self.size = size
+        self.dense = size <= DENSE_BOARD_MAX
+        self.marks: dict[int, str] = {}  # {cell number: cell} for every cell that is not '~'
+        self.version = 0
+        self._rows: list[list[str]] | None = None
+        self._shared = False  # whether _rows has been handed out since it last changed
+        self._owned: set[int] = set()  # rows copied since then, safe to edit in place
+        self._wire: tuple[int, list | dict] | None = None  # (version, value)
+        self._synced = -1  # the version last sent in full, see encoded()
+        self._encoded: tuple[int, Encoded] | None = None  # (version, wire value wrapped for encoding)
+
+    def set(self, cell: int, value: str):
+        if value == EMPTY:
+            self.marks.pop(cell, None)
+        else:
+            self.marks[cell] = value
+        self.version += 1
+        if self._rows is not None:
+            y, x = divmod(cell, self.size)
+            if self._shared:
+                self._rows = list(self._rows)
+                self._shared = False
+                self._owned.clear()
+            if y not in self._owned:
+                self._rows[y] = list(self._rows[y])
+                self._owned.add(y)
+            self._rows[y][x] = value
+
+    def wire(self) -> list[list[str]] | dict:
+        if self._wire is not None and self._wire[0] == self.version:
+            return self._wire[1]
+        size = self.size
+        if self.dense:
+            if self._rows is None:
+                self._rows = [[EMPTY] * size for _ in range(size)]
+                for cell, value in self.marks.items():
+                    self._rows[cell // size][cell % size] = value
+            self._shared = True
+            value = self._rows
+        else:
+            value = {"size": size, "cells": [[cell % size, cell // size, mark] for cell, mark in self.marks.items()]}
+        self._wire = (self.version, value)
+        return value
+
+    def memory_estimate(self) -> int:
+        """Approximate bytes held by this view, from container sizes rather than a deep walk."""
+        total = sys.getsizeof(self.marks) + len(self.marks) * INT_BYTES
+        if self._rows is not None:
+            total += sys.getsizeof(self._rows) + self.size * sys.getsizeof(self._rows[0])
+        if self._encoded is not None:
+            total += sum(sys.getsizeof(data) for data in self._encoded[1]._data.values())
+        return total
+
+    def encoded(self) -> Encoded | None:
+        """The current wire value, encoded on first use per codec, once this version is sent in full again.
+
+        Returns None for the first full sync after a change, and always for boards with fewer than
+        SPLICE_MIN_CELLS cells on the wire: the board is then encoded with the rest of its message,
+        which costs less than encoding it alone and splicing it in. Later changes leave a returned
+        Encoded as it is.
+        """
+        if self._encoded is not None and self._encoded[0] == self.version:
+            return self._encoded[1]
+        if (self.size * self.size if self.dense else len(self.marks)) < SPLICE_MIN_CELLS:
+            return None
+        if self._synced != self.version:
+            self._synced = self.version
+            return None
+        self._encoded = (self.version, Encoded(self.wire()))
+        return self._encoded[1]
+
+
+@lru_cache(maxsize=8)
+def blank_view(size: int) -> BoardView:
+    """A shared, never-changing empty view, for a seat without a board yet."""
+    return BoardView(size)
+
+
+class Board:
+    """A square battleship board that only stores what is on it.
+
+    Cell (x, y) is numbered `y * size + x`. `occupied` maps every ship cell to its Ship and `hits` /
+    `misses` hold the numbers of the cells that have been shot, so memory grows with the ships and
+    shots rather than with the board, and a 1000x1000 board costs no more than a 5x5 one. A shot is
+    a dict lookup plus a set insert. The ship's hit counter tells whether it sank, and the board-wide
+    counters tell whether the fleet is gone, so no check ever scans the board.
+
+    What the owner and the opponent see is kept in two BoardViews (`own`, `opponent`) that every
+    change updates cell by cell, so producing a view for the wire never scans the board.
+    """
+
+    __slots__ = ("size", "ships", "occupied", "hits", "misses", "ship_cells", "hit_count", "own", "opponent")
+
+    def __init__(self, size: int):
+        self.size = size
+        self.ships: list[Ship] = []
+        self.occupied: dict[int, Ship] = {}  # {cell number: ship covering it}
+        self.hits: set[int] = set()
+        self.misses: set[int] = set()
+        self.ship_cells = 0
+        self.hit_count = 0
+        self.own = BoardView(size)
+        self.opponent = BoardView(size)
+
+    @classmethod
+    def from_layout(cls, size: int, layout, hits=(), misses=()) -> "Board":
+        """Rebuild a board from `layout()` output and the cell numbers that were shot."""
+        board = cls(size)
+        for x, y, length, vertical in layout:
+            board.place(x, y, length, vertical)
+        for cell in (*hits, *misses):
+            board.fire(cell % size, cell // size)
+        return board
+
+    @classmethod
+    def from_masks(cls, size: int, ships: int, hits: int, misses: int) -> "Board":
+        """Rebuild a board of single-cell ships from bitmasks, as stored by older snapshots and replays."""
+        def cells(mask: int) -> list[int]:
+            return [i for i, bit in enumerate(reversed(format(mask, "b"))) if bit == "1"] if mask else []
+        return cls.from_layout(size, [(i % size, i // size, 1, False) for i in cells(ships)],
+                               cells(hits), cells(misses))
+
+    def layout(self) -> list[tuple[int, int, int, bool]]:
+        return [ship.layout() for ship in self.ships]
+
+    def snapshot(self) -> dict:
+        return {"ships": self.layout(), "hits": sorted(self.hits), "misses": sorted(self.misses)}
+
+    def memory_estimate(self) -> int:
+        """Approximate bytes held by this board and its views, in O(1)."""
+        ships = len(self.ships) * SHIP_BYTES
+        cells = sum(sys.getsizeof(cells) + len(cells) * INT_BYTES
+                    for cells in (self.occupied, self.hits, self.misses))
+        return ships + cells + self.own.memory_estimate() + self.opponent.memory_estimate()
+
+    def in_bounds(self, x: int, y: int) -> bool:
+        return 0 <= x < self.size and 0 <= y < self.size
+
+    @property
+    def ship_count(self) -> int:
+        return len(self.ships)
+
+    @property
+    def ships_left(self) -> int:
+        """Ship cells not yet hit; the board is beaten at zero."""
+        return self.ship_cells - self.hit_count
+
+    def ship_at(self, x: int, y: int) -> Ship | None:
+        return self.occupied.get(y * self.size + x)
+
+    def has_ship(self, x: int, y: int) -> bool:
+        return y * self.size + x in self.occupied
+
+    def is_shot(self, x: int, y: int) -> bool:
+        cell = y * self.size + x
+        return cell in self.hits or cell in self.misses
+
+    def cell(self, x: int, y: int) -> str:
+        cell = y * self.size + x
+        if cell in self.hits:
+            return HIT
+        if cell in self.misses:
+            return MISS
+        if cell in self.occupied:
+            return SHIP
+        return EMPTY
+
+    def fits(self, x: int, y: int, length: int, vertical: bool = False) -> bool:
+        """Whether a ship of `length` with its bow at (x, y) lies on the board without overlapping."""
+        end_x, end_y = (x, y + length - 1) if vertical else (x + length - 1, y)
+        if not (self.in_bounds(x, y) and self.in_bounds(end_x, end_y)):
+            return False
+        step = self.size if vertical else 1
+        start = y * self.size + x
+        return not any(start + i * step in self.occupied for i in range(length))
+
+    def place(self, x: int, y: int, length: int = 1, vertical: bool = False) -> Ship | None:
+        """Add a ship with its bow at (x, y). Returns None if it does not fit."""
+        if length < 1 or not self.fits(x, y, length, vertical):
+            return None
+        ship = Ship(x, y, length, vertical)
+        step = self.size if vertical else 1
+        start = y * self.size + x
+        for i in range(length):
+            self.occupied[start + i * step] = ship
+            self.own.set(start + i * step, SHIP)
+        self.ships.append(ship)
+        self.ship_cells += length
+        return ship
+
+    def remove(self, x: int, y: int) -> Ship | None:
+        """Take away the ship covering (x, y), unless it has been hit. Returns the removed ship."""
+        ship = self.ship_at(x, y)
+        if ship is None or ship.hits:
+            return None
+        for cx, cy in ship.cells():
+            del self.occupied[cy * self.size + cx]
+            self.own.set(cy * self.size + cx, EMPTY)
+        self.ships.remove(ship)
+        self.ship_cells -= ship.length
+        return ship
+
+    def fire(self, x: int, y: int) -> str:
+        """Record a shot at (x, y) and return the resulting cell ('X' or 'O').
+
+        Callers are expected to check `is_shot` first; firing twice at a cell is a no-op.
+        """
+        cell = y * self.size + x
+        ship = self.occupied.get(cell)
+        if ship is not None:
+            if cell not in self.hits:
+                self.hits.add(cell)
+                self.hit_count += 1
+                ship.hits += 1
+                self.own.set(cell, HIT)
+                self.opponent.set(cell, HIT)
+            return HIT
+        if cell not in self.misses:
+            self.misses.add(cell)
+            self.own.set(cell, MISS)
+            self.opponent.set(cell, MISS)
+        return MISS
@@ -0,0 +1,63 @@
+from typing import Callable
+
+from .codec import Codec, Encoded, Preencoded, splice
+from .models import Lobby
+
+
+class Message(Preencoded):
+    """One player's copy of a full-board broadcast, with boards already encoded spliced in as they are."""
+    __slots__ = ("fields", "boards")
+
+    def __init__(self, fields: dict, boards: dict[str, Encoded]):
+        self.fields = fields
+        self.boards = boards
+
+    @property
+    def payload(self) -> dict:
+        return {**self.fields, **{key: board.payload for key, board in self.boards.items()}}
+
+    def encode(self, codec: Codec) -> str | bytes:
+        return splice(codec, self.fields, {key: board.encode(codec) for key, board in self.boards.items()})
+
+
+class LobbyBroadcast:
+    """Builds every player's copy of one lobby broadcast.
+
+    Each copy is lobby_id (plus owner_id and lobby_data with `lobby_data=True`), the game state,
+    `fields` (the same for everyone), whatever `own(player_id)` adds for a single player and, with
+    `boards=True`, the player's "board" and "opponent_view". Called with a player id it returns that
+    player's copy, so it can be passed to broadcast_lobby as `payload_for`.
+
+    Copies are plain dicts, encoded whole per player, and one Encoded payload when no player gets
+    anything of their own. The exception is a board sent in full again without having changed: its
+    BoardView keeps it encoded (see BoardView.encoded), and the copy is a Message that splices it in.
+    """
+
+    __slots__ = ("lobby", "boards", "own", "shared")
+
+    def __init__(self, lobby: Lobby, fields: dict, lobby_data: bool = False, boards: bool = False,
+                 own: Callable[[str], dict] | None = None):
+        self.lobby = lobby
+        self.boards = boards
+        self.own = own
+        # the state is copied, shoot and forfeit change it in place while copies may still be queued
+        if lobby_data:
+            shared = {"lobby_id": lobby.id, "state": dict(lobby.game_state), "owner_id": lobby.owner_id,
+                      "lobby_data": {"players": [p.id for p in lobby.players]}, **fields}
+        else:
+            shared = {"lobby_id": lobby.id, "state": dict(lobby.game_state), **fields}
+        self.shared = Encoded(shared) if own is None and not boards else shared
+
+    def __call__(self, player_id: str) -> Message | Encoded | dict:
+        if not self.boards:
+            return self.shared if self.own is None else {**self.shared, **self.own(player_id)}
+        payload = {**self.shared, **self.own(player_id)} if self.own is not None else dict(self.shared)
+        encoded = {}
+        for key, view in (("board", self.lobby.board_view(player_id)),
+                          ("opponent_view", self.lobby.opponent_view(player_id))):
+            board = view.encoded() if view else None
+            if board is not None:
+                encoded[key] = board
+            else:
+                payload[key] = view.wire() if view else []
+        return Message(payload, encoded) if encoded else payload
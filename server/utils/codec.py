@@ -0,0 +1,56 @@
+"""The shared codecs of common.codec, plus what only the server needs to encode a message once for many players."""
+import json
+from typing import Any
+
+from common.codec import Codec, MsgPackCodec
+
+
+class Preencoded:
+    """A message that encodes itself for the connection writing it, e.g. from parts shared with others.
+
+    `payload` is the same message as plain data, for paths that need it such as other workers.
+    """
+    __slots__ = ()
+    payload: Any
+
+    def encode(self, codec: Codec) -> str | bytes:
+        raise NotImplementedError
+
+
+class Encoded(Preencoded):
+    """A payload sent unchanged to many connections, encoded at most once per codec.
+
+    Each connection encodes it when its writer gets to it. The first one caches the result, so every
+    other connection with the same codec writes the very same string or bytes.
+    """
+    __slots__ = ("payload", "_data")
+
+    def __init__(self, payload: Any):
+        self.payload = payload
+        self._data: dict[str, str | bytes] = {}
+
+    def encode(self, codec: Codec) -> str | bytes:
+        data = self._data.get(codec.name)
+        if data is None:
+            data = self._data[codec.name] = codec.encode(self.payload)
+        return data
+
+
+def _map_header(count: int) -> bytes:
+    if count < 16:
+        return bytes((0x80 | count,))
+    if count < 1 << 16:
+        return b"\xde" + count.to_bytes(2, "big")
+    return b"\xdf" + count.to_bytes(4, "big")
+
+
+def splice(codec: Codec, fields: dict, encoded: dict[str, str | bytes]) -> str | bytes:
+    """Encode the map of `fields` plus `encoded`, whose values are already encoded with `codec`."""
+    head = codec.encode(fields)
+    if not encoded:
+        return head
+    if isinstance(codec, MsgPackCodec):
+        pairs = b"".join(codec.encode(key) + value for key, value in encoded.items())
+        return _map_header(len(fields) + len(encoded)) + head[len(_map_header(len(fields))):] + pairs
+    pairs = ",".join(f"{json.dumps(key)}:{value}" for key, value in encoded.items())
+    return head[:-1] + ("," if fields else "") + pairs + "}"
@@ -0,0 +1,149 @@
+import asyncio
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Iterable
+
+from starlette.websockets import WebSocketDisconnect
+
+from common.codec import Codec, JsonCodec
+from .codec import Preencoded
+
+OVERFLOW_POLICIES = ("coalesce", "disconnect")
+
+
+@dataclass
+class Connection:
+    """A player's WebSocket, the wire format negotiated for it and its outbound queue.
+
+    `send` never touches the network: it appends to a bounded queue that a per-connection writer
+    task drains, so game logic cannot be held up by a slow reader. When the queue is full:
+
+    - "coalesce" drops the queued updates marked `coalesce=True` (board deltas), which the newest
+      state supersedes; the client notices the version gap and resyncs. If nothing can be dropped the
+      connection is closed.
+    - "disconnect" closes the connection straight away.
+
+    Either way a slow consumer holds at most `max_queue` messages in memory.
+    """
+    player_id: str
+    websocket: Any
+    codec: Codec = JsonCodec()
+    max_queue: int = 64
+    overflow_policy: str = "coalesce"
+    send_timeout: float = 2.0
+    queue: deque = field(default_factory=deque)  # [(coalesce, payload), ...]
+    dropped: int = 0  # messages discarded by coalescing
+    closed: bool = False
+    _ready: asyncio.Event = field(default_factory=asyncio.Event, repr=False)
+    _writer: asyncio.Task | None = field(default=None, repr=False)
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self.queue)
+
+    def start(self):
+        """Start the writer task that drains the outbound queue."""
+        if self._writer is None:
+            self._writer = asyncio.create_task(self._drain())
+
+    def send(self, payload: Any, coalesce: bool = False) -> bool:
+        """Queue `payload` for delivery. Returns False if the connection is closed or was dropped."""
+        if self.closed:
+            return False
+        if len(self.queue) >= self.max_queue:
+            if self.overflow_policy == "coalesce":
+                kept = deque(entry for entry in self.queue if not entry[0])
+                self.dropped += len(self.queue) - len(kept)
+                self.queue = kept
+            if len(self.queue) >= self.max_queue:
+                self._abort()
+                return False
+        self.queue.append((coalesce, payload))
+        self._ready.set()
+        return True
+
+    async def _write(self, payload: Any):
+        data = payload.encode(self.codec) if isinstance(payload, Preencoded) else self.codec.encode(payload)
+        if self.codec.binary:
+            await self.websocket.send_bytes(data)
+        else:
+            await self.websocket.send_text(data)
+
+    async def _drain(self):
+        try:
+            while True:
+                while not self.queue:
+                    self._ready.clear()
+                    await self._ready.wait()
+                _, payload = self.queue.popleft()
+                await asyncio.wait_for(self._write(payload), self.send_timeout)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # the socket is stuck or gone; closing it ends the receive loop as well
+            self._abort()
+
+    def _abort(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.queue.clear()
+        asyncio.create_task(self._close_socket())
+
+    async def _close_socket(self):
+        if self._writer is not None and self._writer is not asyncio.current_task():
+            self._writer.cancel()
+        try:
+            await asyncio.wait_for(self.websocket.close(), self.send_timeout)
+        except Exception:
+            pass
+
+    async def receive(self) -> str | bytes:
+        """Wait for the next text or binary frame. Raises WebSocketDisconnect once the peer is gone."""
+        message = await self.websocket.receive()
+        if message["type"] == "websocket.disconnect":
+            raise WebSocketDisconnect(message.get("code", 1000))
+        if message.get("text") is not None:
+            return message["text"]
+        return message.get("bytes") or b""
+
+    def stop(self):
+        """Stop the writer without closing the socket, e.g. once the peer has disconnected."""
+        self.closed = True
+        self.queue.clear()
+        if self._writer is not None:
+            self._writer.cancel()
+
+    async def close(self):
+        self.closed = True
+        self.queue.clear()
+        await self._close_socket()
+
+
+@dataclass
+class RemoteConnection:
+    """Stand-in for a player whose socket lives on another worker.
+
+    `send` publishes the payload on that worker's channel; the worker then queues it on the real
+    Connection. It has the same `send` signature as Connection, so handlers do not care where the
+    player is connected.
+    """
+    player_id: str
+    worker_id: str
+    store: Any
+    closed: bool = False
+
+    def send(self, payload: Any, coalesce: bool = False) -> bool:
+        if isinstance(payload, Preencoded):
+            payload = payload.payload  # the other worker encodes it for the player's codec
+        self.store.publish(self.worker_id, {"kind": "deliver", "player_id": self.player_id,
+                                            "payload": payload, "coalesce": coalesce})
+        return True
+
+
+def broadcast(messages: Iterable[tuple[Connection | RemoteConnection, Any]], coalesce: bool = False) -> list[str]:
+    """Queue every (connection, payload) pair without waiting on any socket.
+
+    Returns the ids of the players whose connection refused the message (closed or overflowed).
+    """
+    return [conn.player_id for conn, payload in messages if not conn.send(payload, coalesce=coalesce)]
@@ -0,0 +1,172 @@
+import inspect
+import time
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable
+
+from pydantic import BaseModel, ValidationError
+
+from common.codec import decode
+from .connection import Connection
+from .lobby_manager import LobbyManager
+from .logs import MessageLog
+from .metrics import Metrics
+from .models import Lobby, Player
+
+
+@dataclass
+class Context:
+    """Everything a handler needs for one inbound message."""
+    player: Player
+    conn: Connection
+    msg: BaseModel | None = None
+    lobby: Lobby | None = None
+
+
+Handler = Callable[[Context], Awaitable[None]]
+Forwarder = Callable[[str, Context, dict], Awaitable[None]]
+
+
+@dataclass
+class Route:
+    handler: Handler
+    name: str = ""
+    schema: type[BaseModel] | None = None
+    needs_lobby: bool = False
+    coords: bool = False
+    home: Callable[[Context, dict], str | None | Awaitable[str | None]] | None = None
+
+
+@dataclass
+class Router:
+    """Table-driven dispatcher for inbound WebSocket messages.
+
+    Plain string commands (e.g. "heartbeat") are looked up verbatim; object messages are keyed by their
+    "action" field, falling back to "option" for start-menu selections. Every lookup is a single dict
+    access, so the number of registered routes does not affect dispatch cost.
+
+    Each route declares its message schema once. The shared middleware decodes the message in one
+    validation pass, resolves the player's lobby when `needs_lobby` is set, and checks that `x`/`y`
+    fall on the board when `coords` is set, before calling the handler.
+
+    With several workers, a message must run on the worker that holds the lobby it touches. A route's
+    `home` callable (plain or async) names that worker (for `needs_lobby` routes it defaults to the
+    home of the player's lobby); when it is another worker the raw message is passed to `forward` instead.
+
+    With `metrics`, every inbound message is counted by its route name and every handler run (with
+    its middleware) is timed into a histogram per route. With `message_log`, inbound messages are
+    logged (and sampled) by route name; unroutable ones are counted and logged as "unknown".
+    """
+    lobby_manager: LobbyManager
+    worker_id: str | None = None
+    forward: Forwarder | None = None
+    metrics: Metrics | None = None
+    message_log: MessageLog | None = None
+    routes: dict[str, Route] = field(default_factory=dict)
+    text_routes: dict[str, Handler] = field(default_factory=dict)
+
+    def __post_init__(self):
+        if self.metrics is not None:
+            self.messages = self.metrics.counter("htf_messages_total", "Inbound messages by action.", "action")
+            self.handler_seconds = self.metrics.histogram(
+                "htf_handler_seconds", "Handler latency by action, including middleware.", "action")
+            self.handler_errors = self.metrics.counter("htf_handler_errors_total", "Handlers that raised.", "action")
+
+    def text(self, command: str):
+        def decorator(handler: Handler) -> Handler:
+            self.text_routes[command] = handler
+            return handler
+        return decorator
+
+    def route(self, key: str, schema: type[BaseModel] | None = None, needs_lobby: bool = False,
+              coords: bool = False,
+              home: Callable[[Context, dict], str | None | Awaitable[str | None]] | None = None):
+        def decorator(handler: Handler) -> Handler:
+            self.routes[key] = Route(handler=handler, name=key, schema=schema, needs_lobby=needs_lobby,
+                                     coords=coords, home=home)
+            return handler
+        return decorator
+
+    async def home_of(self, route: Route, ctx: Context, raw: dict) -> str | None:
+        if route.home is not None:
+            home = route.home(ctx, raw)
+            return await home if inspect.isawaitable(home) else home
+        if route.needs_lobby:
+            lobby_id = self.lobby_manager.player_lobbies.get(ctx.player.id)
+            if lobby_id is not None and lobby_id not in self.lobby_manager.lobbies:
+                return self.lobby_manager.lobby_home(lobby_id)
+        return None
+
+    async def dispatch(self, player: Player, conn: Connection, data: str | bytes) -> None:
+        raw = decode(data)
+        if isinstance(raw, str):
+            text_handler = self.text_routes.get(raw)
+            if text_handler is None:
+                self.received(player, "unknown", raw)
+            elif self.metrics is None:
+                self.received(player, raw, raw)
+                await text_handler(Context(player=player, conn=conn))
+            else:
+                self.received(player, raw, raw)
+                await self.timed(raw, text_handler, Context(player=player, conn=conn))
+            return
+        route = self.route_for(raw) if isinstance(raw, dict) else None
+        if route is None:
+            self.received(player, "unknown", raw)
+            return
+        self.received(player, route.name, raw)
+        ctx = Context(player=player, conn=conn)
+        if self.forward is not None:
+            home = await self.home_of(route, ctx, raw)
+            if home is not None and home != self.worker_id:
+                await self.forward(home, ctx, raw)
+                return
+        await self.call(route, ctx, raw)
+
+    def route_for(self, raw: dict) -> Route | None:
+        return self.routes.get(raw.get("action")) or self.routes.get(raw.get("option"))
+
+    def received(self, player: Player, name: str, raw):
+        if self.metrics is not None:
+            self.messages.inc(name)
+        if self.message_log is not None:
+            self.message_log.log(player.id, name, raw)
+
+    async def timed(self, name: str, handler: Callable[..., Awaitable[None]], *args) -> None:
+        start = time.perf_counter()
+        try:
+            await handler(*args)
+        except Exception:
+            self.handler_errors.inc(name)
+            raise
+        finally:
+            self.handler_seconds.observe(time.perf_counter() - start, name)
+
+    async def call(self, route: Route, ctx: Context, raw: dict) -> None:
+        """Run the shared middleware for `route` on the decoded message `raw`, then its handler."""
+        if self.metrics is None:
+            await self.run(route, ctx, raw)
+        else:
+            await self.timed(route.name, self.run, route, ctx, raw)
+
+    async def run(self, route: Route, ctx: Context, raw: dict) -> None:
+        if route.schema is not None:
+            try:
+                ctx.msg = route.schema.model_validate(raw)
+            except ValidationError:
+                message = "Invalid coordinates." if route.coords else "Invalid message."
+                ctx.conn.send({"type": "log", "message": f"[red]{message}[/red]"})
+                return
+
+        if route.needs_lobby:
+            ctx.lobby = await self.lobby_manager.get_lobby_by_player(ctx.player.id)
+            if not ctx.lobby:
+                ctx.conn.send({"type": "log", "message": "[red]No lobby found.[/red]"})
+                return
+
+        if route.coords and ctx.lobby is not None:
+            size = ctx.lobby.board_size
+            if not (0 <= ctx.msg.x < size and 0 <= ctx.msg.y < size):
+                ctx.conn.send({"type": "log", "message": "[red]Out of bounds[/red]"})
+                return
+
+        await route.handler(ctx)
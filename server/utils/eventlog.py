@@ -0,0 +1,183 @@
+import asyncio
+import glob
+import json
+import logging
+import os
+from collections.abc import MutableMapping
+
+from .models import Lobby
+
+logger = logging.getLogger("server")
+
+FSYNC_MODES = ("always", "batch", "off")
+SNAPSHOT_FORMAT = 2  # 1 stored boards as bitmasks, which Lobby.restore still reads
+
+# how each logged op is applied again on recovery
+REPLAY = {
+    "join": Lobby.add_player,
+    "computer": Lobby.add_computer,
+    "leave": Lobby.remove_player,
+    "place": Lobby.place_ship,
+    "remove": Lobby.remove_ship,
+    "ships": Lobby.place_ships,
+    "layout": Lobby.set_layout,
+    "placing": Lobby.begin_placement,
+    "start": Lobby.start_game,
+    "shoot": Lobby.shoot,
+    "forfeit": Lobby.forfeit,
+}
+
+
+class EventLog:
+    """Write-ahead log of lobby state changes with periodic snapshots, for crash recovery.
+
+    Every change is a JSON line `[seq, lobby_id, op, *args]`. `record` only appends to an in-memory
+    batch, so the game loop never waits on the disk; the batch is written by `flush` according to
+    `fsync`:
+
+    - "always": write and fsync inside `record`, nothing acknowledged is ever lost, every change pays
+      for a disk sync on the event loop.
+    - "batch": `flush_async` writes and fsyncs the batch from a thread (group commit); a crash loses at
+      most the changes since the last flush.
+    - "off": like "batch" without fsync; survives a process crash once flushed, not a power loss.
+
+    The log is split into segments named after their first sequence number. `compact` writes a
+    snapshot of all lobbies, starts a new segment and deletes the segments it covers, so recovery
+    reads one snapshot plus a short tail.
+    """
+
+    def __init__(self, directory: str, fsync: str = "batch"):
+        if fsync not in FSYNC_MODES:
+            raise ValueError(f"Unknown fsync mode {fsync!r}, expected one of {FSYNC_MODES}")
+        self.directory = directory
+        self.fsync = fsync
+        self.seq = 0
+        self.pending: list[tuple] = []
+        self._file = None
+        self._lock = asyncio.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    @property
+    def snapshot_path(self) -> str:
+        return os.path.join(self.directory, "snapshot.json")
+
+    def _segments(self) -> list[str]:
+        return sorted(glob.glob(os.path.join(self.directory, "events-*.log")))
+
+    def _open_segment(self, first_seq: int):
+        path = os.path.join(self.directory, f"events-{first_seq:012d}.log")
+        self._file = open(path, "a", encoding="utf-8")
+
+    def _close_segment(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def record(self, lobby_id: str, op: str, *args):
+        self.seq += 1
+        self.pending.append((self.seq, lobby_id, op, args))
+        if self.fsync == "always":
+            self.flush()
+
+    def _write(self, records: list[tuple]):
+        if self._file is None:
+            self._open_segment(records[0][0])
+        self._file.write("".join(json.dumps([seq, lobby_id, op, *args], separators=(",", ":")) + "\n"
+                                 for seq, lobby_id, op, args in records))
+        self._file.flush()
+        if self.fsync != "off":
+            os.fsync(self._file.fileno())
+
+    def flush(self) -> int:
+        """Write the pending batch on the calling thread. Returns the number of records written."""
+        records, self.pending = self.pending, []
+        if records:
+            self._write(records)
+        return len(records)
+
+    async def flush_async(self) -> int:
+        """Write the pending batch from a worker thread so the event loop keeps running."""
+        async with self._lock:
+            records, self.pending = self.pending, []
+            if records:
+                await asyncio.to_thread(self._write, records)
+            return len(records)
+
+    async def compact(self, lobbies: dict[str, Lobby]):
+        """Snapshot `lobbies`, then drop the log segments the snapshot makes redundant."""
+        async with self._lock:
+            # taken without awaiting, so the snapshot and `seq` describe the same moment
+            self.flush()
+            old_segments = self._segments()
+            snapshot = {"format": SNAPSHOT_FORMAT, "seq": self.seq,
+                        "lobbies": [lobby.snapshot() for lobby in lobbies.values()]}
+            self._close_segment()  # the next write starts a new segment
+            await asyncio.to_thread(self._write_snapshot, snapshot)
+            for path in old_segments:
+                os.remove(path)
+
+    def _write_snapshot(self, snapshot: dict):
+        tmp_path = self.snapshot_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(snapshot, f, separators=(",", ":"))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.snapshot_path)
+
+    def load(self, player_index: MutableMapping[str, str] | None = None) -> dict[str, Lobby]:
+        """Rebuild the lobbies from the snapshot and the log tail, and continue numbering after them.
+
+        A torn last line from a crash mid-write is cut off, and the replay of that segment ends there.
+        The returned lobbies are not attached to the log yet.
+        """
+        lobbies: dict[str, Lobby] = {}
+        if os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path, encoding="utf-8") as f:
+                snapshot = json.load(f)
+            if snapshot.get("format") not in (1, SNAPSHOT_FORMAT):
+                raise ValueError(f"Unsupported snapshot format {snapshot.get('format')!r}")
+            for data in snapshot["lobbies"]:
+                lobbies[data["id"]] = Lobby.restore(data, player_index)
+            self.seq = snapshot["seq"]
+
+        self._close_segment()
+        for path in self._segments():
+            with open(path, "r+b") as f:
+                offset = 0
+                for line in f:
+                    try:
+                        seq, lobby_id, op, *args = json.loads(line)
+                    except ValueError:
+                        logger.warning(f"Event log {path} ends in a torn record, truncating it.")
+                        f.truncate(offset)
+                        break
+                    offset += len(line)
+                    if seq <= self.seq:
+                        continue
+                    self.seq = seq
+                    apply_event(lobbies, lobby_id, op, args, player_index)
+        return lobbies
+
+    def close(self):
+        self.flush()
+        self._close_segment()
+
+
+def apply_event(lobbies: dict[str, Lobby], lobby_id: str, op: str, args: list,
+                player_index: MutableMapping[str, str] | None = None):
+    if op == "create":
+        is_public, board_size, fleet, seed = args
+        if isinstance(fleet, int):  # logs from before multi-cell ships recorded a count of single cells
+            fleet = [1] * fleet
+        lobbies[lobby_id] = Lobby(id=lobby_id, isPublic=is_public, board_size=board_size, fleet=fleet,
+                                  seed=seed, player_index=player_index)
+        return
+    lobby = lobbies.get(lobby_id)
+    if lobby is None:
+        return
+    if op == "close":
+        del lobbies[lobby_id]
+    elif op in REPLAY:
+        REPLAY[op](lobby, *args)
+    else:
+        logger.warning(f"Skipping unknown event {op!r} for lobby {lobby_id}.")
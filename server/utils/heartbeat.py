@@ -0,0 +1,74 @@
+import math
+import time
+
+
+class HeartbeatTracker:
+    """Tracks connection liveness as deadlines bucketed into a timing wheel.
+
+    Each player sits in exactly one slot, the slot of `last_beat + timeout` rounded up to
+    `resolution` seconds. A beat moves the player to a new slot in O(1) (and is free when the slot
+    does not change), and `expired()` only visits the slots that have come due since the previous
+    call, so a tick costs O(elapsed slots + expired players) no matter how many connections are idle.
+    """
+
+    def __init__(self, timeout: float, resolution: float = 1.0):
+        self.timeout = timeout
+        self.resolution = resolution
+        self.deadlines: dict[str, int] = {}  # {player_id: slot}
+        self.slots: dict[int, set[str]] = {}  # {slot: {player_id, ...}}
+        self._cursor: int | None = None  # first slot not yet checked by expired()
+
+    def __len__(self) -> int:
+        return len(self.deadlines)
+
+    def __contains__(self, player_id: str) -> bool:
+        return player_id in self.deadlines
+
+    def _slot(self, timestamp: float) -> int:
+        return math.ceil(timestamp / self.resolution)
+
+    def beat(self, player_id: str, now: float | None = None, timeout: float | None = None):
+        """Record a sign of life from `player_id`, pushing its deadline `timeout` seconds out.
+
+        `timeout` overrides the tracker's own for this deadline only.
+        """
+        now = time.time() if now is None else now
+        slot = self._slot(now + (self.timeout if timeout is None else timeout))
+        old = self.deadlines.get(player_id)
+        if old == slot:
+            return
+        if old is not None:
+            self._discard(player_id, old)
+        self.deadlines[player_id] = slot
+        self.slots.setdefault(slot, set()).add(player_id)
+        if self._cursor is None:
+            self._cursor = self._slot(now)
+
+    def remove(self, player_id: str):
+        slot = self.deadlines.pop(player_id, None)
+        if slot is not None:
+            self._discard(player_id, slot)
+
+    def _discard(self, player_id: str, slot: int):
+        members = self.slots.get(slot)
+        if members is not None:
+            members.discard(player_id)
+            if not members:
+                del self.slots[slot]
+
+    def expired(self, now: float | None = None) -> list[str]:
+        """Remove and return every player whose deadline has passed."""
+        now = time.time() if now is None else now
+        if self._cursor is None:
+            return []
+        current = math.floor(now / self.resolution)
+        expired = []
+        if self.slots:
+            for slot in range(self._cursor, current + 1):
+                members = self.slots.pop(slot, None)
+                if members:
+                    for player_id in members:
+                        del self.deadlines[player_id]
+                    expired.extend(members)
+        self._cursor = current + 1
+        return expired
@@ -0,0 +1,88 @@
+import asyncio
+import string
+from concurrent.futures import Future
+
+from .state import StateStore
+
+LOBBY_ID_ALPHABET = string.digits
+LOBBY_ID_LENGTH = 6  # typed by players to join a private game
+PLAYER_ID_ALPHABET = string.ascii_letters + string.digits
+PLAYER_ID_LENGTH = 8
+ID_BLOCK = 32  # counter values a worker reserves from the store at a time
+FEISTEL_ROUNDS = 4
+_MASK = (1 << 64) - 1
+
+
+def _mix(value: int) -> int:
+    """splitmix64's finalizer: a cheap, well-spread 64-bit hash of an integer."""
+    value = (value + 0x9E3779B97F4A7C15) & _MASK
+    value = ((value ^ (value >> 30)) * 0xBF58476D1CE4E5B9) & _MASK
+    value = ((value ^ (value >> 27)) * 0x94D049BB133111EB) & _MASK
+    return value ^ (value >> 31)
+
+
+async def _result(future: Future):
+    """The result of a store call, awaited only while it is still running (a MemoryStore's never is)."""
+    return future.result() if future.done() else await asyncio.wrap_future(future)
+
+
+class IdAllocator:
+    """Hands out ids of `length` characters from `alphabet` that never collide, in O(1).
+
+    An id is the next value of a counter shared through the store, run through a keyed Feistel
+    permutation of the id space. Distinct counter values always give distinct ids, so nothing is
+    drawn twice and no lookup is needed to find a free id, however full the space is. Consecutive
+    values still look unrelated, so an id gives its neighbours away no more than a random draw did.
+    The key is kept next to the counter in the store, so every worker uses the same permutation.
+    Each worker reserves `block` values per store round trip and hands them out locally. It asks for
+    the next block as soon as it starts on one, so `allocate` rarely has to wait for the store, and
+    when it does, it awaits the reply instead of blocking the event loop.
+
+    Ids only repeat once every id of the space has been handed out and the counter wraps; callers
+    that can hold an id that long skip the ones still in use.
+    """
+
+    def __init__(self, store: StateStore, sequence: str, alphabet: str, length: int, block: int = ID_BLOCK):
+        if length % 2:
+            raise ValueError("Id length must be even, the permutation splits ids into two halves")
+        self.store = store
+        self.sequence = sequence
+        self.alphabet = alphabet
+        self.length = length
+        self.block = block
+        self.half = len(alphabet) ** (length // 2)
+        self.space = self.half * self.half
+        self._keys: list[int] | None = None  # round keys, made from the store's key on first use
+        self._block: Future | None = None  # the next block, requested while the current one is in use
+        self._next = self._end = 0  # reserved counter values not handed out yet
+
+    async def allocate(self) -> str:
+        if self._next == self._end:
+            await self._take_block()
+        value = self._next % self.space
+        self._next += 1
+        return self._encode(self._permute(value))
+
+    async def _take_block(self):
+        if self._keys is None:
+            key = await _result(self.store.submit(self.store.sequence_key, self.sequence))
+            self._keys = [_mix(key + i) for i in range(FEISTEL_ROUNDS)]
+        block = self._block or self.store.submit(self.store.reserve_ids, self.sequence, self.block)
+        self._block = self.store.submit(self.store.reserve_ids, self.sequence, self.block)
+        # a concurrent call may take another block meanwhile; the values left of this one are skipped
+        self._next = await _result(block)
+        self._end = self._next + self.block
+
+    def _permute(self, value: int) -> int:
+        left, right = divmod(value, self.half)
+        for key in self._keys:
+            left, right = right, (left + _mix(right ^ key)) % self.half
+        return left * self.half + right
+
+    def _encode(self, value: int) -> str:
+        chars = []
+        base = len(self.alphabet)
+        for _ in range(self.length):
+            value, digit = divmod(value, base)
+            chars.append(self.alphabet[digit])
+        return "".join(reversed(chars))
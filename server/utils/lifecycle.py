@@ -0,0 +1,59 @@
+from .heartbeat import HeartbeatTracker
+from .models import Lobby
+
+# seconds a lobby may go without a change in each game state before it is closed; 0 never closes it
+DEFAULT_TTLS = {"waiting": 600, "placing": 300, "playing": 900, "finished": 120}
+
+
+def parse_ttls(spec: str) -> dict[str, float]:
+    """Parse "waiting=300,finished=60" into {state: seconds}."""
+    ttls = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        state, _, seconds = item.partition("=")
+        ttls[state.strip()] = max(0.0, float(seconds))
+    return ttls
+
+
+class LobbyLifecycle:
+    """Closes lobbies that sit idle past the TTL of their game state, and caps how many a worker holds.
+
+    Every change to a lobby (see Lobby.on_change) moves its deadline to `now + ttls[state]`, so a
+    state change picks up the new state's TTL right away. The deadlines live on a timing wheel
+    (HeartbeatTracker): a change within the same slot is free, and `expired()` only visits the slots
+    that came due. A sweep therefore costs O(elapsed slots + expired lobbies), however many lobbies
+    are open.
+    """
+
+    def __init__(self, ttls: dict[str, float] | None = None, max_lobbies: int = 0, resolution: float = 1.0):
+        self.ttls = {**DEFAULT_TTLS, **(ttls or {})}
+        self.max_lobbies = max_lobbies  # 0 means no cap
+        self.deadlines = HeartbeatTracker(0, resolution)
+
+    def __len__(self) -> int:
+        return len(self.deadlines)
+
+    def touch(self, lobby: Lobby, now: float | None = None):
+        """Push the lobby's deadline out by the TTL of its current state."""
+        ttl = self.ttls.get(lobby.game_state.get("state"), 0)
+        if ttl > 0:
+            self.deadlines.beat(lobby.id, now, timeout=ttl)
+        else:
+            self.deadlines.remove(lobby.id)
+
+    def forget(self, lobby_id: str):
+        self.deadlines.remove(lobby_id)
+
+    def expired(self, now: float | None = None) -> list[str]:
+        """Remove and return the ids of the lobbies whose deadline has passed."""
+        return self.deadlines.expired(now)
+
+    def room(self, open_lobbies: int) -> int | None:
+        """How many more lobbies may be opened, or None without a cap."""
+        if not self.max_lobbies:
+            return None
+        return max(0, self.max_lobbies - open_lobbies)
+
+    def admit(self, open_lobbies: int) -> bool:
+        """Whether one more lobby may be opened."""
+        room = self.room(open_lobbies)
+        return room is None or room > 0
@@ -1,28 +1,77 @@
-import random
-import string
-
-from .models import Lobby, Player
+from .eventlog import EventLog
+from .ids import LOBBY_ID_ALPHABET, LOBBY_ID_LENGTH, IdAllocator
+from .lifecycle import LobbyLifecycle
+from .matchmaker import Matchmaker
+from .models import DEFAULT_BOARD_SIZE, Lobby, Player, default_fleet
+from .state import MemoryStore, StateStore
 
 MAX_LOBBY_PLAYERS = 2
 
 
 class LobbyManager:
-    def __init__(self):
-        self.lobbies: dict[str, Lobby] = {}  # {lobby_id: Lobby instance}
-        self.public_queue: list[Player] = []
-
-    def generate_lobby_id(self):
-        lobby_id = ''.join(random.choices(string.digits, k=6))
-        while lobby_id in self.lobbies:
-            lobby_id = ''.join(random.choices(string.digits, k=6))
+    def __init__(self, matchmaker: Matchmaker | None = None, store: StateStore | None = None,
+                 journal: EventLog | None = None, board_size: int = DEFAULT_BOARD_SIZE,
+                 fleet: list[int] | None = None, lifecycle: LobbyLifecycle | None = None):
+        self.board_size = board_size  # for lobbies created without their own, e.g. public games
+        self.fleet = fleet  # None picks default_fleet(board_size)
+        self.store = store or MemoryStore()
+        self.journal = journal  # records every lobby change for crash recovery when set
+        self.lobbies: dict[str, Lobby] = {}  # {lobby_id: Lobby instance}, only lobbies homed on this worker
+        self.public_queue = matchmaker or Matchmaker()
+        self.lifecycle = lifecycle if lifecycle is not None else LobbyLifecycle()  # idle deadlines and the lobby cap
+        # {player_id: lobby_id} across all workers, maintained by Lobby.add/remove_player
+        self.player_lobbies = self.store.player_index()
+        self.spectating: dict[str, str] = {}  # {spectator_id: lobby_id}, for lobbies homed on this worker
+        self.lobby_ids = IdAllocator(self.store, "lobbies", LOBBY_ID_ALPHABET, LOBBY_ID_LENGTH)
+
+    async def generate_lobby_id(self):
+        """Take the next 6-digit id and reserve it in the store for this worker.
+
+        Ids are unique until the allocator has gone through all of them; only then can one still be
+        in use, e.g. by a lobby restored from the journal, and it is skipped.
+        """
+        lobby_id = await self.lobby_ids.allocate()
+        while lobby_id in self.lobbies or not self.store.claim_lobby(lobby_id, self.store.worker_id):
+            lobby_id = await self.lobby_ids.allocate()
         return lobby_id
 
-    async def create_lobby(self, player: Player, is_public: bool = True) -> Lobby:
-        lobby_id = self.generate_lobby_id()
-        lobby = Lobby(id=lobby_id, isPublic=is_public)
+    def lobby_home(self, lobby_id: str | None) -> str | None:
+        """Return the worker that holds `lobby_id`, or None if no such lobby exists."""
+        if not lobby_id:
+            return None
+        if lobby_id in self.lobbies:
+            return self.store.worker_id
+        return self.store.lobby_worker(lobby_id)
+
+    async def find_lobby_home(self, lobby_id: str | None) -> str | None:
+        """Like `lobby_home`, but also finds a lobby another worker created only moments ago."""
+        if not lobby_id:
+            return None
+        return self.lobby_home(lobby_id) or await self.store.lookup_lobby(lobby_id)
+
+    async def create_lobby(self, player: Player, is_public: bool = True, board_size: int | None = None,
+                           fleet: list[int] | None = None) -> Lobby | None:
+        """Create a lobby owned by `player`, with the manager's board and fleet unless given.
+
+        Returns None if this worker already holds as many lobbies as the lifecycle allows.
+        """
+        if not self.lifecycle.admit(len(self.lobbies)):
+            return None
+        self.public_queue.remove(player.id)
+        self.stop_watching(player.id)
+        lobby_id = await self.generate_lobby_id()
+        board_size = board_size or self.board_size
+        fleet = fleet or self.fleet or default_fleet(board_size)
+        lobby = Lobby(id=lobby_id, isPublic=is_public, board_size=board_size, fleet=list(fleet),
+                      player_index=self.player_lobbies, journal=self.journal.record if self.journal else None,
+                      on_change=self.lifecycle.touch)
+        if self.journal:
+            self.journal.record(lobby_id, "create", is_public, lobby.board_size, lobby.fleet, lobby.seed)
         lobby.add_player(player.id)
         lobby.owner_id = player.id
         self.lobbies[lobby_id] = lobby
+        # players on other workers may look the id up as soon as the owner hands it out
+        await self.store.flush()
         return lobby
 
     async def join_lobby(self, player_id: str, lobby_id: str) -> Lobby | None:
@@ -30,28 +79,126 @@ class LobbyManager:
         if not lobby:
             return None
         if lobby.add_player(player_id):
+            self.public_queue.remove(player_id)
+            self.stop_watching(player_id)
             return lobby
         return None
 
-    async def join_public_game(self, player: Player) -> Lobby | None:
-        if not self.public_queue:
-            self.public_queue.append(player)
+    def watch(self, spectator_id: str, lobby_id: str) -> Lobby | None:
+        """Make `spectator_id` a spectator of `lobby_id`, leaving any game they watched before."""
+        lobby = self.lobbies.get(lobby_id)
+        if not lobby:
             return None
+        if self.spectating.get(spectator_id) != lobby_id:
+            self.stop_watching(spectator_id)
+        if not lobby.add_spectator(spectator_id):
+            return None
+        self.spectating[spectator_id] = lobby_id
+        return lobby
 
-        opponent = self.public_queue.pop(0)
-        lobby = await self.create_lobby(opponent, is_public=True)
-        lobby.add_player(player.id)
+    def stop_watching(self, spectator_id: str) -> Lobby | None:
+        """Stop sending `spectator_id` updates. Returns the lobby they were watching."""
+        lobby = self.lobbies.get(self.spectating.pop(spectator_id, None))
+        if lobby:
+            lobby.remove_spectator(spectator_id)
         return lobby
 
+    async def join_public_game(self, player: Player) -> bool:
+        """Queue `player` for a public game. Pairing happens in `match_public_games`.
+
+        Returns False if they are already waiting or sit in a lobby, which they have to leave first.
+        """
+        if player.id in self.player_lobbies:
+            return False
+        return self.public_queue.enqueue(player)
+
+    async def leave_public_queue(self, player_id: str) -> bool:
+        return self.public_queue.remove(player_id)
+
+    async def match_public_games(self) -> list[Lobby]:
+        """Pair queued players in one batch and open a public lobby for each pair.
+
+        Under a lobby cap only as many pairs are made as there is room for; the others keep waiting.
+        Should the cap fill up during the batch (private lobbies are created meanwhile), the pairs
+        left go back into the queue and the lobbies opened so far are returned.
+        """
+        lobbies = []
+        pairs = self.public_queue.match(limit=self.lifecycle.room(len(self.lobbies)))
+        for i, (opponent, player) in enumerate(pairs):
+            waiting = [p for p in (opponent, player) if p.id not in self.player_lobbies]
+            if len(waiting) < 2:
+                # one of them sat down in a lobby on another worker while queued, the other waits on
+                for p in waiting:
+                    self.public_queue.enqueue(p)
+                continue
+            lobby = await self.create_lobby(opponent, is_public=True)
+            if lobby is None:
+                for pair in pairs[i:]:
+                    for p in pair:
+                        if p.id not in self.player_lobbies:
+                            self.public_queue.enqueue(p)
+                break
+            self.stop_watching(player.id)
+            lobby.add_player(player.id)
+            lobbies.append(lobby)
+        return lobbies
+
     async def leave_lobby(self, player_id: str, lobby_id: str) -> bool:
         lobby = self.lobbies.get(lobby_id)
         if not lobby:
             return False
         removed = lobby.remove_player(player_id)
-        if removed and not lobby.players:
-            del self.lobbies[lobby_id]
+        # a computer player does not keep a lobby open on its own
+        if removed and not lobby.has_human():
+            self.close_lobby(lobby_id)
         return removed
 
+    def close_lobby(self, lobby_id: str) -> Lobby | None:
+        """Drop a lobby from this worker, taking out any players still in it. Returns the closed lobby."""
+        lobby = self.lobbies.pop(lobby_id, None)
+        if not lobby:
+            return None
+        lobby.on_change = None
+        for p in list(lobby.players):
+            lobby.remove_player(p.id)
+        # spectators are kept on the closed lobby so the caller can still tell them
+        for spectator_id in lobby.spectators:
+            self.spectating.pop(spectator_id, None)
+        self.lifecycle.forget(lobby_id)
+        self.store.release_lobby(lobby_id)
+        if self.journal:
+            self.journal.record(lobby_id, "close")
+        return lobby
+
+    def expired_lobbies(self, now: float | None = None) -> list[Lobby]:
+        """The lobbies that went idle past their TTL since the last call, still open.
+
+        The caller tells their players and then closes them with `close_lobby`.
+        """
+        return [lobby for lobby_id in self.lifecycle.expired(now) if (lobby := self.lobbies.get(lobby_id))]
+
+    def memory_estimate(self) -> int:
+        """Approximate bytes held by this worker's lobbies, see Lobby.memory_estimate."""
+        return sum(lobby.memory_estimate() for lobby in self.lobbies.values())
+
+    def recover(self) -> list[Lobby]:
+        """Rebuild the lobbies recorded in the journal, e.g. after a restart, and return them."""
+        if not self.journal:
+            return []
+        lobbies = self.journal.load(self.player_lobbies)
+        for lobby_id, lobby in lobbies.items():
+            self.store.claim_lobby(lobby_id, self.store.worker_id)
+            lobby.journal = self.journal.record
+            lobby.on_change = self.lifecycle.touch
+            self.lifecycle.touch(lobby)
+        self.lobbies.update(lobbies)
+        return list(lobbies.values())
+
+    async def snapshot(self):
+        """Write a snapshot of every lobby to the journal and compact its log."""
+        if self.journal:
+            await self.journal.compact(self.lobbies)
+
     async def get_lobby(self, lobby_id: str) -> Lobby | None:
         return self.lobbies.get(lobby_id)
 
@@ -59,7 +206,33 @@ class LobbyManager:
         return list(self.lobbies.values())
 
     async def get_lobby_by_player(self, player_id: str) -> Lobby | None:
-        for lobby in self.lobbies.values():
-            if any(p.id == player_id for p in lobby.players):
-                return lobby
-        return None
+        lobby_id = self.player_lobbies.get(player_id)
+        if lobby_id is None:
+            return None
+        return self.lobbies.get(lobby_id)
+
+    def check_player_index(self) -> list[str]:
+        """Compare `player_lobbies` against the actual lobby memberships.
+
+        Returns a list of human-readable inconsistencies; an empty list means the index is in sync.
+        """
+        problems = []
+        seen: dict[str, str] = {}
+        for lobby_id, lobby in self.lobbies.items():
+            if lobby.player_index is not self.player_lobbies:
+                problems.append(f"Lobby {lobby_id} is not attached to the player index")
+            for p in lobby.players:
+                if p.id in seen:
+                    problems.append(f"Player {p.id} is in lobbies {seen[p.id]} and {lobby_id}")
+                seen[p.id] = lobby_id
+                if self.player_lobbies.get(p.id) != lobby_id:
+                    problems.append(f"Player {p.id} in lobby {lobby_id} is indexed as "
+                                    f"{self.player_lobbies.get(p.id)}")
+        for player_id, lobby_id in self.player_lobbies.items():
+            if lobby_id in self.lobbies:
+                if seen.get(player_id) != lobby_id:
+                    problems.append(f"Index maps {player_id} to {lobby_id} but the player is not in it")
+            elif self.store.lobby_worker(lobby_id) in (None, self.store.worker_id):
+                # lobbies homed on other workers are theirs to check
+                problems.append(f"Index maps {player_id} to unknown lobby {lobby_id}")
+        return problems
@@ -0,0 +1,113 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+
+LOG_FORMATS = ("text", "json")
+TEXT_FORMAT = "%(levelname)s:%(name)s:%(message)s"
+# record attributes that are not passed through as structured fields
+_STANDARD_FIELDS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, with any `extra={...}` fields of the call as keys."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": round(record.created, 6),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _STANDARD_FIELDS:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """Hands records to the listener thread as they are, so %-style arguments are formatted there.
+
+    The stock QueueHandler formats the message before queueing it, which would keep that work on the
+    event loop. Arguments are therefore rendered a little later; only pass values that are not
+    mutated afterwards (ids, numbers, decoded messages).
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+def setup_logging(level: str = "INFO", fmt: str = "text", start: bool = True) -> logging.handlers.QueueListener:
+    """Route every log record through a queue to a background thread that formats and writes it.
+
+    Logging call sites only build a record and append it to an in-memory queue, so formatting and
+    stream I/O never run on the event loop. Returns the listener, running unless `start` is false;
+    records logged until `start_listener` is called wait in the queue.
+    """
+    if fmt not in LOG_FORMATS:
+        raise ValueError(f"Unknown log format {fmt!r}, expected one of {LOG_FORMATS}")
+    # none of this is in our formats, and collecting it is most of what a logging call costs
+    logging.logThreads = False
+    logging.logProcesses = False
+    logging.logMultiprocessing = False
+    logging._srcfile = None  # skips the stack walk for file and line, as the logging docs suggest
+    stream = logging.StreamHandler(sys.stderr)
+    stream.setFormatter(JsonFormatter() if fmt == "json" else logging.Formatter(TEXT_FORMAT))
+    records: queue.SimpleQueue = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(records, stream, respect_handler_level=True)
+
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(DeferredQueueHandler(records))
+    root.setLevel(level.upper())
+    if start:
+        start_listener(listener)
+    return listener
+
+
+def start_listener(listener: logging.handlers.QueueListener):
+    """Start writing the queued records; the listener is stopped (and the queue drained) at interpreter exit."""
+    listener.start()
+    atexit.register(listener.stop)
+
+
+def parse_sample_rates(spec: str) -> dict[str, float]:
+    """Parse "heartbeat=0,shoot=0.1" into {kind: fraction of messages to log}."""
+    rates = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        kind, _, rate = item.partition("=")
+        rates[kind.strip()] = min(1.0, max(0.0, float(rate)))
+    return rates
+
+
+class MessageLog:
+    """Logs inbound messages by kind (route name), keeping only a configured share of noisy kinds.
+
+    A rate of 0 suppresses a kind, 0.01 logs every hundredth message of it and kinds without a rate
+    are always logged. Sampling is a per-kind counter rather than a random draw, and the level check
+    comes first, so a message that is not logged costs a dict lookup and no formatting at all.
+    """
+
+    def __init__(self, logger: logging.Logger, rates: dict[str, float] | None = None, level: int = logging.INFO):
+        self.logger = logger
+        self.level = level
+        self.every = {kind: (round(1 / rate) if rate > 0 else 0) for kind, rate in (rates or {}).items()}
+        self.seen: dict[str, int] = {}
+        self.suppressed = 0
+
+    def log(self, player_id: str, kind: str, raw):
+        if not self.logger.isEnabledFor(self.level):
+            return
+        every = self.every.get(kind, 1)
+        if every != 1:
+            seen = self.seen[kind] = self.seen.get(kind, 0) + 1
+            if every == 0 or seen % every:
+                self.suppressed += 1
+                return
+        self.logger.log(self.level, "Received %s from %s: %s", kind, player_id, raw,
+                        extra={"player": player_id, "kind": kind})
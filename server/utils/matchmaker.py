@@ -0,0 +1,101 @@
+import bisect
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Callable, Hashable
+
+from .models import Player
+
+
+def default_bucket(_: Player) -> Hashable:
+    """Put every player in the same pool. Swap in e.g. a board-size or rating band key."""
+    return None
+
+
+@dataclass
+class WaitTimeStats:
+    """Histogram of how long matched players sat in the queue, in seconds."""
+    bounds: tuple[float, ...] = (0.1, 0.5, 1, 2, 5, 10, 30, 60)
+    counts: list[int] = field(default_factory=list)
+    count: int = 0
+    total: float = 0.0
+    max: float = 0.0
+
+    def __post_init__(self):
+        if not self.counts:
+            self.counts = [0] * (len(self.bounds) + 1)  # last bucket is +Inf
+
+    def observe(self, seconds: float):
+        self.counts[bisect.bisect_left(self.bounds, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def snapshot(self) -> dict:
+        return {
+            "count": self.count,
+            "avg": self.total / self.count if self.count else 0.0,
+            "max": self.max,
+            "buckets": dict(zip([*map(str, self.bounds), "+Inf"], self.counts)),
+        }
+
+
+class Matchmaker:
+    """Public matchmaking queue with O(1) enqueue and O(1) removal.
+
+    Waiting players are kept per bucket in insertion-ordered dicts keyed by player id, so the oldest
+    waiter is popped in O(1) and a disconnecting player is dropped in O(1). Pairing happens in
+    batches: `match()` is meant to be called from a periodic tick and pairs every waiter it can.
+    """
+
+    def __init__(self, bucket_key: Callable[[Player], Hashable] = default_bucket):
+        self.bucket_key = bucket_key
+        self.buckets: dict[Hashable, OrderedDict[str, tuple[Player, float]]] = {}
+        self.entries: dict[str, Hashable] = {}  # {player_id: bucket}
+        self.wait_times = WaitTimeStats()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __contains__(self, player_id: str) -> bool:
+        return player_id in self.entries
+
+    def enqueue(self, player: Player, now: float | None = None) -> bool:
+        """Add `player` to their bucket. Returns False if they are already waiting."""
+        if player.id in self.entries:
+            return False
+        key = self.bucket_key(player)
+        self.buckets.setdefault(key, OrderedDict())[player.id] = (player, time.time() if now is None else now)
+        self.entries[player.id] = key
+        return True
+
+    def remove(self, player_id: str) -> bool:
+        if player_id not in self.entries:
+            return False
+        key = self.entries.pop(player_id)
+        bucket = self.buckets[key]
+        del bucket[player_id]
+        if not bucket:
+            del self.buckets[key]
+        return True
+
+    def match(self, now: float | None = None, limit: int | None = None) -> list[tuple[Player, Player]]:
+        """Pair the longest-waiting players of every bucket, oldest first, and record their wait times.
+
+        At most `limit` pairs are made if given; the rest keep their place in the queue.
+        """
+        now = time.time() if now is None else now
+        pairs = []
+        for key in list(self.buckets):
+            bucket = self.buckets[key]
+            while len(bucket) >= 2 and (limit is None or len(pairs) < limit):
+                _, (first, first_since) = bucket.popitem(last=False)
+                _, (second, second_since) = bucket.popitem(last=False)
+                del self.entries[first.id], self.entries[second.id]
+                self.wait_times.observe(now - first_since)
+                self.wait_times.observe(now - second_since)
+                pairs.append((first, second))
+            if not bucket:
+                del self.buckets[key]
+        return pairs
@@ -0,0 +1,136 @@
+import bisect
+from typing import Callable
+
+# seconds; covers a fast handler (100µs) up to a stalled event loop
+DEFAULT_BOUNDS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+
+def _labels(label_name: str | None, label: str, extra: str = "") -> str:
+    parts = [f'{label_name}="{label}"'] if label_name else []
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Counter:
+    __slots__ = ("name", "help", "label_name", "values")
+
+    def __init__(self, name: str, help: str, label_name: str | None = None):
+        self.name = name
+        self.help = help
+        self.label_name = label_name
+        self.values: dict[str, float] = {}
+
+    def inc(self, label: str = "", amount: float = 1):
+        self.values[label] = self.values.get(label, 0) + amount
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for label, value in self.values.items():
+            lines.append(f"{self.name}{_labels(self.label_name, label)} {value}")
+        return lines
+
+
+class Histogram:
+    """Bucketed observations per label. Each series is [count per bucket..., count above, sum]."""
+    __slots__ = ("name", "help", "label_name", "bounds", "series")
+
+    def __init__(self, name: str, help: str, label_name: str | None = None,
+                 bounds: tuple[float, ...] = DEFAULT_BOUNDS):
+        self.name = name
+        self.help = help
+        self.label_name = label_name
+        self.bounds = bounds
+        self.series: dict[str, list[float]] = {}
+
+    def observe(self, value: float, label: str = ""):
+        series = self.series.get(label)
+        if series is None:
+            series = self.series[label] = [0] * (len(self.bounds) + 2)
+        series[bisect.bisect_left(self.bounds, value)] += 1
+        series[-1] += value
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for label, series in self.series.items():
+            lines.extend(_render_buckets(self.name, self.label_name, label, self.bounds, series[:-1], series[-1]))
+        return lines
+
+
+def _render_buckets(name: str, label_name: str | None, label: str, bounds, counts, total: float) -> list[str]:
+    lines = []
+    cumulative = 0
+    for bound, count in zip([*bounds, "+Inf"], counts):
+        cumulative += count
+        le = f'le="{bound}"'
+        lines.append(f"{name}_bucket{_labels(label_name, label, le)} {cumulative}")
+    lines.append(f"{name}_sum{_labels(label_name, label)} {total}")
+    lines.append(f"{name}_count{_labels(label_name, label)} {cumulative}")
+    return lines
+
+
+class Gauge:
+    """A value read when metrics are rendered: a number, or {label: number} with `label_name`."""
+    __slots__ = ("name", "help", "label_name", "read")
+
+    def __init__(self, name: str, help: str, read: Callable[[], float | dict[str, float]],
+                 label_name: str | None = None):
+        self.name = name
+        self.help = help
+        self.label_name = label_name
+        self.read = read
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        value = self.read()
+        values = value if isinstance(value, dict) else {"": value}
+        for label, number in values.items():
+            lines.append(f"{self.name}{_labels(self.label_name, label)} {number}")
+        return lines
+
+
+class HistogramView:
+    """Exposes a histogram kept elsewhere, e.g. Matchmaker.wait_times, without copying it."""
+    __slots__ = ("name", "help", "source")
+
+    def __init__(self, name: str, help: str, source):
+        self.name = name
+        self.help = help
+        self.source = source  # has `bounds`, `counts` (one more than bounds) and `total`
+
+    def render(self) -> list[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram",
+                *_render_buckets(self.name, None, "", self.source.bounds, self.source.counts, self.source.total)]
+
+
+class Metrics:
+    """Registry rendered in the Prometheus text format.
+
+    Observations are plain dict and list updates. They happen on the event loop thread only, so they
+    need no locks and cost well under a microsecond. Gauges are computed when metrics are rendered
+    instead of being kept up to date.
+    """
+
+    def __init__(self):
+        self.metrics: list = []
+
+    def _add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help: str, label_name: str | None = None) -> Counter:
+        return self._add(Counter(name, help, label_name))
+
+    def histogram(self, name: str, help: str, label_name: str | None = None,
+                  bounds: tuple[float, ...] = DEFAULT_BOUNDS) -> Histogram:
+        return self._add(Histogram(name, help, label_name, bounds))
+
+    def gauge(self, name: str, help: str, read: Callable[[], float | dict[str, float]],
+              label_name: str | None = None) -> Gauge:
+        return self._add(Gauge(name, help, read, label_name))
+
+    def histogram_view(self, name: str, help: str, source) -> HistogramView:
+        return self._add(HistogramView(name, help, source))
+
+    def render(self) -> str:
+        return "\n".join(line for metric in self.metrics for line in metric.render()) + "\n"
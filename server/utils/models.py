@@ -1,11 +1,40 @@
+from collections import Counter
+from collections.abc import MutableMapping
 from dataclasses import field, dataclass
-from typing import Any
+from typing import Any, Callable
 import random
+import sys
+import time
 
 from pydantic import BaseModel
 
-BORD_X = 10
-BORD_Y = 10
+from .board import EMPTY, SHIP, Board, BoardView, HIT, Ship, blank_view
+
+MAX_BOARD_SIZE = 1000
+DEFAULT_BOARD_SIZE = 5
+DEFAULT_FLEET = (1, 1, 1)  # ship lengths on the default board
+CLASSIC_FLEET = (5, 4, 3, 3, 2)
+RANDOM_PLACEMENT_TRIES = 100  # random spots tried per ship before listing every spot that fits
+MAX_SPECTATORS = 1000  # per lobby
+
+
+def default_fleet(board_size: int) -> list[int]:
+    """Ship lengths for a board: three single cells on small boards, one classic fleet per 10 columns."""
+    if board_size < 10:
+        return list(DEFAULT_FLEET)
+    return list(CLASSIC_FLEET) * (board_size // 10)
+
+
+def check_board(board_size: int, fleet: list[int]) -> str | None:
+    """Return why this board size and fleet cannot be played, or None if they can."""
+    if not 1 <= board_size <= MAX_BOARD_SIZE:
+        return f"Board size must be between 1 and {MAX_BOARD_SIZE}"
+    if not fleet or any(not 1 <= length <= board_size for length in fleet):
+        return "Every ship must fit on the board"
+    # leave room for random placement to finish quickly
+    if sum(fleet) > board_size * board_size // 2:
+        return "The fleet covers more than half of the board"
+    return None
 
 
 @dataclass
@@ -20,9 +49,120 @@ class Lobby:
     owner_id: str | None = None
     players: list[PlayerRef] = field(default_factory=list)
     game_state: dict = field(default_factory=lambda: {"state": "waiting", "turn": None, "winner": None})
-    board_size: int = 5
-    boards: dict[str, list[list[str]]] = field(default_factory=dict)
-    ships_required: int = 3
+    board_size: int = DEFAULT_BOARD_SIZE
+    boards: dict[str, Board] = field(default_factory=dict)
+    # lengths of the ships every player places
+    fleet: list[int] = field(default_factory=lambda: list(DEFAULT_FLEET))
+    # bumped on every board mutation; clients use it to detect missed delta updates
+    version: int = 0
+    # shared {player_id: lobby_id} index owned by the LobbyManager, kept in sync on join/leave
+    player_index: MutableMapping[str, str] | None = field(default=None, repr=False, compare=False)
+    # called as journal(lobby_id, op, *args) after every state change, see EventLog.record
+    journal: Callable[..., None] | None = field(default=None, repr=False, compare=False)
+    # called as on_change(lobby) after every state change, e.g. to push back its idle deadline
+    on_change: Callable[["Lobby"], None] | None = field(default=None, repr=False, compare=False)
+    # seeds `rng`, which drives place_ships_randomly; kept so a replay can name it
+    seed: int = field(default_factory=lambda: random.getrandbits(32))
+    # set by start_game: when play began, every player's ship layout at that moment and
+    # the shots since as (ms since start, shooter index in players, x, y)
+    started_at: float | None = None
+    initial_ships: dict[str, list[tuple[int, int, int, bool]]] = field(default_factory=dict)
+    shots: list[tuple[int, int, int, int]] = field(default_factory=list, repr=False)
+    forfeited_by: str | None = None
+    # seats played by the server, {player_id: difficulty}, see add_computer
+    computers: dict[str, str] = field(default_factory=dict)
+    # consecutive turns each player let run out, reset when they shoot themselves
+    missed_turns: dict[str, int] = field(default_factory=dict, repr=False, compare=False)
+    # ids of the connections watching the game; not players, not journaled, see add_spectator
+    spectators: set[str] = field(default_factory=set, repr=False, compare=False)
+    # numbers the updates sent to spectators, so they can tell when one went missing
+    spectator_seq: int = field(default=0, repr=False, compare=False)
+    rng: random.Random = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        self.rng = random.Random(self.seed)
+
+    @property
+    def ships_required(self) -> int:
+        return len(self.fleet)
+
+    def _record(self, op: str, *args):
+        if self.journal is not None:
+            self.journal(self.id, op, *args)
+        if self.on_change is not None:
+            self.on_change(self)
+
+    def memory_estimate(self) -> int:
+        """Approximate bytes held by this lobby, boards and shot history included.
+
+        Built from container sizes and per-entry constants, so it costs O(players), not a deep walk.
+        """
+        shot = sys.getsizeof((0, 0, 0, 0)) + sys.getsizeof(1 << 20)
+        ship = sys.getsizeof((0, 0, 1, False))
+        return (sys.getsizeof(self) + sum(board.memory_estimate() for board in self.boards.values())
+                + sys.getsizeof(self.shots) + len(self.shots) * shot
+                + sum(sys.getsizeof(layout) + len(layout) * ship for layout in self.initial_ships.values()))
+
+    def snapshot(self) -> dict:
+        """Return the lobby's full state as plain JSON-compatible data."""
+        return {
+            "id": self.id,
+            "isPublic": self.isPublic,
+            "owner_id": self.owner_id,
+            "players": [p.id for p in self.players],
+            "game_state": dict(self.game_state),
+            "board_size": self.board_size,
+            "fleet": self.fleet,
+            "version": self.version,
+            "seed": self.seed,
+            "started_at": self.started_at,
+            "initial_ships": self.initial_ships,
+            "shots": self.shots,
+            "forfeited_by": self.forfeited_by,
+            "computers": self.computers,
+            "boards": {player_id: board.snapshot() for player_id, board in self.boards.items()},
+        }
+
+    @classmethod
+    def restore(cls, data: dict, player_index: MutableMapping[str, str] | None = None) -> "Lobby":
+        """Rebuild a lobby from `snapshot()` output and re-register its players in `player_index`.
+
+        Snapshots that stored boards as hex bitmasks of single-cell ships are read as well.
+        """
+        size = data["board_size"]
+
+        def board(saved) -> Board:
+            if isinstance(saved, list):
+                return Board.from_masks(size, *(int(mask, 16) for mask in saved))
+            return Board.from_layout(size, saved["ships"], saved["hits"], saved["misses"])
+
+        def layout(saved) -> list[tuple[int, int, int, bool]]:
+            if isinstance(saved, str):
+                return Board.from_masks(size, int(saved, 16), 0, 0).layout()
+            return [tuple(ship) for ship in saved]
+
+        lobby = cls(
+            id=data["id"],
+            isPublic=data["isPublic"],
+            owner_id=data["owner_id"],
+            players=[PlayerRef(id=player_id) for player_id in data["players"]],
+            game_state=data["game_state"],
+            board_size=size,
+            fleet=data.get("fleet") or [1] * data["ships_required"],
+            version=data["version"],
+            boards={player_id: board(saved) for player_id, saved in data["boards"].items()},
+            player_index=player_index,
+            seed=data.get("seed", 0),
+            started_at=data.get("started_at"),
+            initial_ships={player_id: layout(saved) for player_id, saved in data.get("initial_ships", {}).items()},
+            shots=[tuple(shot) for shot in data.get("shots", [])],
+            forfeited_by=data.get("forfeited_by"),
+            computers=data.get("computers", {}),
+        )
+        if player_index is not None:
+            for p in lobby.players:
+                player_index[p.id] = lobby.id
+        return lobby
 
     def add_player(self, player_id: str) -> bool:
         if any(p.id == player_id for p in self.players):
@@ -30,21 +170,78 @@ class Lobby:
         if len(self.players) >= 2:
             return False
         self.players.append(PlayerRef(id=player_id))
+        if self.player_index is not None:
+            self.player_index[player_id] = self.id
         if not self.owner_id:
             self.owner_id = player_id
         if player_id not in self.boards:
-            self.boards[player_id] = [["~"] * self.board_size for _ in range(self.board_size)]
+            self.boards[player_id] = Board(self.board_size)
+        self._record("join", player_id)
         return True
 
+    def add_computer(self, player_id: str, difficulty: str) -> bool:
+        """Seat a computer player, which the server plays at `difficulty`, see ai.py."""
+        if len(self.players) >= 2 or any(p.id == player_id for p in self.players):
+            return False
+        self.computers[player_id] = difficulty
+        # recorded before the join, so replaying the log seats the computer before its player
+        self._record("computer", player_id, difficulty)
+        return self.add_player(player_id)
+
+    def has_human(self) -> bool:
+        return any(p.id not in self.computers for p in self.players)
+
     def remove_player(self, player_id: str) -> bool:
         before = len(self.players)
         self.players = [p for p in self.players if p.id != player_id]
+        removed = len(self.players) != before
+        if removed and self.player_index is not None and self.player_index.get(player_id) == self.id:
+            del self.player_index[player_id]
         if self.owner_id == player_id:
             self.owner_id = self.players[0].id if self.players else None
-        return len(self.players) != before
+        if removed:
+            self._record("leave", player_id)
+        return removed
+
+    def add_spectator(self, spectator_id: str) -> bool:
+        """Let `spectator_id` watch the game. Spectators never take a player's seat."""
+        if any(p.id == spectator_id for p in self.players):
+            return False
+        if spectator_id not in self.spectators and len(self.spectators) >= MAX_SPECTATORS:
+            return False
+        self.spectators.add(spectator_id)
+        return True
+
+    def remove_spectator(self, spectator_id: str) -> bool:
+        if spectator_id not in self.spectators:
+            return False
+        self.spectators.discard(spectator_id)
+        return True
+
+    def board_view(self, player_id: str) -> BoardView | None:
+        """The player's own board as they see it, ships included."""
+        board = self.boards.get(player_id)
+        return board.own if board else None
+
+    def public_view(self, player_id: str) -> BoardView:
+        """The player's board as anyone but its owner sees it: hits and misses, no ships."""
+        board = self.boards.get(player_id)
+        return board.opponent if board else blank_view(self.board_size)
+
+    def opponent_view(self, player_id: str) -> BoardView:
+        """The opponent's board as the player sees it, blank while there is no opponent."""
+        opponent_id = self._opponent_id(player_id)
+        return self.public_view(opponent_id) if opponent_id else blank_view(self.board_size)
 
-    def get_board(self, player_id: str) -> list[list[str]]:
-        return self.boards.get(player_id, [])
+    def get_public_board(self, player_id: str) -> list[list[str]] | dict:
+        return self.public_view(player_id).wire()
+
+    def get_board(self, player_id: str) -> list[list[str]] | dict:
+        """The player's own board for the wire: rows of cells on small boards, and on large ones
+        {"size": n, "cells": [[x, y, cell], ...]} listing only the cells that are not '~'. Boards above
+        DENSE_BOARD_MAX use the latter. The value is cached until the board changes, see BoardView."""
+        view = self.board_view(player_id)
+        return view.wire() if view else []
 
     def update_game_state(self):
         if len(self.players) < 2:
@@ -52,46 +249,124 @@ class Lobby:
         else:
             self.game_state = {"state": "playing", "winner": None, "turn": self.players[0].id}
 
+    def remaining_ships(self, player_id: str) -> list[int]:
+        """Lengths of the fleet's ships the player has not placed yet, longest first."""
+        board = self.boards.get(player_id)
+        placed = Counter(ship.length for ship in board.ships) if board else Counter()
+        remaining = []
+        for length in sorted(self.fleet, reverse=True):
+            if placed[length]:
+                placed[length] -= 1
+            else:
+                remaining.append(length)
+        return remaining
+
     def place_ships_randomly(self, player_id: str, num_ships: int | None = None):
-        """Place single-cell ships marked with 'S' randomly on the player's board.
+        """Place the player's remaining ships at random, at most `num_ships` of them if given.
 
-        If `num_ships` is None, place up to `self.ships_required` ships. Existing ships are not
-        removed; placement only fills free '~' cells.
+        Existing ships are kept. Each ship tries random spots until one fits, so a sparse board is
+        never enumerated; only a crowded one falls back to listing every spot that fits.
         """
-        if num_ships is None:
-            num_ships = self.ships_required
         board = self.boards.get(player_id)
         if not board:
             return
-        free_cells = [(x, y) for x in range(self.board_size) for y in range(self.board_size) if board[y][x] == "~"]
-        random.shuffle(free_cells)
-        for i in range(min(num_ships, len(free_cells))):
-            x, y = free_cells[i]
-            board[y][x] = "S"
+        remaining = self.remaining_ships(player_id)
+        if num_ships is not None:
+            remaining = remaining[:max(num_ships, 0)]
+        placed = []
+        for length in remaining:
+            spot = self._random_spot(board, length)
+            if spot is None:
+                break
+            placed.append(board.place(*spot))
+        self._placed(player_id, placed)
+
+    def _random_spot(self, board: Board, length: int) -> tuple[int, int, int, bool] | None:
+        size, rng = self.board_size, self.rng
+        for _ in range(RANDOM_PLACEMENT_TRIES):
+            vertical = rng.random() < 0.5
+            x = rng.randrange(size if vertical else size - length + 1)
+            y = rng.randrange(size - length + 1 if vertical else size)
+            if board.fits(x, y, length, vertical):
+                return x, y, length, vertical
+        spots = [(x, y, length, vertical) for vertical in (False, True) for y in range(size) for x in range(size)
+                 if board.fits(x, y, length, vertical)]
+        return rng.choice(spots) if spots else None
+
+    def place_ships(self, player_id: str, layout: list[tuple[int, int, int, bool]]):
+        """Place several (x, y, length, vertical) ships in one update, skipping any that do not fit."""
+        board = self.boards.get(player_id)
+        if not board:
+            return
+        self._placed(player_id, [ship for x, y, length, vertical in layout
+                                 if (ship := board.place(x, y, length, vertical))])
+
+    def _placed(self, player_id: str, ships: list[Ship]):
+        if ships:
+            self.version += 1
+            self._record("ships", player_id, [ship.layout() for ship in ships])
 
     def ships_placed(self, player_id: str) -> int:
         board = self.boards.get(player_id)
         if not board:
             return 0
-        return sum(1 for row in board for cell in row if cell == "S")
+        return board.ship_count
 
-    def place_ship(self, player_id: str, x: int, y: int) -> dict:
-        """Place a single-cell ship at (x, y) if within bounds, not occupied, and under limit.
+    def place_ship(self, player_id: str, x: int, y: int, vertical: bool = False) -> dict:
+        """Place the player's longest unplaced ship with its bow at (x, y), running right or down.
 
-        Returns a dict containing either an 'error' key or 'ok': True and 'placed' count.
+        Returns a dict containing either an 'error' key or 'ok': True, the 'placed' count and the
+        'cells' the ship covers.
         """
         if x < 0 or y < 0 or x >= self.board_size or y >= self.board_size:
             return {"error": "Out of bounds"}
         board = self.boards.get(player_id)
         if board is None:
             return {"error": "Board not found"}
-        if board[y][x] == "S":
+        if board.has_ship(x, y):
             return {"error": "Already ship"}
-        placed = self.ships_placed(player_id)
-        if placed >= self.ships_required:
+        remaining = self.remaining_ships(player_id)
+        if not remaining:
             return {"error": "Max ships placed"}
-        board[y][x] = "S"
-        return {"ok": True, "placed": placed + 1}
+        ship = board.place(x, y, remaining[0], vertical)
+        if ship is None:
+            end = (x, y + remaining[0] - 1) if vertical else (x + remaining[0] - 1, y)
+            return {"error": "Out of bounds" if not board.in_bounds(*end) else "Already ship"}
+        self.version += 1
+        self._record("place", player_id, x, y, vertical)
+        return {"ok": True, "placed": board.ship_count, "cells": ship.cells()}
+
+    def set_layout(self, player_id: str, layout: list[tuple[int, int, int, bool]]) -> dict:
+        """Replace the player's ships with `layout`, a list of (x, y, length, vertical), all or nothing.
+
+        The lengths must come out of the fleet; ships left out are placed at random when placement
+        ends. Returns a dict containing either an 'error' key or 'ok': True, the 'placed' count and
+        the [x, y, cell] triples of the cells that changed.
+        """
+        board = self.boards.get(player_id)
+        if board is None:
+            return {"error": "Board not found"}
+        if self.game_state.get("state") not in ("waiting", "placing"):
+            return {"error": "The game has already started"}
+        if len(layout) > len(self.fleet) or Counter(ship[2] for ship in layout) - Counter(self.fleet):
+            return {"error": "The layout does not match the fleet"}
+        # check the whole layout on a scratch board first, so a bad ship leaves the real one untouched
+        scratch = Board(self.board_size)
+        for x, y, length, vertical in layout:
+            if scratch.place(x, y, length, vertical) is None:
+                end = (x, y + length - 1) if vertical else (x + length - 1, y)
+                fits = scratch.in_bounds(x, y) and scratch.in_bounds(*end)
+                return {"error": f"Ship at ({x},{y}) {'overlaps another ship' if fits else 'is out of bounds'}"}
+        before = {cell for ship in board.ships for cell in ship.cells()}
+        for ship in list(board.ships):
+            board.remove(ship.x, ship.y)
+        for x, y, length, vertical in layout:
+            board.place(x, y, length, vertical)
+        after = {cell for ship in board.ships for cell in ship.cells()}
+        self.version += 1
+        self._record("layout", player_id, [ship.layout() for ship in board.ships])
+        cells = [[x, y, EMPTY] for x, y in before - after] + [[x, y, SHIP] for x, y in after - before]
+        return {"ok": True, "placed": board.ship_count, "cells": cells}
 
     def remove_ship(self, player_id: str, x: int, y: int) -> dict:
         if x < 0 or y < 0 or x >= self.board_size or y >= self.board_size:
@@ -99,15 +374,23 @@ class Lobby:
         board = self.boards.get(player_id)
         if board is None:
             return {"error": "Board not found"}
-        if board[y][x] != "S":
+        ship = board.remove(x, y)
+        if ship is None:
             return {"error": "No ship at position"}
-        board[y][x] = "~"
-        return {"ok": True, "placed": self.ships_placed(player_id)}
+        self.version += 1
+        self._record("remove", player_id, x, y)
+        return {"ok": True, "placed": board.ship_count, "cells": ship.cells()}
 
-    def start_game(self) -> dict:
+    def begin_placement(self):
+        """Switch the lobby into the ship placement phase."""
+        self.game_state = {"state": "placing", "turn": None, "winner": None}
+        self._record("placing")
+
+    def start_game(self, at: float | None = None) -> dict:
         """Start the game if both players have placed the required number of ships.
 
         Sets the initial turn to the first player in `self.players` and updates `self.game_state`.
+        `at` overrides the start time, e.g. when replaying the event log.
         Returns a dict with 'ok': True on success or an 'error' key on failure.
         """
         if len(self.players) < 2:
@@ -117,6 +400,10 @@ class Lobby:
                 return {"error": f"Player {p.id} has not placed enough ships"}
         first = self.players[0].id if self.players else None
         self.game_state = {"state": "playing", "turn": first, "winner": None}
+        self.started_at = time.time() if at is None else at
+        self.initial_ships = {player_id: board.layout() for player_id, board in self.boards.items()}
+        self.shots = []
+        self._record("start", self.started_at)
         return {"ok": True}
 
     def _opponent_id(self, player_id: str) -> str | None:
@@ -125,12 +412,14 @@ class Lobby:
                 return p.id
         return None
 
-    def shoot(self, shooter_id: str, x: int, y: int) -> dict:
-        """Handle a shot from `shooter_id` at coordinates (x, y).
+    def shoot(self, shooter_id: str, x: int, y: int, at: float | None = None) -> dict:
+        """Handle a shot from `shooter_id` at coordinates (x, y), fired at time `at` (now by default).
 
         Returns a dict with keys:
         - 'hit': bool
         - 'already': bool (if that cell was already shot)
+        - 'cell': the new state of the shot cell ('X' or 'O'), on fresh shots
+        - 'sunk': the length of the ship this shot sank, if it did
         - 'winner': optional id of winner when the shot finishes the game
 
         This implementation switches the turn to the opponent after each shot (even on hit).
@@ -146,40 +435,68 @@ class Lobby:
         if x < 0 or y < 0 or x >= self.board_size or y >= self.board_size:
             return {"error": "Out of bounds"}
 
-        cell = board[y][x]
-        if cell in ("X", "O"):
-            return {"hit": cell == "X", "already": True}
+        if board.is_shot(x, y):
+            return {"hit": board.cell(x, y) == HIT, "already": True}
 
-        hit = False
-        if cell == "S":
-            board[y][x] = "X"
-            hit = True
-        else:
-            board[y][x] = "O"
+        cell = board.fire(x, y)
+        hit = cell == HIT
+        ship = board.ship_at(x, y) if hit else None
+        self.version += 1
 
         # switch turn to opponent
         self.game_state["turn"] = opponent_id
 
         # check whether opponent has any ships left
-        opponent_board = board
-        ships_left = any(cell == "S" for row in opponent_board for cell in row)
-        if not ships_left:
+        if not board.ships_left:
             self.game_state["state"] = "finished"
             self.game_state["winner"] = shooter_id
 
-        return {"hit": hit, "already": False, "winner": self.game_state.get("winner")}
+        if self.started_at is not None:
+            at = time.time() if at is None else at
+            shooter = 0 if self.players[0].id == shooter_id else 1
+            self.shots.append((int((at - self.started_at) * 1000), shooter, x, y))
+            self._record("shoot", shooter_id, x, y, at)
+        else:
+            self._record("shoot", shooter_id, x, y)
 
-    def get_opponent_view(self, player_id: str) -> list[list[str]]:
-        """Return a view of the opponent's board where ships are hidden; only X and O are visible.
+        return {"hit": hit, "already": False, "cell": cell, "sunk": ship.length if ship and ship.sunk else None,
+                "winner": self.game_state.get("winner")}
 
-        If there is no opponent, return a blank board view.
-        """
+    def forfeit(self, player_id: str) -> dict:
+        """End a running game in favour of `player_id`'s opponent."""
+        if self.game_state.get("state") != "playing":
+            return {"error": "Game is not running"}
         opponent_id = self._opponent_id(player_id)
         if not opponent_id:
-            return [["~"] * self.board_size for _ in range(self.board_size)]
-        board = self.boards.get(opponent_id, [["~"] * self.board_size for _ in range(self.board_size)])
-        view = [[(cell if cell in ("X", "O") else "~") for cell in row] for row in board]
-        return view
+            return {"error": "No opponent"}
+        self.game_state["state"] = "finished"
+        self.game_state["winner"] = opponent_id
+        self.forfeited_by = player_id
+        self.version += 1
+        self._record("forfeit", player_id)
+        return {"ok": True, "winner": opponent_id}
+
+    def random_target(self, shooter_id: str) -> tuple[int, int] | None:
+        """Pick a random cell of the opponent's board that has not been shot at yet."""
+        opponent_id = self._opponent_id(shooter_id)
+        board = self.boards.get(opponent_id) if opponent_id else None
+        if not board:
+            return None
+        size = self.board_size
+        for _ in range(32):
+            x, y = self.rng.randrange(size), self.rng.randrange(size)
+            if not board.is_shot(x, y):
+                return x, y
+        cells = [(x, y) for y in range(size) for x in range(size) if not board.is_shot(x, y)]
+        return self.rng.choice(cells) if cells else None
+
+    def get_opponent_view(self, player_id: str) -> list[list[str]] | dict:
+        """Return a view of the opponent's board where ships are hidden; only X and O are visible.
+
+        If there is no opponent, return a blank board view. Large boards use the same sparse form
+        as `get_board`.
+        """
+        return self.opponent_view(player_id).wire()
 
 
 class StartMenuOption(BaseModel):
@@ -193,3 +510,41 @@ class StartMenuOption(BaseModel):
 class Player(BaseModel):
     id: str
     websocket: Any
+
+
+class OptionMessage(BaseModel):
+    option: str
+    input: str | None = None
+    # only read when creating a game; the server's defaults apply when they are left out
+    board_size: int | None = None
+    fleet: list[int] | None = None
+
+
+class ActionMessage(BaseModel):
+    action: str
+
+
+class CoordsMessage(ActionMessage):
+    x: int
+    y: int
+
+
+class PlaceShipMessage(CoordsMessage):
+    vertical: bool = False
+
+
+class ShipPlacement(BaseModel):
+    x: int
+    y: int
+    length: int
+    vertical: bool = False
+
+
+class PlaceShipsMessage(ActionMessage):
+    ships: list[ShipPlacement]
+
+
+class ReplayMessage(ActionMessage):
+    replay_id: str
+    from_turn: int = 0
+    speed: float = 1.0
@@ -0,0 +1,229 @@
+import asyncio
+import json
+import os
+import struct
+from dataclasses import dataclass, field
+from typing import AsyncIterator
+
+from .board import Board
+from .models import Lobby, PlayerRef
+
+MAGIC = b"HTFR"
+FORMAT_VERSION = 2  # 1 stored each board as a bitmask of single-cell ships; still readable
+HEADER = struct.Struct("<4sBI")  # magic, format version, metadata length
+SHOT = struct.Struct("<IBHH")  # ms since the game started, shooter index, x, y
+EXTENSION = ".htfr"
+
+
+class ReplayError(ValueError):
+    """The replay is malformed or does not play back to a valid game."""
+
+
+@dataclass
+class Replay:
+    """A finished game: both starting boards, the placement seed and every shot with its timestamp.
+
+    On disk it is a fixed header, a JSON metadata block and then one fixed-size record per shot, so
+    turn `n` sits at a known offset (see `ReplayFile`). Shooters are stored as indexes into `players`,
+    whose first entry moves first.
+    """
+    lobby_id: str
+    players: list[str]
+    board_size: int
+    fleet: list[int]
+    seed: int
+    started_at: float
+    boards: dict[str, list[tuple[int, int, int, bool]]]  # {player_id: ship layout at the start of the game}
+    shots: list[tuple[int, int, int, int]] = field(default_factory=list)  # (ms, shooter, x, y)
+    winner: str | None = None
+    forfeited_by: str | None = None  # set when the game ended by forfeit after the last shot
+
+    @property
+    def turns(self) -> int:
+        return len(self.shots)
+
+    @property
+    def name(self) -> str:
+        return f"{self.lobby_id}-{int(self.started_at * 1000)}"
+
+    @classmethod
+    def from_lobby(cls, lobby: Lobby) -> "Replay":
+        if lobby.started_at is None:
+            raise ReplayError(f"Lobby {lobby.id} has not started a game")
+        players = [p.id for p in lobby.players]
+        return cls(
+            lobby_id=lobby.id,
+            players=players,
+            board_size=lobby.board_size,
+            fleet=list(lobby.fleet),
+            seed=lobby.seed,
+            started_at=lobby.started_at,
+            boards={player_id: lobby.initial_ships[player_id] for player_id in players},
+            shots=list(lobby.shots),
+            winner=lobby.game_state.get("winner"),
+            forfeited_by=lobby.forfeited_by,
+        )
+
+    def _metadata(self) -> bytes:
+        return json.dumps({
+            "lobby_id": self.lobby_id,
+            "players": self.players,
+            "board_size": self.board_size,
+            "fleet": self.fleet,
+            "seed": self.seed,
+            "started_at": self.started_at,
+            "winner": self.winner,
+            "forfeited_by": self.forfeited_by,
+            "boards": self.boards,
+        }, separators=(",", ":")).encode()
+
+    def encode(self) -> bytes:
+        metadata = self._metadata()
+        return b"".join([HEADER.pack(MAGIC, FORMAT_VERSION, len(metadata)), metadata,
+                         *(SHOT.pack(*shot) for shot in self.shots)])
+
+    @classmethod
+    def decode(cls, data: bytes) -> "Replay":
+        replay, offset = cls._decode_header(data)
+        if (len(data) - offset) % SHOT.size:
+            raise ReplayError("Truncated shot record")
+        replay.shots = list(SHOT.iter_unpack(memoryview(data)[offset:]))
+        return replay
+
+    @classmethod
+    def _decode_header(cls, data: bytes) -> tuple["Replay", int]:
+        if len(data) < HEADER.size:
+            raise ReplayError("Not a replay file")
+        magic, version, length = HEADER.unpack_from(data)
+        if magic != MAGIC:
+            raise ReplayError("Not a replay file")
+        if version not in (1, FORMAT_VERSION):
+            raise ReplayError(f"Unsupported replay format version {version}")
+        try:
+            meta = json.loads(data[HEADER.size:HEADER.size + length])
+        except ValueError as exc:
+            raise ReplayError(f"Corrupt replay metadata: {exc}") from None
+        size = meta["board_size"]
+        if version == 1:
+            fleet = [1] * meta["ships_required"]
+            boards = {player_id: Board.from_masks(size, int(mask, 16), 0, 0).layout()
+                      for player_id, mask in meta["boards"].items()}
+        else:
+            fleet = meta["fleet"]
+            boards = {player_id: [tuple(ship) for ship in layout] for player_id, layout in meta["boards"].items()}
+        replay = cls(
+            lobby_id=meta["lobby_id"],
+            players=meta["players"],
+            board_size=size,
+            fleet=fleet,
+            seed=meta["seed"],
+            started_at=meta["started_at"],
+            boards=boards,
+            winner=meta["winner"],
+            forfeited_by=meta.get("forfeited_by"),
+        )
+        return replay, HEADER.size + length
+
+    def new_lobby(self) -> Lobby:
+        """A lobby in the state the game started in, without journal or player index."""
+        return Lobby(
+            id=self.lobby_id,
+            isPublic=False,
+            owner_id=self.players[0],
+            players=[PlayerRef(id=player_id) for player_id in self.players],
+            game_state={"state": "playing", "turn": self.players[0], "winner": None},
+            board_size=self.board_size,
+            boards={player_id: Board.from_layout(self.board_size, layout)
+                    for player_id, layout in self.boards.items()},
+            fleet=list(self.fleet),
+            seed=self.seed,
+        )
+
+    def apply(self, lobby: Lobby, turn: int) -> dict:
+        """Play shot number `turn` on `lobby`. Raises ReplayError if the game would not accept it."""
+        _, shooter, x, y = self.shots[turn]
+        if shooter >= len(self.players):
+            raise ReplayError(f"Turn {turn}: unknown shooter {shooter}")
+        result = lobby.shoot(self.players[shooter], x, y)
+        if result.get("error") or result.get("already"):
+            raise ReplayError(f"Turn {turn}: {result.get('error') or 'cell was already shot'}")
+        return result
+
+    def run(self, until: int | None = None) -> Lobby:
+        """Play the first `until` shots (all by default) at full speed and return the lobby."""
+        lobby = self.new_lobby()
+        for turn in range(self.turns if until is None else min(until, self.turns)):
+            self.apply(lobby, turn)
+        return lobby
+
+    def verify(self) -> bool:
+        """Check that every shot is legal and the game ends with the recorded winner."""
+        try:
+            lobby = self.run()
+        except ReplayError:
+            return False
+        if self.forfeited_by is not None and lobby.forfeit(self.forfeited_by).get("error"):
+            return False
+        return lobby.game_state.get("winner") == self.winner
+
+    async def stream(self, speed: float = 1.0, from_turn: int = 0) -> AsyncIterator[tuple[int, Lobby]]:
+        """Yield (turns played, lobby) after each shot, keeping the original gaps divided by `speed`.
+
+        The first item is the position at `from_turn`, reached without waiting.
+        """
+        from_turn = min(max(from_turn, 0), self.turns)
+        lobby = self.run(until=from_turn)
+        yield from_turn, lobby
+        last = self.shots[from_turn - 1][0] if from_turn else 0
+        for turn in range(from_turn, self.turns):
+            elapsed = self.shots[turn][0]
+            await asyncio.sleep(max(0, elapsed - last) / 1000 / speed)
+            last = elapsed
+            self.apply(lobby, turn)
+            yield turn + 1, lobby
+        if self.forfeited_by is not None:
+            lobby.forfeit(self.forfeited_by)
+            yield self.turns, lobby
+
+
+class ReplayFile:
+    """Random access to a replay on disk: any turn is one seek away, without reading the rest."""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            head = f.read(HEADER.size)
+            if len(head) < HEADER.size:
+                raise ReplayError("Not a replay file")
+            _, _, length = HEADER.unpack(head)
+            self.replay, self.offset = Replay._decode_header(head + f.read(length))
+        self.turns = (os.path.getsize(path) - self.offset) // SHOT.size
+
+    def shots(self, start: int = 0, stop: int | None = None) -> list[tuple[int, int, int, int]]:
+        stop = self.turns if stop is None else min(stop, self.turns)
+        if start >= stop:
+            return []
+        with open(self.path, "rb") as f:
+            f.seek(self.offset + start * SHOT.size)
+            return list(SHOT.iter_unpack(f.read((stop - start) * SHOT.size)))
+
+    def shot(self, turn: int) -> tuple[int, int, int, int]:
+        shots = self.shots(turn, turn + 1)
+        if not shots:
+            raise IndexError(turn)
+        return shots[0]
+
+    def load(self) -> Replay:
+        """Read every shot into a Replay."""
+        self.replay.shots = self.shots()
+        return self.replay
+
+
+def save_replay(replay: Replay, directory: str) -> str:
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, replay.name + EXTENSION)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(replay.encode())
+    os.replace(tmp_path, path)
+    return path
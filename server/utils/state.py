@@ -0,0 +1,471 @@
+import asyncio
+import json
+import logging
+import os
+import random
+import socket
+import sqlite3
+import threading
+import time
+from collections import deque
+from collections.abc import MutableMapping
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Iterator
+
+logger = logging.getLogger("server")
+
+BUSY_TIMEOUT = 0.05  # seconds SQLite waits for another worker's write lock before the store retries
+MAX_RETRY_DELAY = 1.0  # longest pause between those retries
+CHANGE_RETENTION = 60  # seconds rows stay in the changes feed; a worker polls far more often
+
+
+def default_worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class StateStore:
+    """Lobby directory, player index, sessions and cross-worker messaging shared by all workers.
+
+    Live `Lobby` objects stay in the memory of the worker that created them (their home worker).
+    The store records which worker is home to each lobby, which lobby each player is in and which
+    worker holds each player's socket, so any worker can route a message to the right place.
+    `publish`/`receive` carry those messages between workers.
+
+    Calls that have to wait for an answer from the store (`receive`, `claim_role`, `reserve_ids`,
+    `sequence_key`) go through `call` or `submit` on the event loop, see SQLiteStore.
+    """
+
+    def __init__(self, worker_id: str | None = None):
+        self.worker_id = worker_id or default_worker_id()
+
+    # sessions: {player_id: worker_id}
+    def add_session(self, player_id: str, worker_id: str):
+        raise NotImplementedError
+
+    def remove_session(self, player_id: str):
+        raise NotImplementedError
+
+    def session_worker(self, player_id: str) -> str | None:
+        raise NotImplementedError
+
+    # lobby directory: {lobby_id: home worker_id}
+    def claim_lobby(self, lobby_id: str, worker_id: str) -> bool:
+        """Atomically reserve `lobby_id` for `worker_id`. Returns False if the id is already taken."""
+        raise NotImplementedError
+
+    def release_lobby(self, lobby_id: str):
+        raise NotImplementedError
+
+    def lobby_worker(self, lobby_id: str) -> str | None:
+        raise NotImplementedError
+
+    async def lookup_lobby(self, lobby_id: str) -> str | None:
+        """Like `lobby_worker`, but also finds lobbies other workers created since the last `poll`."""
+        return self.lobby_worker(lobby_id)
+
+    def player_index(self) -> MutableMapping[str, str]:
+        """The shared {player_id: lobby_id} mapping, see `LobbyManager.player_lobbies`."""
+        raise NotImplementedError
+
+    # id sequences: {sequence: (next value, key)}, see IdAllocator
+    def reserve_ids(self, sequence: str, count: int) -> int:
+        """Atomically advance `sequence` by `count` and return the first of the values reserved."""
+        raise NotImplementedError
+
+    def sequence_key(self, sequence: str) -> int:
+        """The random key of `sequence`, created on first use and the same for every worker."""
+        raise NotImplementedError
+
+    def claim_role(self, role: str, worker_id: str, lease: float) -> str:
+        """Take or renew `role` for `lease` seconds unless another worker holds an unexpired lease.
+
+        Returns the current holder. Holders renew periodically, so a dead worker's roles fail over.
+        """
+        raise NotImplementedError
+
+    # pub/sub, one channel per worker
+    def publish(self, worker_id: str, message: dict):
+        raise NotImplementedError
+
+    def receive(self, worker_id: str, limit: int = 500) -> list[dict]:
+        """Pop up to `limit` pending messages for `worker_id`, oldest first."""
+        raise NotImplementedError
+
+    async def poll(self, limit: int = 500) -> list[dict]:
+        """Pop this worker's pending messages like `receive`, and catch up on what other workers changed."""
+        return await self.call(self.receive, self.worker_id, limit)
+
+    def submit(self, fn: Callable, *args) -> Future:
+        """Start `fn(*args)`, a call into this store, where the store does its I/O and return its future.
+
+        Stores without I/O of their own run it right away.
+        """
+        future = Future()
+        try:
+            future.set_result(fn(*args))
+        except Exception as exc:
+            future.set_exception(exc)
+        return future
+
+    async def call(self, fn: Callable, *args):
+        """Await `fn(*args)`, a call into this store, without blocking the event loop."""
+        return await asyncio.wrap_future(self.submit(fn, *args))
+
+    def open(self):
+        """Start the store's I/O and load what it keeps in memory, before the first call into it."""
+
+    async def flush(self):
+        """Wait until the writes made so far are visible to the other workers."""
+
+    def close(self):
+        """Finish the writes still pending and let go of the store's resources."""
+
+
+class MemoryStore(StateStore):
+    """Plain dicts; only valid while a single worker process serves every connection."""
+
+    def __init__(self, worker_id: str | None = None):
+        super().__init__(worker_id)
+        self.sessions: dict[str, str] = {}
+        self.lobbies: dict[str, str] = {}
+        self.players: dict[str, str] = {}
+        self.roles: dict[str, tuple[str, float]] = {}  # {role: (worker_id, expires)}
+        self.channels: dict[str, deque] = {}
+        self.sequences: dict[str, list[int]] = {}  # {sequence: [next value, key]}
+
+    def add_session(self, player_id: str, worker_id: str):
+        self.sessions[player_id] = worker_id
+
+    def remove_session(self, player_id: str):
+        self.sessions.pop(player_id, None)
+
+    def session_worker(self, player_id: str) -> str | None:
+        return self.sessions.get(player_id)
+
+    def claim_lobby(self, lobby_id: str, worker_id: str) -> bool:
+        if lobby_id in self.lobbies:
+            return False
+        self.lobbies[lobby_id] = worker_id
+        return True
+
+    def release_lobby(self, lobby_id: str):
+        self.lobbies.pop(lobby_id, None)
+
+    def lobby_worker(self, lobby_id: str) -> str | None:
+        return self.lobbies.get(lobby_id)
+
+    def player_index(self) -> dict[str, str]:
+        return self.players
+
+    def _sequence(self, sequence: str) -> list[int]:
+        return self.sequences.setdefault(sequence, [0, random.getrandbits(62)])
+
+    def reserve_ids(self, sequence: str, count: int) -> int:
+        entry = self._sequence(sequence)
+        first = entry[0]
+        entry[0] += count
+        return first
+
+    def sequence_key(self, sequence: str) -> int:
+        return self._sequence(sequence)[1]
+
+    def claim_role(self, role: str, worker_id: str, lease: float) -> str:
+        now = time.time()
+        holder, expires = self.roles.get(role, (worker_id, 0.0))
+        if holder == worker_id or expires < now:
+            self.roles[role] = holder, expires = worker_id, now + lease
+        return holder
+
+    def publish(self, worker_id: str, message: dict):
+        self.channels.setdefault(worker_id, deque()).append(message)
+
+    def receive(self, worker_id: str, limit: int = 500) -> list[dict]:
+        channel = self.channels.get(worker_id)
+        messages = []
+        while channel and len(messages) < limit:
+            messages.append(channel.popleft())
+        return messages
+
+
+class _Mirror(MutableMapping):
+    """One {key: value} table of an SQLiteStore, read from a copy in this process.
+
+    Writes change the copy at once and are written behind on the store thread; what other workers
+    write reaches the copy through `SQLiteStore.poll`.
+    """
+
+    def __init__(self, store: "SQLiteStore", table: str):
+        self.store = store
+        self.table = table
+        self.data: dict[str, str] = {}
+
+    def __getitem__(self, key: str) -> str:
+        return self.data[key]
+
+    def get(self, key: str, default=None):
+        return self.data.get(key, default)
+
+    def __contains__(self, key) -> bool:
+        return key in self.data
+
+    def __setitem__(self, key: str, value: str):
+        self.data[key] = value
+        self.store._write_behind(self.table, key, value)
+
+    def __delitem__(self, key: str):
+        del self.data[key]
+        self.store._write_behind(self.table, key, None)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.data)
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+
+class SQLiteStore(StateStore):
+    """State shared between worker processes through one SQLite database in WAL mode.
+
+    The database is only touched by a thread of the store's own, so a slow disk or a write lock
+    held by another worker never stalls the event loop. Sessions, the lobby directory and the player
+    index are mirrored in memory: reads never reach the database, writes change the mirror at once
+    and are committed behind it in order, each with a row in the `changes` feed. `poll` applies the
+    other workers' rows from that feed, so every mirror follows the database within a poll.
+
+    Lobby ids come from a counter shared by all workers (see IdAllocator), so no two workers claim
+    the same id at once and `claim_lobby` only checks the mirror for ids still held from before the
+    counter wrapped.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS sessions (player_id TEXT PRIMARY KEY, worker_id TEXT NOT NULL);
+        CREATE TABLE IF NOT EXISTS lobbies (lobby_id TEXT PRIMARY KEY, worker_id TEXT NOT NULL);
+        CREATE TABLE IF NOT EXISTS players (player_id TEXT PRIMARY KEY, lobby_id TEXT NOT NULL);
+        CREATE TABLE IF NOT EXISTS roles (role TEXT PRIMARY KEY, worker_id TEXT NOT NULL, expires REAL NOT NULL);
+        CREATE TABLE IF NOT EXISTS sequences (sequence TEXT PRIMARY KEY, next INTEGER NOT NULL, key INTEGER NOT NULL);
+        CREATE TABLE IF NOT EXISTS messages (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                                             worker_id TEXT NOT NULL, payload TEXT NOT NULL);
+        CREATE INDEX IF NOT EXISTS messages_by_worker ON messages (worker_id, id);
+        CREATE TABLE IF NOT EXISTS changes (id INTEGER PRIMARY KEY AUTOINCREMENT, worker_id TEXT NOT NULL,
+                                            at REAL NOT NULL, tbl TEXT NOT NULL, key TEXT NOT NULL, value TEXT);
+    """
+    # mirrored tables: {table: (key column, value column)}
+    MIRRORED = {"sessions": ("player_id", "worker_id"), "lobbies": ("lobby_id", "worker_id"),
+                "players": ("player_id", "lobby_id")}
+
+    def __init__(self, path: str, worker_id: str | None = None):
+        super().__init__(worker_id)
+        self.path = path
+        self.db: sqlite3.Connection | None = None  # only used on the store thread
+        self._pool: ThreadPoolExecutor | None = None
+        self._pid: int | None = None
+        self._thread: int | None = None
+        self._seen = 0  # last row of the changes feed applied to the mirrors
+        self._pruned = 0.0
+        self._writes: deque[Callable[[sqlite3.Connection], object]] = deque()  # see _background
+        self.sessions = _Mirror(self, "sessions")
+        self.lobbies = _Mirror(self, "lobbies")
+        self.players = _Mirror(self, "players")
+
+    def open(self):
+        # the store thread starts here rather than in __init__, so the server can fork first, see TargetingPool
+        for table, rows in self.submit(self._load).result().items():
+            getattr(self, table).data.update(rows)
+
+    @property
+    def _executor(self) -> ThreadPoolExecutor:
+        # one thread per process, started again after a fork
+        if self._pool is None or self._pid != os.getpid():
+            self._pool = ThreadPoolExecutor(1, thread_name_prefix="state-store", initializer=self._connect)
+            self._pid = os.getpid()
+        return self._pool
+
+    def _connect(self):
+        self._thread = threading.get_ident()
+        self.db = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT)
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self._transact(lambda db: db.execute("PRAGMA journal_mode=WAL"))
+        self._transact(lambda db: db.executescript(self.SCHEMA))
+
+    def submit(self, fn: Callable, *args) -> Future:
+        return self._executor.submit(fn, *args)
+
+    async def flush(self):
+        await self.call(self._flush)
+
+    def close(self):
+        if self._pool is not None and self._pid == os.getpid():
+            self._pool.submit(lambda: self.db.close())
+            self._pool.shutdown()
+            self._pool = None
+
+    def _on_thread(self, fn: Callable, *args):
+        """Run `fn(*args)` on the store thread and wait for it, inline when already there."""
+        if threading.get_ident() == self._thread:
+            return fn(*args)
+        return self.submit(fn, *args).result()
+
+    def _transact(self, work: Callable[[sqlite3.Connection], object]):
+        """Run `work(db)` in one transaction, retrying while another worker holds the write lock."""
+        delay = BUSY_TIMEOUT
+        while True:
+            try:
+                with self.db:
+                    return work(self.db)
+            except sqlite3.OperationalError as exc:
+                if "locked" not in str(exc) and "busy" not in str(exc):
+                    raise
+            time.sleep(delay)
+            delay = min(delay * 2, MAX_RETRY_DELAY)
+
+    def _background(self, work: Callable[[sqlite3.Connection], object]):
+        """Queue a write; the store thread commits everything queued by then in one transaction."""
+        self._writes.append(work)
+        if len(self._writes) == 1:
+            self.submit(self._flush)
+
+    def _flush(self):
+        works = []
+        while self._writes:
+            works.append(self._writes.popleft())
+
+        def write(db):
+            for work in works:
+                work(db)
+        try:
+            self._transact(write)
+        except Exception as exc:
+            logger.error(f"State store lost {len(works)} writes: {exc}")
+
+    def _load(self) -> dict[str, dict[str, str]]:
+        def read(db):
+            db.execute("BEGIN")  # one snapshot for the tables and the position in the feed
+            self._seen = db.execute("SELECT COALESCE(MAX(id), 0) FROM changes").fetchone()[0]
+            return {table: dict(db.execute(f"SELECT {key}, {value} FROM {table}"))
+                    for table, (key, value) in self.MIRRORED.items()}
+        return self._transact(read)
+
+    def _write_behind(self, table: str, key: str, value: str | None):
+        key_column, value_column = self.MIRRORED[table]
+
+        def write(db):
+            if value is None:
+                db.execute(f"DELETE FROM {table} WHERE {key_column} = ?", (key,))
+            else:
+                db.execute(f"INSERT OR REPLACE INTO {table} ({key_column}, {value_column}) VALUES (?, ?)",
+                           (key, value))
+            db.execute("INSERT INTO changes (worker_id, at, tbl, key, value) VALUES (?, ?, ?, ?, ?)",
+                       (self.worker_id, time.time(), table, key, value))
+        self._background(write)
+
+    def add_session(self, player_id: str, worker_id: str):
+        self.sessions[player_id] = worker_id
+
+    def remove_session(self, player_id: str):
+        self.sessions.pop(player_id, None)
+
+    def session_worker(self, player_id: str) -> str | None:
+        return self.sessions.get(player_id)
+
+    def claim_lobby(self, lobby_id: str, worker_id: str) -> bool:
+        if lobby_id in self.lobbies:
+            return False
+        self.lobbies[lobby_id] = worker_id
+        return True
+
+    def release_lobby(self, lobby_id: str):
+        self.lobbies.pop(lobby_id, None)
+
+    def lobby_worker(self, lobby_id: str) -> str | None:
+        return self.lobbies.get(lobby_id)
+
+    async def lookup_lobby(self, lobby_id: str) -> str | None:
+        worker_id = self.lobbies.get(lobby_id)
+        if worker_id is None:
+            row = await self.call(self._transact, lambda db: db.execute(
+                "SELECT worker_id FROM lobbies WHERE lobby_id = ?", (lobby_id,)).fetchone())
+            worker_id = row[0] if row else None
+        return worker_id
+
+    def player_index(self) -> MutableMapping[str, str]:
+        return self.players
+
+    @staticmethod
+    def _create_sequence(db: sqlite3.Connection, sequence: str):
+        db.execute("INSERT OR IGNORE INTO sequences (sequence, next, key) VALUES (?, 0, ?)",
+                   (sequence, random.getrandbits(62)))
+
+    def reserve_ids(self, sequence: str, count: int) -> int:
+        def reserve(db):
+            self._create_sequence(db, sequence)
+            # the update takes the write lock, so the read below sees our own increment only
+            db.execute("UPDATE sequences SET next = next + ? WHERE sequence = ?", (count, sequence))
+            return db.execute("SELECT next FROM sequences WHERE sequence = ?", (sequence,)).fetchone()[0] - count
+        return self._on_thread(self._transact, reserve)
+
+    def sequence_key(self, sequence: str) -> int:
+        def key(db):
+            self._create_sequence(db, sequence)
+            return db.execute("SELECT key FROM sequences WHERE sequence = ?", (sequence,)).fetchone()[0]
+        return self._on_thread(self._transact, key)
+
+    def claim_role(self, role: str, worker_id: str, lease: float) -> str:
+        def claim(db):
+            now = time.time()
+            db.execute("INSERT INTO roles (role, worker_id, expires) VALUES (?, ?, ?) "
+                       "ON CONFLICT (role) DO UPDATE SET worker_id = excluded.worker_id, "
+                       "expires = excluded.expires WHERE roles.worker_id = excluded.worker_id "
+                       "OR roles.expires < ?", (role, worker_id, now + lease, now))
+            return db.execute("SELECT worker_id FROM roles WHERE role = ?", (role,)).fetchone()[0]
+        return self._on_thread(self._transact, claim)
+
+    def publish(self, worker_id: str, message: dict):
+        payload = json.dumps(message, separators=(",", ":"))
+        self._background(lambda db: db.execute("INSERT INTO messages (worker_id, payload) VALUES (?, ?)",
+                                               (worker_id, payload)))
+
+    @staticmethod
+    def _pop_messages(db: sqlite3.Connection, worker_id: str, limit: int) -> list[dict]:
+        rows = db.execute("SELECT id, payload FROM messages WHERE worker_id = ? ORDER BY id LIMIT ?",
+                          (worker_id, limit)).fetchall()
+        if rows:
+            db.execute("DELETE FROM messages WHERE worker_id = ? AND id <= ?", (worker_id, rows[-1][0]))
+        return [json.loads(payload) for _, payload in rows]
+
+    def receive(self, worker_id: str, limit: int = 500) -> list[dict]:
+        return self._on_thread(self._transact, lambda db: self._pop_messages(db, worker_id, limit))
+
+    async def poll(self, limit: int = 500) -> list[dict]:
+        seen, changes, messages = await self.call(self._transact, lambda db: self._fetch(db, limit))
+        self._seen = seen
+        # applied here, on the event loop, which is the only place the mirrors change otherwise
+        for table, key, value in changes:
+            data = getattr(self, table).data
+            if value is None:
+                data.pop(key, None)
+            else:
+                data[key] = value
+        return messages
+
+    def _fetch(self, db: sqlite3.Connection, limit: int) -> tuple[int, list[tuple], list[dict]]:
+        # the feed is read in the same transaction as the messages, so a message never arrives
+        # ahead of an index change its sender made before sending it
+        db.execute("BEGIN")
+        rows = db.execute("SELECT id, worker_id, tbl, key, value FROM changes WHERE id > ? ORDER BY id",
+                          (self._seen,)).fetchall()
+        messages = self._pop_messages(db, self.worker_id, limit)
+        now = time.time()
+        if now - self._pruned > CHANGE_RETENTION / 2:
+            db.execute("DELETE FROM changes WHERE at < ?", (now - CHANGE_RETENTION,))
+            self._pruned = now
+        # this worker's own rows are in its mirrors already
+        changes = [(table, key, value) for _, worker_id, table, key, value in rows if worker_id != self.worker_id]
+        return rows[-1][0] if rows else self._seen, changes, messages
+
+
+def make_store(backend: str, path: str | None = None, worker_id: str | None = None) -> StateStore:
+    if backend == "memory":
+        return MemoryStore(worker_id)
+    if backend == "sqlite":
+        return SQLiteStore(path or "hackthefleet-state.db", worker_id)
+    raise ValueError(f"Unknown state backend {backend!r}")
@@ -0,0 +1,121 @@
+import asyncio
+import inspect
+import logging
+import math
+import time
+from typing import Any, Callable, Hashable
+
+logger = logging.getLogger("server")
+
+
+class Timer:
+    __slots__ = ("key", "slot", "callback", "args")
+
+    def __init__(self, key: tuple, slot: int, callback: Callable[..., Any], args: tuple):
+        self.key = key
+        self.slot = slot
+        self.callback = callback
+        self.args = args
+
+
+class TimerService:
+    """Every game timer of this worker on one timing wheel, driven by a single task.
+
+    Timers are named by a key `(group, name)`, e.g. `(lobby_id, "turn")`. Scheduling a key that is
+    already pending replaces it, so there is at most one timer per key and a stale one can never
+    fire. Adding and cancelling are O(1); `cancel_group` drops every timer of a lobby at once.
+
+    Like HeartbeatTracker, deadlines are rounded up to `resolution` seconds and bucketed per slot, so
+    a tick only visits the slots that came due. A callback may be a plain function or a coroutine
+    function; coroutines are started as tasks so a slow one never holds up the wheel.
+    """
+
+    def __init__(self, resolution: float = 0.05):
+        self.resolution = resolution
+        self.timers: dict[tuple, Timer] = {}
+        self.slots: dict[int, dict[tuple, Timer]] = {}  # {slot: {key: timer}}
+        self.groups: dict[Hashable, set[tuple]] = {}  # {group: {key, ...}}
+        self._cursor: int | None = None  # first slot not yet checked by due()
+
+    def __len__(self) -> int:
+        return len(self.timers)
+
+    def __contains__(self, key: tuple) -> bool:
+        return key in self.timers
+
+    def schedule(self, key: tuple, delay: float, callback: Callable[..., Any], *args,
+                 now: float | None = None) -> Timer:
+        """Call `callback(*args)` in `delay` seconds, replacing any timer pending under `key`."""
+        now = time.time() if now is None else now
+        self.cancel(key)
+        if self._cursor is None or not self.timers:
+            self._cursor = math.floor(now / self.resolution)
+        slot = max(math.ceil((now + delay) / self.resolution), self._cursor)
+        timer = Timer(key, slot, callback, args)
+        self.timers[key] = timer
+        self.slots.setdefault(slot, {})[key] = timer
+        self.groups.setdefault(key[0], set()).add(key)
+        return timer
+
+    def cancel(self, key: tuple) -> bool:
+        timer = self.timers.pop(key, None)
+        if timer is None:
+            return False
+        members = self.slots.get(timer.slot)
+        if members is not None:
+            members.pop(key, None)
+            if not members:
+                del self.slots[timer.slot]
+        self._forget(key)
+        return True
+
+    def cancel_group(self, group: Hashable) -> int:
+        """Cancel every timer whose key starts with `group`. Returns how many were pending."""
+        keys = list(self.groups.get(group, ()))
+        for key in keys:
+            self.cancel(key)
+        return len(keys)
+
+    def _forget(self, key: tuple):
+        keys = self.groups.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self.groups[key[0]]
+
+    def due(self, now: float | None = None) -> list[Timer]:
+        """Remove and return the timers whose deadline has passed, earliest first."""
+        now = time.time() if now is None else now
+        if self._cursor is None:
+            return []
+        current = math.floor(now / self.resolution)
+        fired = []
+        if self.slots:
+            for slot in range(self._cursor, current + 1):
+                members = self.slots.pop(slot, None)
+                if members:
+                    for key, timer in members.items():
+                        del self.timers[key]
+                        self._forget(key)
+                    fired.extend(members.values())
+        self._cursor = max(self._cursor, current + 1)
+        return fired
+
+    def fire(self, timer: Timer):
+        try:
+            result = timer.callback(*timer.args)
+            if inspect.isawaitable(result):
+                asyncio.ensure_future(result).add_done_callback(self._report)
+        except Exception as exc:
+            logger.error(f"Timer {timer.key} failed: {exc}")
+
+    @staticmethod
+    def _report(task: asyncio.Future):
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Timer task failed: {task.exception()}")
+
+    async def run(self):
+        while True:
+            for timer in self.due():
+                self.fire(timer)
+            await asyncio.sleep(self.resolution)